@@ -26,8 +26,13 @@ def define_model(input_size=776):
 
 def evaluate(model, dataset_path):
     print("Loading the dataset...")
-    batch = torch.load(dataset_path)
-    val_ds, val_bl, val_indices = batch
+    if os.path.isdir(dataset_path):
+        val_ds = ShardedDataset(dataset_path, shuffle=False).load_all()
+        val_bl = val_ds[:]
+        val_indices = list(range(len(val_ds)))
+    else:
+        batch = torch.load(dataset_path)
+        val_ds, val_bl, val_indices = batch
     print("Evaluation...")
     val_df = get_results_df(val_ds, val_bl, val_indices, model, train_device="cpu")
     val_scores = get_scores(val_df)
@@ -58,8 +63,10 @@ def main(conf):
             dataset_path = os.path.join(
                 conf.experiment.base_path,
                 f"dataset/{dataset}",
-                f"{conf.data_generation.dataset_name}.pt",
+                conf.data_generation.dataset_name,
             )
+            if not os.path.isdir(dataset_path):
+                dataset_path += ".pt"
             scores = evaluate(model, dataset_path)
             print(scores)
 
@@ -7,10 +7,58 @@ from utils.modeling import *
 from utils.train_utils import *
 
 
+def generate_dataset_shards(conf):
+    """Converts the benchmark, validation and training datasets into shards,
+    reading the programs one at a time.
+
+    The shards of a dataset are written into the directory
+    `dataset/{bench,valid,train}/{dataset_name}/`, next to its manifest.
+
+    Args:
+        conf (RecursiveLSTMConfig): The configuration of the repository.
+    """
+    for split, dataset_file, max_batch_size, drop_prog_func in [
+        ("bench", conf.data_generation.benchmark_dataset_file, 1, None),
+        (
+            "valid",
+            conf.data_generation.valid_dataset_file,
+            conf.data_generation.batch_size,
+            drop_program,
+        ),
+        (
+            "train",
+            conf.data_generation.train_dataset_file,
+            conf.data_generation.batch_size,
+            drop_program,
+        ),
+    ]:
+        print("streaming batches from: " + dataset_file)
+        build_dataset_shards(
+            dataset_file,
+            os.path.join(
+                conf.experiment.base_path,
+                f"dataset/{split}",
+                conf.data_generation.dataset_name,
+            ),
+            max_batch_size,
+            drop_sched_func=drop_schedule,
+            drop_prog_func=drop_prog_func,
+            can_set_default_eval=default_eval,
+            speedups_clip_func=speedup_clip,
+            shard_size=conf.data_generation.shard_size,
+            max_buffered_datapoints=conf.data_generation.max_buffered_datapoints,
+            nb_processes=conf.data_generation.nb_processes,
+        )
+
+
 @hydra.main(config_path="conf", config_name="config")
 def generate_datasets(conf):
     """Converts and split into batches the validation and training dataset.
 
+    The batches of a dataset are written in the columnar format of
+    build_dataset_shards, into the directory
+    `dataset/{bench,valid,train}/{dataset_name}/`.
+
     Args:
         conf (RecursiveLSTMConfig): The configuration of the repository.
     """
@@ -18,8 +66,12 @@ def generate_datasets(conf):
     if not os.path.exists(dataset_path):
         os.makedirs(dataset_path)
 
+    if conf.data_generation.streaming:
+        generate_dataset_shards(conf)
+        return
+
     # benchmark
-    bench_ds, bench_bl, bench_indices, _, _ = load_data(
+    bench_ds, _, _, _, _ = load_data(
         conf.data_generation.benchmark_dataset_file,
         split_ratio=1,
         max_batch_size=1,
@@ -27,24 +79,19 @@ def generate_datasets(conf):
         drop_prog_func=None,
         default_eval=default_eval,
         speedups_clip_func=speedup_clip,
-        store_device="cuda:0",
-        train_device="cuda:0",
+        nb_processes=conf.data_generation.nb_processes,
     )
-    benchmark_dataset_path = os.path.join(conf.experiment.base_path, "dataset/bench")
-    if not os.path.exists(benchmark_dataset_path):
-        os.makedirs(benchmark_dataset_path)
-    with open(
+    save_dataset_shards(
+        bench_ds,
         os.path.join(
             conf.experiment.base_path,
-            "dataset/bench/",
-            f"{conf.data_generation.dataset_name}.pt",
+            "dataset/bench",
+            conf.data_generation.dataset_name,
         ),
-        "wb",
-    ) as bench_bl_pickle_file:
-        torch.save([bench_ds, bench_bl, bench_indices], bench_bl_pickle_file)
+    )
 
     # Validation
-    valid_ds, _, _, valid_bl, valid_indices = load_data(
+    valid_ds, _, _, _, _ = load_data(
         conf.data_generation.valid_dataset_file,
         split_ratio=0,
         max_batch_size=conf.data_generation.batch_size,
@@ -52,22 +99,19 @@ def generate_datasets(conf):
         drop_prog_func=drop_program,
         default_eval=default_eval,
         speedups_clip_func=speedup_clip,
+        nb_processes=conf.data_generation.nb_processes,
     )
-    validation_dataset_path = os.path.join(conf.experiment.base_path, "dataset/valid")
-    if not os.path.exists(validation_dataset_path):
-        os.makedirs(validation_dataset_path)
-    with open(
+    save_dataset_shards(
+        valid_ds,
         os.path.join(
             conf.experiment.base_path,
-            "dataset/valid/",
-            f"{conf.data_generation.dataset_name}.pt",
+            "dataset/valid",
+            conf.data_generation.dataset_name,
         ),
-        "wb",
-    ) as valid_bl_pickle_file:
-        torch.save([valid_ds, valid_bl, valid_indices], valid_bl_pickle_file)
+    )
 
     # Training
-    train_ds, _, _, train_bl, train_indices = load_data(
+    train_ds, _, _, _, _ = load_data(
         conf.data_generation.train_dataset_file,
         split_ratio=0,
         max_batch_size=conf.data_generation.batch_size,
@@ -75,20 +119,17 @@ def generate_datasets(conf):
         drop_prog_func=drop_program,
         default_eval=default_eval,
         speedups_clip_func=speedup_clip,
+        nb_processes=conf.data_generation.nb_processes,
     )
 
-    training_dataset_path = os.path.join(conf.experiment.base_path, "dataset/train")
-    if not os.path.exists(training_dataset_path):
-        os.makedirs(training_dataset_path)
-    with open(
+    save_dataset_shards(
+        train_ds,
         os.path.join(
             conf.experiment.base_path,
-            "dataset/train/",
-            f"{conf.data_generation.dataset_name}.pt",
+            "dataset/train",
+            conf.data_generation.dataset_name,
         ),
-        "wb",
-    ) as train_bl_pickle_file:
-        torch.save([train_ds, train_bl, train_indices], train_bl_pickle_file)
+    )
 
 
 if __name__ == "__main__":
@@ -11,7 +11,31 @@ from utils.modeling import *
 from utils.train_utils import *
 
 
-def read_datasets(config):
+def read_datasets(config, train_device="cpu"):
+    train_dir = os.path.join(
+        config.experiment.base_path,
+        "dataset/train",
+        config.data_generation.dataset_name,
+    )
+    valid_dir = os.path.join(
+        config.experiment.base_path,
+        "dataset/valid",
+        config.data_generation.dataset_name,
+    )
+    if os.path.isdir(train_dir) and os.path.isdir(valid_dir):
+        # Only the manifests are read, the batches are memory mapped. The
+        # training batches are made again at every epoch.
+        bl_dict = {
+            "train": ShardedDataset(train_dir, train_device=train_device).get_data_loader(
+                config.data_generation.batch_size
+            ),
+            "val": ShardedDataset(valid_dir, train_device=train_device).get_data_loader(
+                config.data_generation.batch_size, shuffle=False
+            ),
+        }
+        return bl_dict
+
+    # Datasets generated in the former single file format
     path = os.path.join(
         config.experiment.base_path,
         "dataset/valid",
@@ -49,9 +73,9 @@ def main(config: RecursiveLSTMConfig):
     logging.info(f"Starting experiment {config.experiment.name}")
     
     # Reading data
-    logging.info("Reading the dataset")
-    bl_dict = read_datasets(config)
     train_device = "cuda:0"
+    logging.info("Reading the dataset")
+    bl_dict = read_datasets(config, train_device)
 
     # Defining the model
     logging.info("Defining the model")
@@ -93,6 +117,7 @@ def main(config: RecursiveLSTMConfig):
         logger=logger,
         log_every=1,
         train_device=train_device,
+        async_copy=config.training.async_copy,
     )
 
 
@@ -1,5 +1,5 @@
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Optional
 @dataclass
 class ExperimentConfig:
     name: str = "base-model"
@@ -13,6 +13,10 @@ class DataGenerationConfig:
     benchmark_dataset_file: str = "./datasets/benchmarks_mats1.pkl"
     dataset_name: str = "dataset"
     batch_size: int = 1024
+    streaming: bool = False
+    shard_size: int = 65536
+    max_buffered_datapoints: Optional[int] = None
+    nb_processes: int = 1
 
 
 @dataclass
@@ -20,6 +24,7 @@ class TrainConfig:
     log_file: str = "log.txt"
     lr: float = 0.001
     max_epochs: int = 1000
+    async_copy: bool = False
 
 
 @dataclass
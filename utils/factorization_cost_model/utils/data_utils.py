@@ -1,8 +1,13 @@
 import copy
+import itertools
 import json
+import math
+import multiprocessing
+import os
 import pickle
 import random
 import re
+from collections import OrderedDict
 
 import numpy as np
 import pandas as pd
@@ -52,6 +57,7 @@ def load_data(
     speedups_clip_func=None,
     store_device="cpu",
     train_device="cpu",
+    nb_processes=1,
 ):
     print("loading batches from: " + train_val_dataset_file)
     dataset = Dataset(
@@ -63,6 +69,7 @@ def load_data(
         speedups_clip_func,
         store_device=store_device,
         train_device=train_device,
+        nb_processes=nb_processes,
     )
     if split_ratio == None:
         split_ratio = 0.2
@@ -269,111 +276,190 @@ def get_representation_template(program_dict, max_depth, train_device="cpu"):
     )
 
 
-def get_schedule_representation(
+def get_representation_indices(
     program_json,
-    schedule_json,
     comps_repr_templates_list,
     loops_repr_templates_list,
     comps_placeholders_indices_dict,
     loops_placeholders_indices_dict,
-    max_depth,
 ):
-
-    comps_repr = copy.deepcopy(comps_repr_templates_list)
-    loops_repr = copy.deepcopy(loops_repr_templates_list)
-
+    """Precomputes the positions of the placeholders of the templates of a
+    program, to fill the representations of its schedules with array
+    assignments.
+
+    Args:
+        program_json (dict): The annotation of the program.
+        comps_repr_templates_list (list): The template of each computation.
+        loops_repr_templates_list (list): The template of each loop.
+        comps_placeholders_indices_dict (dict): The position of each placeholder in the computation templates.
+        loops_placeholders_indices_dict (dict): The position of each placeholder in the loop templates.
+
+    Returns:
+        dict: The templates as arrays with zeros in place of the placeholders, and the positions of the placeholders.
+    """
     computations_dict = program_json["computations"]
     ordered_comp_list = sorted(
         list(computations_dict.keys()),
         key=lambda x: computations_dict[x]["absolute_order"],
     )
 
-    padded_tranf_mat_per_comp = dict()
+    def get_base(templates_list):
+        return np.array(
+            [
+                [0 if isinstance(element, str) else element for element in template]
+                for template in templates_list
+            ],
+            dtype=np.float32,
+        )
 
+    def get_positions(placeholders, placeholders_indices_dict):
+        positions = np.array(
+            [placeholders_indices_dict[placeholder] for placeholder in placeholders],
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        return positions[:, 0], positions[:, 1]
+
+    def get_ranges(placeholders, placeholders_indices_dict):
+        rows = []
+        cols = []
+        for start_placeholder, end_placeholder in placeholders:
+            start = placeholders_indices_dict[start_placeholder]
+            end = placeholders_indices_dict[end_placeholder]
+            rows.extend([start[0]] * (end[1] - start[1] + 1))
+            cols.extend(range(start[1], end[1] + 1))
+        return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+    # The values of the placeholders are computed in the order of these lists
+    comps_placeholders = []
     for comp_index, comp_name in enumerate(ordered_comp_list):
-        comp_dict = program_json["computations"][comp_name]
-        comp_schedule_dict = schedule_json[comp_name]
         c_code = "C" + str(comp_index)
+        for iter_i in range(len(computations_dict[comp_name]["iterators"])):
+            l_code = c_code + "-L" + str(iter_i)
+            comps_placeholders.extend(
+                [
+                    l_code + "Parallelized",
+                    l_code + "Tiled",
+                    l_code + "TileFactor",
+                    l_code + "Fused",
+                ]
+            )
+        comps_placeholders.extend([c_code + "-Unrolled", c_code + "-UnrollFactor"])
+    loops_placeholders = []
+    for loop_name in program_json["iterators"]:
+        l_code = "L" + loop_name
+        loops_placeholders.extend(
+            [
+                l_code + "Parallelized",
+                l_code + "Tiled",
+                l_code + "TileFactor",
+                l_code + "Unrolled",
+                l_code + "UnrollFactor",
+                l_code + "Fused",
+            ]
+        )
 
-        fused_levels = []
-        if "fusions" in schedule_json and schedule_json["fusions"]:
-            for fusion in schedule_json["fusions"]:
+    mat_start = comps_placeholders_indices_dict["C0-TransformationMatrixStart"]
+    mat_end = comps_placeholders_indices_dict["C0-TransformationMatrixEnd"]
+    nb_mat_elements = mat_end[1] - mat_start[1] + 1
+    return {
+        "ordered_comp_list": ordered_comp_list,
+        "comps_base": get_base(comps_repr_templates_list),
+        "loops_base": get_base(loops_repr_templates_list),
+        "comps_positions": get_positions(
+            comps_placeholders, comps_placeholders_indices_dict
+        ),
+        "loops_positions": get_positions(
+            loops_placeholders, loops_placeholders_indices_dict
+        ),
+        "comps_matrix_positions": get_ranges(
+            [
+                (
+                    "C" + str(comp_index) + "-TransformationMatrixStart",
+                    "C" + str(comp_index) + "-TransformationMatrixEnd",
+                )
+                for comp_index in range(len(ordered_comp_list))
+            ],
+            comps_placeholders_indices_dict,
+        ),
+        "loops_matrix_positions": get_ranges(
+            [
+                ("L" + loop_name + "TransfMatRowStart", "L" + loop_name + "TransfMatRowEnd")
+                for loop_name in program_json["iterators"]
+            ]
+            + [
+                ("L" + loop_name + "TransfMatColStart", "L" + loop_name + "TransfMatColEnd")
+                for loop_name in program_json["iterators"]
+            ],
+            loops_placeholders_indices_dict,
+        ),
+        "nb_mat_elements": nb_mat_elements,
+        "max_depth": int(np.sqrt(nb_mat_elements / MAX_MATRICES)) - 1,
+    }
+
+
+def get_schedule_values(program_json, schedule_json, representation_indices):
+    """Computes the values of the placeholders of a schedule, in the order of
+    the positions of get_representation_indices.
+
+    Raises:
+        NbMatricesException: If the schedule has too many transformation matrices.
+        AssertionError: If the schedules of the computations are inconsistent.
+
+    Returns:
+        tuple: The values of the computation placeholders, of the computation matrices, of the loop placeholders and of the loop matrices.
+    """
+    computations_dict = program_json["computations"]
+    ordered_comp_list = representation_indices["ordered_comp_list"]
+    max_depth = representation_indices["max_depth"]
+    nb_mat_elements = representation_indices["nb_mat_elements"]
+
+    # The matrix only depends on the schedule of the first computation, it is
+    # the same for all the computations
+    padded_matrix = get_padded_transformation_matrix(
+        program_json, schedule_json, ordered_comp_list[0], max_depth
+    )
+    padded_matrix_values = padded_matrix.flatten()
+    assert len(padded_matrix_values) == nb_mat_elements
+    padded_tranf_mat = padded_matrix[0, :].reshape(max_depth + 1, max_depth + 1)
 
+    fused_levels_per_comp = {comp_name: [] for comp_name in ordered_comp_list}
+    if "fusions" in schedule_json and schedule_json["fusions"]:
+        for fusion in schedule_json["fusions"]:
+            for comp_name in ordered_comp_list:
                 if comp_name in fusion:
-                    fused_levels.append(fusion[2])
+                    fused_levels_per_comp[comp_name].append(fusion[2])
 
+    comps_values = []
+    for comp_name in ordered_comp_list:
+        comp_dict = computations_dict[comp_name]
+        comp_schedule_dict = schedule_json[comp_name]
+        tiling = comp_schedule_dict["tiling"]
         for iter_i, iterator_name in enumerate(comp_dict["iterators"]):
-
-            l_code = c_code + "-L" + str(iter_i)
-
-            parallelized = 0
-            if iterator_name == comp_schedule_dict["parallelized_dim"]:
-                parallelized = 1
-            p_index = comps_placeholders_indices_dict[l_code + "Parallelized"]
-            comps_repr[p_index[0]][p_index[1]] = parallelized
-
             tiled = 0
             tile_factor = 0
-            if comp_schedule_dict["tiling"] and (
-                iterator_name in comp_schedule_dict["tiling"]["tiling_dims"]
-            ):
+            if tiling and (iterator_name in tiling["tiling_dims"]):
                 tiled = 1
-                tile_factor_index = comp_schedule_dict["tiling"]["tiling_dims"].index(
-                    iterator_name
-                )
                 tile_factor = int(
-                    comp_schedule_dict["tiling"]["tiling_factors"][tile_factor_index]
+                    tiling["tiling_factors"][tiling["tiling_dims"].index(iterator_name)]
                 )
-            p_index = comps_placeholders_indices_dict[l_code + "Tiled"]
-            comps_repr[p_index[0]][p_index[1]] = tiled
-            p_index = comps_placeholders_indices_dict[l_code + "TileFactor"]
-            comps_repr[p_index[0]][p_index[1]] = tile_factor
-
-            fused = 0
-            if iter_i in fused_levels:
-                fused = 1
-            p_index = comps_placeholders_indices_dict[l_code + "Fused"]
-            comps_repr[p_index[0]][p_index[1]] = fused
-
-        unrolled = 0
-        unroll_factor = 0
+            comps_values.extend(
+                [
+                    int(iterator_name == comp_schedule_dict["parallelized_dim"]),
+                    tiled,
+                    tile_factor,
+                    int(iter_i in fused_levels_per_comp[comp_name]),
+                ]
+            )
         if comp_schedule_dict["unrolling_factor"]:
-            unrolled = 1
-            unroll_factor = int(comp_schedule_dict["unrolling_factor"])
-        p_index = comps_placeholders_indices_dict[c_code + "-Unrolled"]
-        comps_repr[p_index[0]][p_index[1]] = unrolled
-        p_index = comps_placeholders_indices_dict[c_code + "-UnrollFactor"]
-        comps_repr[p_index[0]][p_index[1]] = unroll_factor
-
-        mat_start = comps_placeholders_indices_dict[
-            c_code + "-TransformationMatrixStart"
-        ]
-        mat_end = comps_placeholders_indices_dict[c_code + "-TransformationMatrixEnd"]
-        nb_mat_elements = mat_end[1] - mat_start[1] + 1
-        max_depth = int(np.sqrt(nb_mat_elements / MAX_MATRICES)) - 1
-        padded_matrix = get_padded_transformation_matrix(
-            program_json, schedule_json, comp_name, max_depth
-        )
-        assert len(padded_matrix.flatten().tolist()) == nb_mat_elements
-
-        # print("padded_matrix.flatten().tolist()=",padded_matrix.flatten().tolist())
-        # print("mat_start[0]",mat_start[0])
-        # print("mat_start[1]",mat_start[1])
-        # print("mat_end[1] + 1",mat_end[1] + 1)
-        comps_repr[mat_start[0]][
-            mat_start[1] : mat_end[1] + 1
-        ] = padded_matrix.flatten().tolist()
-
-        # print("padded_matrix[0,:].reshape(max_depth + 1,max_depth + 1)=",padded_matrix[0,:].reshape(max_depth + 1,max_depth + 1))
-        padded_tranf_mat_per_comp[comp_name] = padded_matrix[0, :].reshape(
-            max_depth + 1, max_depth + 1
-        )
+            comps_values.extend([1, int(comp_schedule_dict["unrolling_factor"])])
+        else:
+            comps_values.extend([0, 0])
 
     loop_schedules_dict = dict()
     for loop_name in program_json["iterators"]:
         loop_schedules_dict[loop_name] = dict()
-        loop_schedules_dict[loop_name]["TransformationMatrixCol"] = []
-        loop_schedules_dict[loop_name]["TransformationMatrixRow"] = []
+        loop_schedules_dict[loop_name]["TransformationMatrixCol"] = None
+        loop_schedules_dict[loop_name]["TransformationMatrixRow"] = None
         loop_schedules_dict[loop_name]["tiled"] = 0
         loop_schedules_dict[loop_name]["tile_factor"] = 0
         loop_schedules_dict[loop_name]["unrolled"] = 0
@@ -381,60 +467,52 @@ def get_schedule_representation(
         loop_schedules_dict[loop_name]["parallelized"] = 0
         loop_schedules_dict[loop_name]["fused"] = 0
 
-    for comp_index, comp_name in enumerate(ordered_comp_list):
+    for comp_name in ordered_comp_list:
         comp_schedule_dict = schedule_json[comp_name]
         if comp_schedule_dict["tiling"]:
             for tiled_loop_index, tiled_loop in enumerate(
                 comp_schedule_dict["tiling"]["tiling_dims"]
             ):
-                loop_schedules_dict[tiled_loop]["tiled"] = 1
-                assert loop_schedules_dict[tiled_loop][
-                    "tile_factor"
-                ] == 0 or loop_schedules_dict[tiled_loop]["tile_factor"] == int(
+                tile_factor = int(
                     comp_schedule_dict["tiling"]["tiling_factors"][tiled_loop_index]
                 )
-                loop_schedules_dict[tiled_loop]["tile_factor"] = int(
-                    comp_schedule_dict["tiling"]["tiling_factors"][tiled_loop_index]
+                loop_schedules_dict[tiled_loop]["tiled"] = 1
+                assert loop_schedules_dict[tiled_loop]["tile_factor"] in (
+                    0,
+                    tile_factor,
                 )
+                loop_schedules_dict[tiled_loop]["tile_factor"] = tile_factor
         if comp_schedule_dict["unrolling_factor"]:
             comp_innermost_loop = computations_dict[comp_name]["iterators"][-1]
+            unroll_factor = int(comp_schedule_dict["unrolling_factor"])
             loop_schedules_dict[comp_innermost_loop]["unrolled"] = 1
-            assert loop_schedules_dict[comp_innermost_loop][
-                "unroll_factor"
-            ] == 0 or loop_schedules_dict[comp_innermost_loop]["unroll_factor"] == int(
-                comp_schedule_dict["unrolling_factor"]
-            )
-            loop_schedules_dict[comp_innermost_loop]["unroll_factor"] = int(
-                comp_schedule_dict["unrolling_factor"]
+            assert loop_schedules_dict[comp_innermost_loop]["unroll_factor"] in (
+                0,
+                unroll_factor,
             )
+            loop_schedules_dict[comp_innermost_loop]["unroll_factor"] = unroll_factor
         if comp_schedule_dict["parallelized_dim"]:
             loop_schedules_dict[comp_schedule_dict["parallelized_dim"]][
                 "parallelized"
             ] = 1
 
-        assert padded_tranf_mat_per_comp[comp_name].shape == (
-            (max_depth + 1),
-            (max_depth + 1),
-        )
         for iter_i, loop_name in enumerate(computations_dict[comp_name]["iterators"]):
-            if len(loop_schedules_dict[loop_name]["TransformationMatrixCol"]) > 0:
+            if loop_schedules_dict[loop_name]["TransformationMatrixCol"] is not None:
                 assert (
                     loop_schedules_dict[loop_name]["TransformationMatrixCol"]
-                    == padded_tranf_mat_per_comp[comp_name][:, iter_i + 1]
+                    == padded_tranf_mat[:, iter_i + 1]
                 ).all()
-            else:
-                loop_schedules_dict[loop_name][
-                    "TransformationMatrixCol"
-                ] = padded_tranf_mat_per_comp[comp_name][:, iter_i + 1]
-            if len(loop_schedules_dict[loop_name]["TransformationMatrixRow"]) > 0:
                 assert (
                     loop_schedules_dict[loop_name]["TransformationMatrixRow"]
-                    == padded_tranf_mat_per_comp[comp_name][iter_i + 1, :]
+                    == padded_tranf_mat[iter_i + 1, :]
                 ).all()
             else:
+                loop_schedules_dict[loop_name][
+                    "TransformationMatrixCol"
+                ] = padded_tranf_mat[:, iter_i + 1]
                 loop_schedules_dict[loop_name][
                     "TransformationMatrixRow"
-                ] = padded_tranf_mat_per_comp[comp_name][iter_i + 1, :]
+                ] = padded_tranf_mat[iter_i + 1, :]
 
     if "fusions" in schedule_json and schedule_json["fusions"]:
         for fusion in schedule_json["fusions"]:
@@ -443,55 +521,114 @@ def get_schedule_representation(
             loop_schedules_dict[fused_loop1]["fused"] = 1
             loop_schedules_dict[fused_loop2]["fused"] = 1
 
+    loops_values = []
+    loops_rows = []
+    loops_cols = []
     for loop_name in program_json["iterators"]:
-        l_code = "L" + loop_name
+        loop_schedule_dict = loop_schedules_dict[loop_name]
+        loops_values.extend(
+            [
+                loop_schedule_dict["parallelized"],
+                loop_schedule_dict["tiled"],
+                loop_schedule_dict["tile_factor"],
+                loop_schedule_dict["unrolled"],
+                loop_schedule_dict["unroll_factor"],
+                loop_schedule_dict["fused"],
+            ]
+        )
+        assert loop_schedule_dict["TransformationMatrixRow"] is not None
+        loops_rows.append(loop_schedule_dict["TransformationMatrixRow"])
+        loops_cols.append(loop_schedule_dict["TransformationMatrixCol"])
 
-        p_index = loops_placeholders_indices_dict[l_code + "Parallelized"]
-        loops_repr[p_index[0]][p_index[1]] = loop_schedules_dict[loop_name][
-            "parallelized"
-        ]
+    return (
+        comps_values,
+        np.tile(padded_matrix_values, len(ordered_comp_list)),
+        loops_values,
+        np.concatenate(loops_rows + loops_cols),
+    )
 
-        p_index = loops_placeholders_indices_dict[l_code + "Tiled"]
-        loops_repr[p_index[0]][p_index[1]] = loop_schedules_dict[loop_name]["tiled"]
-        p_index = loops_placeholders_indices_dict[l_code + "TileFactor"]
-        loops_repr[p_index[0]][p_index[1]] = loop_schedules_dict[loop_name][
-            "tile_factor"
-        ]
 
-        p_index = loops_placeholders_indices_dict[l_code + "Unrolled"]
-        loops_repr[p_index[0]][p_index[1]] = loop_schedules_dict[loop_name]["unrolled"]
-        p_index = loops_placeholders_indices_dict[l_code + "UnrollFactor"]
-        loops_repr[p_index[0]][p_index[1]] = loop_schedules_dict[loop_name][
-            "unroll_factor"
-        ]
+def get_schedules_representation(program_json, schedules_json, representation_indices):
+    """Computes the representations of several schedules of a program at once.
+
+    The values of the placeholders of all the schedules are gathered into
+    arrays, then written into a copy of the templates for all the schedules
+    with one assignment per kind of placeholder.
 
-        p_index = loops_placeholders_indices_dict[l_code + "Fused"]
-        loops_repr[p_index[0]][p_index[1]] = loop_schedules_dict[loop_name]["fused"]
+    Args:
+        program_json (dict): The annotation of the program.
+        schedules_json (list): The schedules.
+        representation_indices (dict): The result of get_representation_indices for the program.
 
-        row_start = loops_placeholders_indices_dict[l_code + "TransfMatRowStart"]
-        row_end = loops_placeholders_indices_dict[l_code + "TransfMatRowEnd"]
-        nb_row_elements = row_end[1] - row_start[1] + 1
-        assert (
-            len(loop_schedules_dict[loop_name]["TransformationMatrixRow"])
-            == nb_row_elements
+    Returns:
+        tuple: The computations tensor and the loops tensor of the representable schedules, of shapes (n_schedules, n_comps, comp_width) and (n_schedules, n_loops, loop_width), and the indices of these schedules in schedules_json.
+    """
+    valid_indices = []
+    schedules_values = []
+    for schedule_index, schedule_json in enumerate(schedules_json):
+        try:
+            schedules_values.append(
+                get_schedule_values(program_json, schedule_json, representation_indices)
+            )
+        except (NbMatricesException, AssertionError):
+            continue
+        valid_indices.append(schedule_index)
+
+    comps_base = representation_indices["comps_base"]
+    loops_base = representation_indices["loops_base"]
+    comps_repr = np.repeat(comps_base[np.newaxis], len(valid_indices), axis=0)
+    loops_repr = np.repeat(loops_base[np.newaxis], len(valid_indices), axis=0)
+    if valid_indices:
+        for repr_array, positions, values in [
+            (comps_repr, "comps_positions", 0),
+            (comps_repr, "comps_matrix_positions", 1),
+            (loops_repr, "loops_positions", 2),
+            (loops_repr, "loops_matrix_positions", 3),
+        ]:
+            rows, cols = representation_indices[positions]
+            repr_array[:, rows, cols] = np.array(
+                [schedule_values[values] for schedule_values in schedules_values],
+                dtype=np.float32,
+            )
+    return torch.from_numpy(comps_repr), torch.from_numpy(loops_repr), valid_indices
+
+
+def get_schedule_representation(
+    program_json,
+    schedule_json,
+    comps_repr_templates_list,
+    loops_repr_templates_list,
+    comps_placeholders_indices_dict,
+    loops_placeholders_indices_dict,
+    max_depth,
+):
+    representation_indices = get_representation_indices(
+        program_json,
+        comps_repr_templates_list,
+        loops_repr_templates_list,
+        comps_placeholders_indices_dict,
+        loops_placeholders_indices_dict,
+    )
+    computations_tensor, loops_tensor = [
+        torch.from_numpy(repr_array[np.newaxis])
+        for repr_array in (
+            representation_indices["comps_base"],
+            representation_indices["loops_base"],
         )
-        loops_repr[row_start[0]][row_start[1] : row_end[1] + 1] = loop_schedules_dict[
-            loop_name
-        ]["TransformationMatrixRow"]
-
-        col_start = loops_placeholders_indices_dict[l_code + "TransfMatColStart"]
-        col_end = loops_placeholders_indices_dict[l_code + "TransfMatColEnd"]
-        nb_col_elements = col_end[1] - col_start[1] + 1
-        assert (
-            len(loop_schedules_dict[loop_name]["TransformationMatrixCol"])
-            == nb_col_elements
+    ]
+    comps_values, comps_matrix, loops_values, loops_matrix = get_schedule_values(
+        program_json, schedule_json, representation_indices
+    )
+    for repr_tensor, positions, values in [
+        (computations_tensor, "comps_positions", comps_values),
+        (computations_tensor, "comps_matrix_positions", comps_matrix),
+        (loops_tensor, "loops_positions", loops_values),
+        (loops_tensor, "loops_matrix_positions", loops_matrix),
+    ]:
+        rows, cols = representation_indices[positions]
+        repr_tensor[0, rows, cols] = torch.from_numpy(
+            np.asarray(values, dtype=np.float32)
         )
-        loops_repr[col_start[0]][col_start[1] : col_end[1] + 1] = loop_schedules_dict[
-            loop_name
-        ]["TransformationMatrixCol"]
-
-    loops_tensor = torch.unsqueeze(torch.FloatTensor(loops_repr), 0)
-    computations_tensor = torch.unsqueeze(torch.FloatTensor(comps_repr), 0)
 
     return computations_tensor, loops_tensor
 
@@ -1001,6 +1138,243 @@ def simplify_sched_str(
     return re.sub("(M\({[\dC\,]+},[\d\,\-]+\))+", new_mats_str, sched_str)
 
 
+def get_program_datapoints(
+    function_name,
+    program_dict,
+    max_depth,
+    drop_sched_func=None,
+    can_set_default_eval=None,
+    speedups_clip_func=None,
+    train_device="cpu",
+):
+    """Computes the representation of all the schedules of a program.
+
+    Args:
+        function_name (str): The name of the program.
+        program_dict (dict): The program, with its annotation and its schedules.
+        max_depth (int): The maximum depth of the loop nests.
+        drop_sched_func (function, optional): Whether a schedule should be dropped. Defaults to None, no schedule is dropped.
+        can_set_default_eval (function, optional): The default speedup of a schedule, 0 if it has none. Defaults to None, no default speedup.
+        speedups_clip_func (function, optional): Clips the speedups. Defaults to None, no clipping.
+        train_device (str, optional): The device of the tree tensors. Defaults to "cpu".
+
+    Returns:
+        tuple: The tree of the program (None if the program cannot be represented), the datapoints as (datapoint_attributes, comps_tensor, loops_tensor, speedup), the number of dropped schedules and the number of pruned schedules.
+    """
+    if drop_sched_func == None:
+
+        def drop_sched_func(x, y):
+            return False
+
+    if speedups_clip_func == None:
+
+        def speedups_clip_func(x):
+            return x
+
+    if can_set_default_eval == None:
+
+        def can_set_default_eval(x, y):
+            return 0
+
+    try:
+        (
+            prog_tree,
+            comps_repr_templates_list,
+            loops_repr_templates_list,
+            comps_placeholders_indices_dict,
+            loops_placeholders_indices_dict,
+        ) = get_representation_template(
+            program_dict,
+            max_depth=max_depth,
+            train_device=train_device,
+        )
+    except (NbAccessException, LoopsDepthException):
+        return None, [], len(program_dict["schedules_list"]), 0
+
+    program_json = program_dict["program_annotation"]
+    program_exec_time = program_dict["initial_execution_time"]
+    tree_footprint = get_tree_footprint(prog_tree)
+    kept_schedules = []
+    speedups = []
+    nb_pruned = 0
+    for schedule_index in range(len(program_dict["schedules_list"])):
+        schedule_json = program_dict["schedules_list"][schedule_index]
+        sched_exec_time = np.min(schedule_json["execution_times"])
+        if drop_sched_func(program_dict, schedule_index) or (not sched_exec_time):
+            nb_pruned += 1
+            continue
+
+        sched_speedup = program_exec_time / sched_exec_time
+
+        def_sp = can_set_default_eval(program_dict, schedule_index)
+        if def_sp > 0:
+            sched_speedup = def_sp
+
+        kept_schedules.append(schedule_index)
+        speedups.append(speedups_clip_func(sched_speedup))
+
+    # All the schedules of the program are represented at once
+    representation_indices = get_representation_indices(
+        program_json,
+        comps_repr_templates_list,
+        loops_repr_templates_list,
+        comps_placeholders_indices_dict,
+        loops_placeholders_indices_dict,
+    )
+    comps_tensor, loops_tensor, valid_indices = get_schedules_representation(
+        program_json,
+        [program_dict["schedules_list"][index] for index in kept_schedules],
+        representation_indices,
+    )
+
+    datapoints = []
+    for i, kept_index in enumerate(valid_indices):
+        schedule_index = kept_schedules[kept_index]
+        datapoint_attributes = get_datapoint_attributes(
+            function_name,
+            program_dict,
+            schedule_index,
+            tree_footprint,
+        )
+        datapoints.append(
+            (
+                datapoint_attributes,
+                comps_tensor[i : i + 1],
+                loops_tensor[i : i + 1],
+                speedups[kept_index],
+            )
+        )
+    return prog_tree, datapoints, nb_pruned, nb_pruned
+
+
+def featurize_program(args):
+    """Computes the datapoints of a program in a worker process.
+
+    The tensors are sent back as numpy arrays, torch would put each of them in
+    its own shared memory segment. The tree is not sent back, the parent
+    builds it from the program when its footprint is new.
+
+    Args:
+        args (tuple): The arguments of get_program_datapoints, without the device.
+
+    Returns:
+        tuple: The footprint of the tree (None if the program cannot be represented), the datapoints, the number of dropped schedules and the number of pruned schedules.
+    """
+    prog_tree, datapoints, nb_dropped, nb_pruned = get_program_datapoints(*args)
+    if prog_tree is None:
+        return None, [], nb_dropped, nb_pruned
+    return (
+        get_tree_footprint(prog_tree),
+        [
+            (datapoint_attributes, comps_tensor.numpy(), loops_tensor.numpy(), speedup)
+            for datapoint_attributes, comps_tensor, loops_tensor, speedup in datapoints
+        ],
+        nb_dropped,
+        nb_pruned,
+    )
+
+
+def iter_program_datapoints(
+    programs,
+    max_depth,
+    drop_sched_func=None,
+    can_set_default_eval=None,
+    speedups_clip_func=None,
+    train_device="cpu",
+    nb_processes=1,
+    window_size=256,
+):
+    """Computes the datapoints of programs, in parallel when nb_processes is
+    greater than 1.
+
+    The results are yielded in the order of the programs whatever the number of
+    processes, so the datasets built from them do not depend on it. The
+    programs are sent to the pool by windows of `window_size` programs, the
+    next window being computed while the current one is consumed, so a lazy
+    iterable of programs is never read further than two windows ahead.
+
+    The functions are sent to the worker processes, they must be picklable
+    (defined at the top level of a module).
+
+    Args:
+        programs (iterable): The programs as (index, function_name, program_dict).
+        max_depth (int): The maximum depth of the loop nests.
+        drop_sched_func (function, optional): Whether a schedule should be dropped. Defaults to None.
+        can_set_default_eval (function, optional): The default speedup of a schedule, 0 if it has none. Defaults to None.
+        speedups_clip_func (function, optional): Clips the speedups. Defaults to None.
+        train_device (str, optional): The device of the tree tensors. Defaults to "cpu".
+        nb_processes (int, optional): The number of worker processes. Defaults to 1, no worker.
+        window_size (int, optional): The number of programs sent to the pool at once. Defaults to 256.
+
+    Yields:
+        tuple: The index and the name of the program, then the results of get_program_datapoints.
+    """
+    if nb_processes <= 1:
+        for index, function_name, program_dict in programs:
+            yield (index, function_name) + get_program_datapoints(
+                function_name,
+                program_dict,
+                max_depth,
+                drop_sched_func,
+                can_set_default_eval,
+                speedups_clip_func,
+                train_device=train_device,
+            )
+        return
+
+    programs = iter(programs)
+    trees = dict()
+
+    def submit_window(pool):
+        window = list(itertools.islice(programs, window_size))
+        if not window:
+            return None, None
+        return window, pool.map_async(
+            featurize_program,
+            [
+                (
+                    function_name,
+                    program_dict,
+                    max_depth,
+                    drop_sched_func,
+                    can_set_default_eval,
+                    speedups_clip_func,
+                )
+                for _, function_name, program_dict in window
+            ],
+            chunksize=max(1, len(window) // (4 * nb_processes)),
+        )
+
+    with multiprocessing.Pool(nb_processes) as pool:
+        window, results = submit_window(pool)
+        while window:
+            window_results = results.get()
+            next_window, next_results = submit_window(pool)
+            for (index, function_name, program_dict), (
+                tree_footprint,
+                datapoints,
+                nb_dropped,
+                nb_pruned,
+            ) in zip(window, window_results):
+                if tree_footprint is None:
+                    yield index, function_name, None, [], nb_dropped, nb_pruned
+                    continue
+                if tree_footprint not in trees:
+                    trees[tree_footprint] = get_representation_template(
+                        program_dict, max_depth=max_depth, train_device=train_device
+                    )[0]
+                yield index, function_name, trees[tree_footprint], [
+                    (
+                        datapoint_attributes,
+                        torch.from_numpy(comps_array),
+                        torch.from_numpy(loops_array),
+                        speedup,
+                    )
+                    for datapoint_attributes, comps_array, loops_array, speedup in datapoints
+                ], nb_dropped, nb_pruned
+            window, results = next_window, next_results
+
+
 class Dataset:
     def __init__(
         self,
@@ -1012,6 +1386,7 @@ class Dataset:
         speedups_clip_func=None,
         store_device="cpu",
         train_device="cpu",
+        nb_processes=1,
     ):
 
         if dataset_filename.endswith("json"):
@@ -1033,58 +1408,44 @@ class Dataset:
         self.batched_datapoint_attributes = []
         self.nb_datapoints = 0
 
-        if drop_sched_func == None:
-
-            def drop_sched_func(x, y):
-                return False
-
         if drop_prog_func == None:
 
             def drop_prog_func(x):
                 return False
 
-        if speedups_clip_func == None:
-
-            def speedups_clip_func(x):
-                return x
-
-        if can_set_default_eval == None:
-
-            def can_set_default_eval(x, y):
-                return 0
-
         functions_list = list(self.programs_dict.keys())
         random.Random(42).shuffle(functions_list)
-        for index, function_name in enumerate(tqdm(functions_list)):
-            if drop_prog_func(self.programs_dict[function_name]):
-                self.nb_dropped += len(
-                    self.programs_dict[function_name]["schedules_list"]
-                )
-                self.dropped_funcs.append(function_name)
-                continue
 
-            program_json = self.programs_dict[function_name]["program_annotation"]
-
-            try:
-                (
-                    prog_tree,
-                    comps_repr_templates_list,
-                    loops_repr_templates_list,
-                    comps_placeholders_indices_dict,
-                    loops_placeholders_indices_dict,
-                ) = get_representation_template(
-                    self.programs_dict[function_name],
-                    max_depth=self.max_depth,
-                    train_device=train_device,
-                )
-            except (NbAccessException, LoopsDepthException):
-                self.nb_dropped += len(
-                    self.programs_dict[function_name]["schedules_list"]
-                )
+        def iter_kept_programs():
+            for index, function_name in enumerate(tqdm(functions_list)):
+                if drop_prog_func(self.programs_dict[function_name]):
+                    self.nb_dropped += len(
+                        self.programs_dict[function_name]["schedules_list"]
+                    )
+                    self.dropped_funcs.append(function_name)
+                    continue
+                yield index, function_name, self.programs_dict[function_name]
+
+        for (
+            index,
+            function_name,
+            prog_tree,
+            datapoints,
+            nb_dropped,
+            nb_pruned,
+        ) in iter_program_datapoints(
+            iter_kept_programs(),
+            self.max_depth,
+            drop_sched_func,
+            can_set_default_eval,
+            speedups_clip_func,
+            train_device=train_device,
+            nb_processes=nb_processes,
+        ):
+            self.nb_dropped += nb_dropped
+            self.nb_pruned += nb_pruned
+            if prog_tree is None:
                 continue
-            program_exec_time = self.programs_dict[function_name][
-                "initial_execution_time"
-            ]
             tree_footprint = get_tree_footprint(prog_tree)
             self.batches_dict[tree_footprint] = self.batches_dict.get(
                 tree_footprint,
@@ -1099,51 +1460,12 @@ class Dataset:
                 },
             )
 
-            for schedule_index in range(
-                len(self.programs_dict[function_name]["schedules_list"])
-            ):
-                schedule_json = self.programs_dict[function_name]["schedules_list"][
-                    schedule_index
-                ]
-                sched_exec_time = np.min(schedule_json["execution_times"])
-                if drop_sched_func(
-                    self.programs_dict[function_name], schedule_index
-                ) or (not sched_exec_time):
-                    self.nb_dropped += 1
-                    self.nb_pruned += 1
-                    continue
-
-                sched_speedup = program_exec_time / sched_exec_time
-
-                def_sp = can_set_default_eval(
-                    self.programs_dict[function_name], schedule_index
-                )
-                if def_sp > 0:
-                    sched_speedup = def_sp
-
-                sched_speedup = speedups_clip_func(sched_speedup)
-
-                try:
-                    comps_tensor, loops_tensor = get_schedule_representation(
-                        program_json,
-                        schedule_json,
-                        comps_repr_templates_list,
-                        loops_repr_templates_list,
-                        comps_placeholders_indices_dict,
-                        loops_placeholders_indices_dict,
-                        self.max_depth,
-                    )
-                except (NbMatricesException, AssertionError):
-                    # print(function_name, schedule_json)
-                    continue
-
-                datapoint_attributes = get_datapoint_attributes(
-                    function_name,
-                    self.programs_dict[function_name],
-                    schedule_index,
-                    tree_footprint,
-                )
-
+            for (
+                datapoint_attributes,
+                comps_tensor,
+                loops_tensor,
+                sched_speedup,
+            ) in datapoints:
                 self.batches_dict[tree_footprint]["func_id"].append(index)
                 self.batches_dict[tree_footprint]["comps_tensor_list"].append(
                     comps_tensor
@@ -1264,6 +1586,587 @@ class Dataset:
         return len(self.batched_Y)
 
 
+def iter_programs(dataset_path, seed=42):
+    """Reads the programs of a dataset one at a time, in the shuffled order of
+    the Dataset class.
+
+    A `.jsonl` file holds one `{function_name: program}` object per line, a
+    directory holds one `.json` or `.pkl` file per program named after the
+    function. Only the offsets of the lines (or the file names) are kept in
+    memory. A `.json` or `.pkl` file holding the dict of all the programs
+    cannot be read incrementally, it is loaded once and the programs are
+    released as they are read.
+
+    Args:
+        dataset_path (str): The path to the dataset.
+        seed (int, optional): The seed of the shuffle. Defaults to 42.
+
+    Yields:
+        tuple: The name of the function and its program dict.
+    """
+    if os.path.isdir(dataset_path):
+        file_names = sorted(
+            file_name
+            for file_name in os.listdir(dataset_path)
+            if file_name.endswith((".json", ".pkl"))
+        )
+        random.Random(seed).shuffle(file_names)
+        for file_name in file_names:
+            file_path = os.path.join(dataset_path, file_name)
+            if file_name.endswith(".json"):
+                with open(file_path, "r") as f:
+                    program_dict = json.load(f)
+            else:
+                with open(file_path, "rb") as f:
+                    program_dict = pickle.load(f)
+            yield os.path.splitext(file_name)[0], program_dict
+    elif dataset_path.endswith("jsonl"):
+        offsets = []
+        with open(dataset_path, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    offsets.append(offset)
+                offset += len(line)
+            # The shuffle of the Dataset class only depends on the number of
+            # programs, the order is the same as the one of the whole dict
+            random.Random(seed).shuffle(offsets)
+            for offset in offsets:
+                f.seek(offset)
+                yield from json.loads(f.readline()).items()
+    else:
+        if dataset_path.endswith("json"):
+            with open(dataset_path, "r") as f:
+                programs_dict = json.load(f)
+        else:
+            with open(dataset_path, "rb") as f:
+                programs_dict = pickle.load(f)
+        functions_list = list(programs_dict.keys())
+        random.Random(seed).shuffle(functions_list)
+        for function_name in functions_list:
+            yield function_name, programs_dict.pop(function_name)
+
+
+def tree_to_json(node):
+    """Converts a program tree into a JSON compatible dict, its tensors into lists."""
+    return {
+        key: [tree_to_json(child) for child in value]
+        if key == "child_list"
+        else value.tolist()
+        if isinstance(value, torch.Tensor)
+        else value
+        for key, value in node.items()
+    }
+
+
+def tree_from_json(node, train_device="cpu"):
+    """Converts a dict written by tree_to_json back into a program tree."""
+    node = dict(node)
+    node["loop_index"] = torch.tensor(node["loop_index"]).to(train_device)
+    if "computations_indices" in node:
+        node["computations_indices"] = torch.tensor(
+            node["computations_indices"]
+        ).to(train_device)
+    node["child_list"] = [
+        tree_from_json(child, train_device=train_device)
+        for child in node["child_list"]
+    ]
+    return node
+
+
+def write_shard(
+    output_dir,
+    manifest,
+    tree_footprint,
+    comps_tensor,
+    loops_tensor,
+    speedups,
+    datapoint_attributes,
+    batch_offsets,
+):
+    """Writes the datapoints of a footprint as a shard in the columnar format.
+
+    The comps tensor, the loops tensor and the speedups are written as `.npy`
+    files that ShardedDataset memory maps, the datapoint attributes are only
+    read by the evaluation and are pickled apart. The shard is added to the
+    manifest.
+
+    Args:
+        output_dir (str): The directory of the dataset.
+        manifest (dict): The manifest of the dataset.
+        tree_footprint (str): The footprint of the datapoints.
+        comps_tensor (torch.Tensor): The comps tensors of the datapoints.
+        loops_tensor (torch.Tensor): The loops tensors of the datapoints.
+        speedups (torch.Tensor): The speedups of the datapoints.
+        datapoint_attributes (list): The attributes of the datapoints.
+        batch_offsets (list): The index of the first datapoint of each batch.
+    """
+    shard_name = f"shard_{len(manifest['shards']):06d}"
+    for column, tensor in [
+        ("comps_tensor", comps_tensor),
+        ("loops_tensor", loops_tensor),
+        ("speedups", speedups),
+    ]:
+        np.save(
+            os.path.join(output_dir, f"{shard_name}_{column}.npy"),
+            tensor.cpu().numpy().astype(np.float32),
+        )
+    with open(os.path.join(output_dir, f"{shard_name}_attributes.pkl"), "wb") as f:
+        pickle.dump(list(datapoint_attributes), f)
+    manifest["shards"].append(
+        {
+            "name": shard_name,
+            "footprint": tree_footprint,
+            "nb_datapoints": len(speedups),
+            "batch_offsets": list(batch_offsets),
+        }
+    )
+
+
+def write_manifest(output_dir, manifest):
+    # The manifest is written last, a directory without one is incomplete
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def build_dataset_shards(
+    dataset_path,
+    output_dir,
+    max_batch_size,
+    drop_sched_func=None,
+    drop_prog_func=None,
+    can_set_default_eval=None,
+    speedups_clip_func=None,
+    shard_size=65536,
+    max_buffered_datapoints=None,
+    seed=42,
+    nb_processes=1,
+):
+    """Converts a dataset into shards of datapoints, reading the programs one
+    at a time.
+
+    The datapoints are buffered per tree footprint. A buffer is written as a
+    shard when it reaches `shard_size` datapoints, and the largest buffer is
+    written early when all the buffers hold more than
+    `max_buffered_datapoints` datapoints, so the memory use does not depend on
+    the size of the dataset. The datapoints of a shard are shuffled and cut
+    into batches of `max_batch_size` datapoints. See write_shard for the
+    format of the shards.
+
+    Args:
+        dataset_path (str): The path to the dataset, see iter_programs.
+        output_dir (str): The directory of the shards.
+        max_batch_size (int): The size of the batches.
+        drop_sched_func (function, optional): Whether a schedule should be dropped. Defaults to None.
+        drop_prog_func (function, optional): Whether a program should be dropped. Defaults to None.
+        can_set_default_eval (function, optional): The default speedup of a schedule, 0 if it has none. Defaults to None.
+        speedups_clip_func (function, optional): Clips the speedups. Defaults to None.
+        shard_size (int, optional): The maximum number of datapoints of a shard. Defaults to 65536.
+        max_buffered_datapoints (int, optional): The maximum number of datapoints kept in memory. Defaults to 2 * shard_size.
+        seed (int, optional): The seed of the shuffles. Defaults to 42.
+        nb_processes (int, optional): The number of processes computing the datapoints. Defaults to 1.
+
+    Returns:
+        dict: The manifest.
+    """
+    if drop_prog_func == None:
+
+        def drop_prog_func(x):
+            return False
+
+    if max_buffered_datapoints is None:
+        max_buffered_datapoints = 2 * shard_size
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    max_depth = 5
+    manifest = {
+        "version": 2,
+        "source": dataset_path,
+        "nb_datapoints": 0,
+        "nb_dropped": 0,
+        "nb_pruned": 0,
+        "dropped_funcs": [],
+        "trees": dict(),
+        "shards": [],
+    }
+    buffers = dict()
+    nb_buffered = 0
+
+    def flush_buffer(tree_footprint):
+        datapoints = buffers.pop(tree_footprint)
+        rng.shuffle(datapoints)
+        attributes, comps_tensors, loops_tensors, speedups = zip(*datapoints)
+        write_shard(
+            output_dir,
+            manifest,
+            tree_footprint,
+            torch.cat(comps_tensors, 0),
+            torch.cat(loops_tensors, 0),
+            torch.FloatTensor(speedups),
+            attributes,
+            range(0, len(datapoints), max_batch_size),
+        )
+        return len(datapoints)
+
+    def iter_kept_programs():
+        for index, (function_name, program_dict) in enumerate(
+            tqdm(iter_programs(dataset_path, seed))
+        ):
+            if drop_prog_func(program_dict):
+                manifest["nb_dropped"] += len(program_dict["schedules_list"])
+                manifest["dropped_funcs"].append(function_name)
+                continue
+            yield index, function_name, program_dict
+
+    for (
+        index,
+        function_name,
+        prog_tree,
+        datapoints,
+        nb_dropped,
+        nb_pruned,
+    ) in iter_program_datapoints(
+        iter_kept_programs(),
+        max_depth,
+        drop_sched_func,
+        can_set_default_eval,
+        speedups_clip_func,
+        nb_processes=nb_processes,
+    ):
+        manifest["nb_dropped"] += nb_dropped
+        manifest["nb_pruned"] += nb_pruned
+        if not datapoints:
+            continue
+        tree_footprint = get_tree_footprint(prog_tree)
+        if tree_footprint not in manifest["trees"]:
+            manifest["trees"][tree_footprint] = tree_to_json(prog_tree)
+        buffer = buffers.setdefault(tree_footprint, [])
+        buffer.extend(datapoints)
+        manifest["nb_datapoints"] += len(datapoints)
+        nb_buffered += len(datapoints)
+
+        if len(buffer) >= shard_size:
+            nb_buffered -= flush_buffer(tree_footprint)
+        while nb_buffered > max_buffered_datapoints:
+            largest_footprint = max(
+                buffers, key=lambda footprint: len(buffers[footprint])
+            )
+            nb_buffered -= flush_buffer(largest_footprint)
+
+    for tree_footprint in list(buffers):
+        flush_buffer(tree_footprint)
+
+    write_manifest(output_dir, manifest)
+    print(
+        f"Number of datapoints {manifest['nb_datapoints']} Number of shards {len(manifest['shards'])}"
+    )
+    return manifest
+
+
+def save_dataset_shards(dataset, output_dir):
+    """Writes the batches of a Dataset in the columnar format of
+    build_dataset_shards, one shard per footprint.
+
+    The batches keep their composition, the batches of a footprint are
+    written in their order in the dataset.
+
+    Args:
+        dataset (Dataset): The dataset.
+        output_dir (str): The directory of the shards.
+
+    Returns:
+        dict: The manifest.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {
+        "version": 2,
+        "nb_datapoints": dataset.nb_datapoints,
+        "nb_dropped": dataset.nb_dropped,
+        "nb_pruned": dataset.nb_pruned,
+        "dropped_funcs": dataset.dropped_funcs,
+        "trees": dict(),
+        "shards": [],
+    }
+    batches_per_footprint = dict()
+    for batch_index in range(len(dataset)):
+        prog_tree = dataset.batched_X[batch_index][0]
+        tree_footprint = get_tree_footprint(prog_tree)
+        if tree_footprint not in manifest["trees"]:
+            manifest["trees"][tree_footprint] = tree_to_json(prog_tree)
+        batches_per_footprint.setdefault(tree_footprint, []).append(batch_index)
+
+    for tree_footprint, batch_indices in tqdm(batches_per_footprint.items()):
+        batch_sizes = [len(dataset.batched_Y[index]) for index in batch_indices]
+        write_shard(
+            output_dir,
+            manifest,
+            tree_footprint,
+            torch.cat([dataset.batched_X[index][1].cpu() for index in batch_indices]),
+            torch.cat([dataset.batched_X[index][2].cpu() for index in batch_indices]),
+            torch.cat([dataset.batched_Y[index].cpu() for index in batch_indices]),
+            [
+                attributes
+                for index in batch_indices
+                for attributes in dataset.batched_datapoint_attributes[index]
+            ],
+            np.cumsum([0] + batch_sizes[:-1]).tolist(),
+        )
+
+    write_manifest(output_dir, manifest)
+    return manifest
+
+
+def keep_batch(batch):
+    """Collate function of the DataLoaders whose dataset reads whole batches."""
+    return batch
+
+
+class FootprintBucketSampler(torch.utils.data.Sampler):
+    """Samples batches of datapoints that share the same tree footprint.
+
+    The datapoints of a footprint form a bucket. When shuffling, at every
+    iteration the datapoints of each bucket are shuffled before being cut
+    into batches, so the composition of the batches changes at every epoch,
+    and the batches of all the buckets are shuffled together.
+
+    Args:
+        buckets (list): The indices of the datapoints of each footprint, as numpy arrays.
+        batch_size (int): The maximum number of datapoints of a batch.
+        shuffle (bool, optional): Whether to shuffle the datapoints and the batches. Defaults to True.
+        seed (int, optional): The seed of the shuffles. Defaults to 42.
+    """
+
+    def __init__(self, buckets, batch_size, shuffle=True, seed=42):
+        self.buckets = buckets
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+
+    def __iter__(self):
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = self.rng.permutation(bucket)
+            batches.extend(
+                bucket[start : start + self.batch_size]
+                for start in range(0, len(bucket), self.batch_size)
+            )
+        if self.shuffle:
+            batches = [batches[i] for i in self.rng.permutation(len(batches))]
+        return iter(batches)
+
+    def __len__(self):
+        return sum(math.ceil(len(bucket) / self.batch_size) for bucket in self.buckets)
+
+
+class ShardedDataset:
+    """Batches of a dataset in the columnar format of build_dataset_shards.
+
+    The columns of the shards are memory mapped when first read, so opening
+    a dataset only reads its manifest and the page cache holds the data,
+    shared by all the processes reading the same dataset. A batch is copied
+    out of the mapping when it is read. Only the `max_open_shards` most
+    recently read shards stay mapped, each mapping holds a file descriptor.
+
+    Iterating over the dataset reads the shards in a shuffled order and their
+    batches in a shuffled order, the order changes at every iteration.
+    `load_all` reads all the batches with their attributes instead, in the
+    order of the manifest, for the evaluation functions that index the
+    batches. `get_data_loader` makes new batches at every epoch instead, see
+    FootprintBucketSampler.
+
+    Args:
+        directory (str): The directory of the shards.
+        store_device (str, optional): The device of the read tensors. Defaults to "cpu".
+        shuffle (bool, optional): Whether to shuffle the shards and the batches. Defaults to True.
+        seed (int, optional): The seed of the shuffles. Defaults to 42.
+        train_device (str, optional): The device of the tree tensors. Defaults to "cpu".
+        max_open_shards (int, optional): The maximum number of shards mapped at once. Defaults to 128.
+    """
+
+    def __init__(
+        self,
+        directory,
+        store_device="cpu",
+        shuffle=True,
+        seed=42,
+        train_device="cpu",
+        max_open_shards=128,
+    ):
+        self.directory = directory
+        self.store_device = torch.device(store_device)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rng = random.Random(seed)
+        with open(os.path.join(directory, "manifest.json"), "r") as f:
+            self.manifest = json.load(f)
+        self.nb_datapoints = self.manifest["nb_datapoints"]
+        self.trees = {
+            tree_footprint: tree_from_json(tree, train_device=train_device)
+            for tree_footprint, tree in self.manifest["trees"].items()
+        }
+        self.shard_offsets = np.cumsum(
+            [0] + [shard["nb_datapoints"] for shard in self.manifest["shards"]]
+        )
+        self.max_open_shards = max_open_shards
+        # The mapped columns of the shards, the least recently read first
+        self.columns = OrderedDict()
+        self.batches = [
+            (shard_index, start, end)
+            for shard_index, shard in enumerate(self.manifest["shards"])
+            for start, end in zip(
+                shard["batch_offsets"],
+                shard["batch_offsets"][1:] + [shard["nb_datapoints"]],
+            )
+        ]
+        self.batched_X = []
+        self.batched_Y = []
+        self.batched_datapoint_attributes = []
+
+    def get_columns(self, shard_index):
+        if shard_index in self.columns:
+            self.columns.move_to_end(shard_index)
+            return self.columns[shard_index]
+        shard_name = self.manifest["shards"][shard_index]["name"]
+        self.columns[shard_index] = [
+            np.load(
+                os.path.join(self.directory, f"{shard_name}_{column}.npy"),
+                mmap_mode="r",
+            )
+            for column in ["comps_tensor", "loops_tensor", "speedups"]
+        ]
+        # The mapping of an evicted shard is closed once no batch uses it
+        while len(self.columns) > self.max_open_shards:
+            self.columns.popitem(last=False)
+        return self.columns[shard_index]
+
+    def get_batch(self, shard_index, start, end):
+        comps_tensor, loops_tensor, speedups = self.get_columns(shard_index)
+        return (
+            (
+                self.trees[self.manifest["shards"][shard_index]["footprint"]],
+                torch.from_numpy(np.array(comps_tensor[start:end])).to(
+                    self.store_device
+                ),
+                torch.from_numpy(np.array(loops_tensor[start:end])).to(
+                    self.store_device
+                ),
+            ),
+            torch.from_numpy(np.array(speedups[start:end])).to(self.store_device),
+        )
+
+    def get_datapoints(self, indices):
+        """Read a batch made of any datapoints of the same footprint.
+
+        Args:
+            indices (list): The indices of the datapoints in the dataset.
+
+        Returns:
+            tuple: The inputs and the labels of the batch.
+        """
+        # Sorted indices read the mapped columns in order
+        indices = np.sort(np.asarray(indices))
+        shard_indices = np.searchsorted(self.shard_offsets, indices, side="right") - 1
+        columns_parts = []
+        for shard_index in np.unique(shard_indices):
+            rows = indices[shard_indices == shard_index] - self.shard_offsets[shard_index]
+            columns_parts.append(
+                [column[rows] for column in self.get_columns(shard_index)]
+            )
+        comps_tensor, loops_tensor, speedups = [
+            torch.from_numpy(np.concatenate(column_parts)).to(self.store_device)
+            for column_parts in zip(*columns_parts)
+        ]
+        tree = self.trees[self.manifest["shards"][shard_indices[0]]["footprint"]]
+        return (tree, comps_tensor, loops_tensor), speedups
+
+    def get_footprint_buckets(self):
+        """Get the indices of the datapoints of each footprint."""
+        buckets = dict()
+        for shard_index, shard in enumerate(self.manifest["shards"]):
+            buckets.setdefault(shard["footprint"], []).append(
+                np.arange(
+                    self.shard_offsets[shard_index], self.shard_offsets[shard_index + 1]
+                )
+            )
+        return [np.concatenate(bucket) for bucket in buckets.values()]
+
+    def get_data_loader(self, batch_size, shuffle=True):
+        """Get a DataLoader over batches of `batch_size` datapoints of the same
+        footprint, made again at every epoch when shuffling.
+
+        Args:
+            batch_size (int): The maximum number of datapoints of a batch.
+            shuffle (bool, optional): Whether to shuffle the datapoints and the batches. Defaults to True.
+
+        Returns:
+            torch.utils.data.DataLoader: The data loader.
+        """
+        return torch.utils.data.DataLoader(
+            self,
+            sampler=FootprintBucketSampler(
+                self.get_footprint_buckets(), batch_size, shuffle, self.seed
+            ),
+            batch_size=None,
+            collate_fn=keep_batch,
+        )
+
+    def __iter__(self):
+        if not self.shuffle:
+            for batch in self.batches:
+                yield self.get_batch(*batch)
+            return
+        # The batches of a shard are read together, the reads stay local to a
+        # few files at a time
+        batches_per_shard = dict()
+        for batch in self.batches:
+            batches_per_shard.setdefault(batch[0], []).append(batch)
+        shard_indices = list(batches_per_shard)
+        self.rng.shuffle(shard_indices)
+        for shard_index in shard_indices:
+            shard_batches = batches_per_shard[shard_index]
+            self.rng.shuffle(shard_batches)
+            for batch in shard_batches:
+                yield self.get_batch(*batch)
+
+    def load_all(self):
+        """Reads all the batches and their attributes into memory, like the
+        Dataset class."""
+        self.batched_X = []
+        self.batched_Y = []
+        self.batched_datapoint_attributes = []
+        shard_attributes = dict()
+        for shard_index, start, end in self.batches:
+            if shard_index not in shard_attributes:
+                shard_name = self.manifest["shards"][shard_index]["name"]
+                with open(
+                    os.path.join(self.directory, f"{shard_name}_attributes.pkl"), "rb"
+                ) as f:
+                    shard_attributes = {shard_index: pickle.load(f)}
+            inputs, labels = self.get_batch(shard_index, start, end)
+            self.batched_X.append(inputs)
+            self.batched_Y.append(labels)
+            self.batched_datapoint_attributes.append(
+                shard_attributes[shard_index][start:end]
+            )
+        return self
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return [self[i] for i in range(start, stop, step)]
+        elif isinstance(index, int):
+            return (self.batched_X[index], self.batched_Y[index])
+        else:
+            # The batches of the samplers are arrays of datapoint indices
+            return self.get_datapoints(index)
+
+    def __len__(self):
+        return len(self.batches)
+
+
 def has_skippable_loop_1comp(
     prog_dict,
 ):
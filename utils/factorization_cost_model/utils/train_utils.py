@@ -1,7 +1,9 @@
 import copy
 import math
 import os
+import queue
 import random
+import threading
 import time
 
 
@@ -14,6 +16,130 @@ from utils.config import *
 from tqdm import tqdm
 
 
+class BatchPrefetcher:
+    """Iterates over batches, reading them on a background thread and copying
+    them to the training device ahead of their use.
+
+    The reading thread stays `prefetch` batches ahead of the training loop.
+    By default, the batches are copied to the device synchronously when they
+    are returned. With `async_copy` on a GPU, the tensors are pinned in
+    page-locked memory by the reading thread, and the copy of the next batch
+    is started with non_blocking on a side stream before the current batch is
+    returned, so the copy overlaps with the computation on the current batch.
+    An event recorded after the copy of each batch lets the computation wait
+    for that copy only, not for the copy of the next batch queued behind it on
+    the side stream.
+
+    Args:
+        batches (iterable): The batches, as (inputs, labels).
+        train_device (str): The device of the training.
+        prefetch (int, optional): The number of batches read ahead. Defaults to 4.
+        async_copy (bool, optional): Whether to copy the batches to the GPU on a side stream. Defaults to False.
+    """
+
+    def __init__(self, batches, train_device, prefetch=4, async_copy=False):
+        self.batches = batches
+        self.train_device = torch.device(train_device)
+        self.prefetch = prefetch
+        self.use_cuda = async_copy and self.train_device.type == "cuda"
+        self.stream = torch.cuda.Stream(self.train_device) if self.use_cuda else None
+
+    def __len__(self):
+        return len(self.batches)
+
+    def pin(self, tensor):
+        if self.use_cuda and tensor.device.type == "cpu":
+            return tensor.pin_memory()
+        return tensor
+
+    def read_batches(self, batches_queue, stop):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for inputs, labels in self.batches:
+                batch = (
+                    (inputs[0], self.pin(inputs[1]), self.pin(inputs[2])),
+                    self.pin(labels),
+                )
+                if not put(batch):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(None)
+
+    def to_device(self, batch):
+        """Start the copy of a batch to the training device.
+
+        Returns:
+            tuple: The copied batch, and the event marking the end of its copy, None when not on a GPU.
+        """
+        inputs, labels = batch
+        if self.stream is None:
+            return (
+                (
+                    inputs[0],
+                    inputs[1].to(self.train_device),
+                    inputs[2].to(self.train_device),
+                ),
+                labels.to(self.train_device),
+            ), None
+        with torch.cuda.stream(self.stream):
+            batch = (
+                (
+                    inputs[0],
+                    inputs[1].to(self.train_device, non_blocking=True),
+                    inputs[2].to(self.train_device, non_blocking=True),
+                ),
+                labels.to(self.train_device, non_blocking=True),
+            )
+            copied = torch.cuda.Event()
+            copied.record(self.stream)
+        return batch, copied
+
+    def wait(self, batch, copied):
+        """Make the computation wait for the copy of a batch."""
+        if copied is not None:
+            current_stream = torch.cuda.current_stream(self.train_device)
+            current_stream.wait_event(copied)
+            inputs, labels = batch
+            # The memory of the batch must not be reused before the
+            # computation is done with it
+            for tensor in (inputs[1], inputs[2], labels):
+                tensor.record_stream(current_stream)
+        return batch
+
+    def __iter__(self):
+        batches_queue = queue.Queue(self.prefetch)
+        stop = threading.Event()
+        reader = threading.Thread(
+            target=self.read_batches, args=(batches_queue, stop), daemon=True
+        )
+        reader.start()
+
+        def get_next_batch():
+            batch = batches_queue.get()
+            if isinstance(batch, Exception):
+                raise batch
+            return None if batch is None else self.to_device(batch)
+
+        try:
+            next_batch = get_next_batch()
+            while next_batch is not None:
+                batch, copied = next_batch
+                next_batch = get_next_batch()
+                yield self.wait(batch, copied)
+        finally:
+            stop.set()
+
+
 def mape_criterion(inputs, targets):
     eps = 1e-5
     return 100 * torch.mean(torch.abs(targets - inputs) / (targets + eps))
@@ -30,6 +156,7 @@ def train_model(
     log_every=5,
     logger=None,
     train_device="cpu",
+    async_copy=False,
 ):
     since = time.time()
     losses = []
@@ -37,13 +164,6 @@ def train_model(
     best_loss = math.inf
     best_model = None
     hash = random.getrandbits(16)
-    dataloader_size = {"train": 0, "val": 0}
-    for item in dataloader["train"]:
-        label = item[1]
-        dataloader_size["train"] += label.shape[0]
-    for item in dataloader["val"]:
-        label = item[1]
-        dataloader_size["val"] += label.shape[0]
 
     model = model.to(train_device)
 
@@ -62,16 +182,14 @@ def train_model(
             else:
                 model.eval()
             running_loss = 0.0
-            pbar = tqdm(dataloader[phase])
-            for inputs, labels in pbar:
-                original_device = labels.device
-                inputs = (
-                    inputs[0],
-                    inputs[1].to(train_device),
-                    inputs[2].to(train_device),
+            nb_datapoints = 0
+            # The batches are read ahead of their use
+            pbar = tqdm(
+                BatchPrefetcher(
+                    dataloader[phase], train_device, async_copy=async_copy
                 )
-                labels = labels.to(train_device)
-
+            )
+            for inputs, labels in pbar:
                 optimizer.zero_grad()
 
                 with torch.set_grad_enabled(phase == "train"):
@@ -86,10 +204,10 @@ def train_model(
 
                 pbar.set_description("Loss: {:.3f}".format(loss.item()))
                 running_loss += loss.item() * labels.shape[0]
-                labels = labels.to(original_device)
+                nb_datapoints += labels.shape[0]
                 epoch_end = time.time()
 
-            epoch_loss = running_loss / dataloader_size[phase]
+            epoch_loss = running_loss / nb_datapoints
 
             if phase == "val":
                 losses.append((train_loss, epoch_loss))
@@ -0,0 +1,269 @@
+import argparse
+import copy
+import json
+import os
+import time
+import traceback
+
+import numpy as np
+import ray
+import ray.rllib.agents.ppo as ppo
+from ray.rllib.models.catalog import ModelCatalog
+from ray.rllib.policy.sample_batch import SampleBatch
+from ray.tune.registry import register_env
+
+from rl_interface.action import Action
+from rl_interface.environment import TiramisuScheduleEnvironment
+from rl_interface.model import TiramisuModelMult
+from utils.environment_variables import configure_env_variables
+from utils.global_ray_variables import Actor, GlobalVarActor
+from utils.rl_autoscheduler_config import (RLAutoSchedulerConfig,
+                                           dict_to_config, parse_yaml_file,
+                                           read_yaml_file)
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-workers", default=-1, type=int)
+    parser.add_argument("--checkpoint", default=None, type=str)
+    parser.add_argument("--beam-width",
+                        default=4,
+                        type=int,
+                        help="Number of partial schedules kept per depth")
+    parser.add_argument("--expansions",
+                        default=3,
+                        type=int,
+                        help="Number of policy actions expanded per schedule")
+    parser.add_argument("--time-budget",
+                        default=600.0,
+                        type=float,
+                        help="Search time in seconds per program, the final "
+                        "measurements excluded")
+    parser.add_argument("--output", default="beam_results.json", type=str)
+    return parser.parse_args()
+
+
+class BeamSearch:
+    """Searches the schedules of a program with the trained policy and the
+    surrogate model, executing only the best schedules found.
+
+    A candidate is the list of actions of a schedule. At each depth, the
+    policy proposes its `expansions` most likely legal actions for every
+    candidate of the beam, all the new schedules are scored with the
+    surrogate model in a single batch, and the `beam_width` best ones form the
+    next beam. Once the beam is empty, the depth limit is reached or the time
+    budget is spent, the best finished and unfinished candidates are measured
+    for real.
+
+    The environment cannot be copied (the program holds compiler and harness
+    processes), so a candidate is rebuilt by replaying its actions on a new
+    empty schedule. The legality results are cached, so a replay does not
+    compile anything twice.
+
+    Args:
+        env (TiramisuScheduleEnvironment): The environment, reset on the program to schedule.
+        policy (Policy): The trained policy.
+        beam_width (int): The number of candidates kept per depth.
+        expansions (int): The number of actions expanded per candidate.
+        time_budget (float): The search time in seconds.
+    """
+
+    def __init__(self, env, policy, beam_width=4, expansions=3,
+                 time_budget=600.0):
+        self.env = env
+        self.policy = policy
+        self.beam_width = beam_width
+        self.expansions = expansions
+        self.time_budget = time_budget
+
+    def get_top_actions(self, observation):
+        """Get the most likely legal actions of the policy in a state."""
+        _, _, extra_fetches = self.policy.compute_single_action(observation,
+                                                                explore=False)
+        logits = np.asarray(extra_fetches[SampleBatch.ACTION_DIST_INPUTS])
+        legal_actions = np.flatnonzero(observation["action_mask"])
+        return legal_actions[np.argsort(
+            -logits[legal_actions])][:self.expansions].tolist()
+
+    def replay(self, actions):
+        """Rebuild the schedule of a list of actions.
+
+        Returns:
+            tuple: The observation, whether the schedule is finished, and whether all the actions were applied.
+        """
+        observation = self.env.restart_schedule()
+        controller = self.env.schedule_controller
+        done = False
+        try:
+            for raw_action in actions:
+                action = Action(raw_action, self.env.schedule_object.it_dict,
+                                self.env.schedule_object.common_it)
+                _, _, done, info = controller.apply_action(action)
+                if "illegal_action" in info:
+                    return observation, done, False
+                observation = self.env.schedule_object.get_representation()
+        except Exception:
+            return observation, done, False
+        finally:
+            self.env.lc_data.update(controller.get_legality_data())
+        done = done or controller.depth == self.env.schedule_object.MAX_DEPTH \
+            or len(actions) >= 20
+        return observation, done, True
+
+    def expand(self, beam):
+        """Expand every candidate of the beam with the top actions of the policy.
+
+        Returns:
+            list: The new candidates as (actions, schedule_str, schedule_dict, done).
+        """
+        children = []
+        seen_schedules = set()
+        for actions in beam:
+            observation, _, _ = self.replay(actions)
+            for raw_action in self.get_top_actions(observation):
+                if time.time() > self.deadline:
+                    return children
+                child_actions = actions + [raw_action]
+                _, done, applied = self.replay(child_actions)
+                schedule_str = self.env.schedule_object.schedule_str
+                # Illegal actions and already reached schedules are dropped
+                if not applied or schedule_str in seen_schedules:
+                    continue
+                seen_schedules.add(schedule_str)
+                children.append(
+                    (child_actions, schedule_str,
+                     copy.deepcopy(self.env.schedule_object.schedule_dict),
+                     done))
+        return children
+
+    def search(self):
+        """Search the schedules of the current program of the environment.
+
+        Returns:
+            dict: The best measured schedule, its speedup and search statistics.
+        """
+        start_time = time.time()
+        self.deadline = start_time + self.time_budget
+        beam = [[]]
+        scored = []
+        nb_scored = 0
+        while beam and time.time() < self.deadline:
+            children = self.expand(beam)
+            if not children:
+                break
+            predicted_speedups = self.env.schedule_controller.predict_speedups(
+                [schedule_dict for _, _, schedule_dict, _ in children])
+            nb_scored += len(children)
+            scored += [(predicted_speedup, actions, schedule_str, done)
+                       for predicted_speedup, (actions, schedule_str, _, done)
+                       in zip(predicted_speedups, children)]
+            children = sorted(zip(predicted_speedups, children),
+                              key=lambda child: -child[0])
+            beam = [
+                actions for _, (actions, _, _, done) in children if not done
+            ][:self.beam_width]
+        search_time = time.time() - start_time
+
+        # Only the best predicted schedules are executed
+        finalists = sorted(scored, key=lambda candidate: -candidate[0])
+        best = {"schedule_str": "", "speedup": 1.0, "actions": []}
+        for predicted_speedup, actions, schedule_str, _ in finalists[:self.
+                                                                      beam_width]:
+            self.replay(actions)
+            try:
+                speedup = self.env.schedule_controller.get_final_score()
+            except Exception:
+                print("Failed measuring", schedule_str, traceback.format_exc())
+                continue
+            print(f"{schedule_str}: predicted {predicted_speedup}, "
+                  f"measured {speedup}")
+            if speedup > best["speedup"]:
+                best = {
+                    "schedule_str": schedule_str,
+                    "speedup": speedup,
+                    "actions": actions
+                }
+        best["search_time"] = search_time
+        best["nb_scored_schedules"] = nb_scored
+        best["nb_measured_schedules"] = min(len(finalists), self.beam_width)
+        return best
+
+
+def main(config: RLAutoSchedulerConfig, args):
+    if args.checkpoint is None: return
+    configure_env_variables(config)
+    best_checkpoint = os.path.join(config.ray.base_path, args.checkpoint)
+    with ray.init(num_cpus=config.ray.ray_num_cpus):
+        progs_list_registery = GlobalVarActor.remote(
+            config.environment.programs_file,
+            config.environment.dataset_path,
+            num_workers=config.ray.num_workers,
+            eval_cache_file=config.environment.eval_cache_file,
+            checkpoint_interval=config.environment.checkpoint_interval,
+            checkpoint_max_pending=config.environment.checkpoint_max_pending)
+        shared_variable_actor = Actor.remote(progs_list_registery)
+
+        register_env(
+            "Tiramisu_env_v1",
+            lambda a: TiramisuScheduleEnvironment(config, shared_variable_actor
+                                                  ),
+        )
+        ModelCatalog.register_custom_model("tiramisu_model_v1",
+                                           TiramisuModelMult)
+
+        agent = ppo.PPOTrainer(
+            env="Tiramisu_env_v1",
+            config={
+                "num_workers": config.ray.num_workers,
+                "batch_mode": "complete_episodes",
+                "train_batch_size": 1024,
+                "sgd_minibatch_size": 256,
+                "lr": 1e-4,
+                "num_sgd_iter": 4,
+                "explore": False,
+                "framework": "torch",
+                "_disable_preprocessor_api": True,
+                "model": {
+                    "custom_model": "tiramisu_model_v1",
+                    "custom_model_config": {
+                        "layer_sizes": list(config.model.layer_sizes),
+                        "drops": list(config.model.drops),
+                    }
+                },
+            },
+        )
+
+        agent.restore(best_checkpoint)
+
+        env = TiramisuScheduleEnvironment(config, shared_variable_actor)
+        beam_search = BeamSearch(env,
+                                 agent.get_policy(),
+                                 beam_width=args.beam_width,
+                                 expansions=args.expansions,
+                                 time_budget=args.time_budget)
+
+        results = []
+        for prog_name in sorted(env.progs_list):
+            try:
+                env.reset(prog_name=prog_name)
+            except Exception:
+                print(f"Skipping {prog_name}, it cannot be loaded")
+                continue
+            result = beam_search.search()
+            result["prog"] = env.prog.name
+            print(result)
+            results.append(result)
+            with open(args.output, "w+") as file:
+                file.write(json.dumps(results))
+        ray.get(progs_list_registery.shutdown.remote())
+
+
+if __name__ == "__main__":
+    parsed_yaml_dict = parse_yaml_file(read_yaml_file("config.yaml"))
+    config = dict_to_config(parsed_yaml_dict)
+    args = get_arguments()
+    if args.num_workers != -1:
+        config.ray.num_workers = args.num_workers
+    config.environment.programs_file = "./val.json"
+    config.environment.dataset_path = "../benchmark"
+    main(config, args)
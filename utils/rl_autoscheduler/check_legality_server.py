@@ -0,0 +1,82 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from tiramisu_programs.cpp_file import CPP_File
+from tiramisu_programs.legality_server import LegalityServer
+from tiramisu_programs.program_model import ProgramModel
+from utils.environment_variables import configure_env_variables
+from utils.rl_autoscheduler_config import (RLAutoSchedulerConfig,
+                                           dict_to_config, parse_yaml_file,
+                                           read_yaml_file)
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Check that the legality server of program generators "
+        "compiles against the configured Tiramisu")
+    parser.add_argument("generators",
+                        nargs="*",
+                        help="The generators to check, defaults to the first "
+                        "programs of the dataset")
+    parser.add_argument("--num-programs", default=1, type=int)
+    return parser.parse_args()
+
+
+def get_dataset_generators(dataset_path, num_programs):
+    generators = []
+    for func_name in sorted(os.listdir(dataset_path)):
+        generator_file = os.path.join(dataset_path, func_name,
+                                      func_name + "_generator.cpp")
+        if os.path.isfile(generator_file):
+            generators.append(generator_file)
+        if len(generators) == num_programs:
+            break
+    return generators
+
+
+def check_server(config: RLAutoSchedulerConfig, generator_file):
+    """Emit the legality server of a generator and compile it.
+
+    Returns:
+        bool: Whether or not the server compiled.
+    """
+    with open(generator_file, "r") as f:
+        source = f.read()
+    model = ProgramModel.parse(source, None)
+    # The compilation command expects a path relative to the working directory
+    work_dir = tempfile.mkdtemp(prefix="legality_server_", dir=".")
+    try:
+        server_file = os.path.join(work_dir,
+                                   model.name + "_legality_server.cpp")
+        with open(server_file, "w") as f:
+            f.write(LegalityServer.get_server_code(model, source))
+        return CPP_File.compile_tiramisu_code(config, server_file,
+                                              "Checking legality server")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(config: RLAutoSchedulerConfig, generators):
+    configure_env_variables(config)
+    nb_failed = 0
+    for generator_file in generators:
+        if check_server(config, generator_file):
+            print(f"OK {generator_file}")
+        else:
+            nb_failed += 1
+            print(f"FAILED {generator_file}", file=sys.stderr)
+    return nb_failed
+
+
+if __name__ == "__main__":
+    parsed_yaml_dict = parse_yaml_file(read_yaml_file("config.yaml"))
+    config = dict_to_config(parsed_yaml_dict)
+    args = get_arguments()
+    generators = args.generators or get_dataset_generators(
+        config.environment.dataset_path, args.num_programs)
+    if not generators:
+        sys.exit("No generator to check")
+    sys.exit(1 if main(config, generators) else 0)
@@ -34,7 +34,10 @@ def main(config: RLAutoSchedulerConfig, checkpoint=None):
         progs_list_registery = GlobalVarActor.remote(
             config.environment.programs_file,
             config.environment.dataset_path,
-            num_workers=config.ray.num_workers)
+            num_workers=config.ray.num_workers,
+            eval_cache_file=config.environment.eval_cache_file,
+            checkpoint_interval=config.environment.checkpoint_interval,
+            checkpoint_max_pending=config.environment.checkpoint_max_pending)
         shared_variable_actor = Actor.remote(progs_list_registery)
 
         register_env(
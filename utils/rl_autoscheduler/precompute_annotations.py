@@ -0,0 +1,102 @@
+import argparse
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tiramisu_programs.annotation_store import (AnnotationStore,
+                                                get_source_hash)
+from tiramisu_programs.program_model import ProgramModel
+from tiramisu_programs.tiramisu_program import TiramisuProgram
+from tiramisu_programs.workspace import get_workspace
+from utils.environment_variables import configure_env_variables
+from utils.rl_autoscheduler_config import (RLAutoSchedulerConfig,
+                                           dict_to_config, parse_yaml_file,
+                                           read_yaml_file)
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Precompute the annotations of all the dataset programs")
+    parser.add_argument("--num-workers", default=os.cpu_count(), type=int)
+    parser.add_argument("--force",
+                        action="store_true",
+                        help="Recompute the annotations that are up to date")
+    return parser.parse_args()
+
+
+def get_program_name(generator_file):
+    """Get the name of a program, under which its annotations are stored."""
+    with open(generator_file, 'r') as f:
+        return ProgramModel.parse(f.read(), None).name
+
+
+def compute_annotations(config: RLAutoSchedulerConfig, func_name):
+    """Compile and run the generator of a program to get its annotations.
+
+    Returns:
+        tuple: The name of the program, the hash of its generator and its annotations.
+    """
+    # A one-shot query, there is no point in launching a legality server
+    config.tiramisu.legality_server = False
+    workspace = get_workspace(config.environment)
+    file = workspace.get_program_file(config.environment.dataset_path,
+                                      func_name)
+    prog = None
+    try:
+        prog = TiramisuProgram(config, file)
+        return prog.name, prog.program_hash, prog.compute_program_annotations()
+    finally:
+        if prog is not None:
+            prog.close()
+        workspace.remove(func_name)
+
+
+def main(config: RLAutoSchedulerConfig, num_workers, force=False):
+    configure_env_variables(config)
+    dataset_path = config.environment.dataset_path
+    store = AnnotationStore(config.environment.annotation_store_file)
+
+    pending = []
+    for func_name in sorted(os.listdir(dataset_path)):
+        generator_file = os.path.join(dataset_path, func_name,
+                                      func_name + "_generator.cpp")
+        if not os.path.isfile(generator_file):
+            continue
+        try:
+            name = get_program_name(generator_file)
+        except Exception:
+            # The worker reports why the generator cannot be loaded
+            pending.append(func_name)
+            continue
+        if force or not store.is_up_to_date(name,
+                                            get_source_hash(generator_file)):
+            pending.append(func_name)
+    print(f"{len(store)} programs in the store, {len(pending)} to compute")
+
+    nb_failed = 0
+    with ProcessPoolExecutor(num_workers) as executor:
+        futures = {
+            executor.submit(compute_annotations, config, func_name): func_name
+            for func_name in pending
+        }
+        for i, future in enumerate(as_completed(futures)):
+            try:
+                name, program_hash, annotations = future.result()
+            except Exception:
+                nb_failed += 1
+                print(f"Failed computing the annotations of {futures[future]}",
+                      file=sys.stderr)
+                traceback.print_exc()
+                continue
+            # The workers only compute, the store has a single writer
+            store.put(name, program_hash, annotations)
+            print(f"[{i + 1}/{len(pending)}] {name}")
+    print(f"Done, {len(store)} programs in the store, {nb_failed} failed")
+
+
+if __name__ == "__main__":
+    parsed_yaml_dict = parse_yaml_file(read_yaml_file("config.yaml"))
+    config = dict_to_config(parsed_yaml_dict)
+    args = get_arguments()
+    main(config, args.num_workers, args.force)
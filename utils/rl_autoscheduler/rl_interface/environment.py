@@ -14,7 +14,10 @@ import tiramisu_programs
 import torch
 
 import rl_interface
+from tiramisu_programs.surrogate_model_utils.json_to_tensor import \
+    LoopsDepthException
 from utils.environment_variables import configure_env_variables
+from utils.profiler import configure_profiler
 
 np.seterr(invalid="raise")
 
@@ -23,7 +26,6 @@ class TiramisuScheduleEnvironment(gym.Env):
     '''
     The reinforcement learning environment used by the GYM. 
     '''
-    SAVING_FREQUENCY = 500
 
     def __init__(self, config, shared_variable_actor):
         print("Configuring the environment variables")
@@ -43,11 +45,15 @@ class TiramisuScheduleEnvironment(gym.Env):
         print("Loading data from {} \n".format(config.environment.dataset_path))    # FIX that here
         self.shared_variable_actor = shared_variable_actor
         self.id = ray.get(self.shared_variable_actor.increment.remote())
+        self.profiler = configure_profiler(config.environment.profile, self.id)
+        self.nb_episodes = 0
         # out = subprocess.run(f"echo \"Worker {self.id} running on hostname $(hostname)\" >> hostnames.txt", check=True ,shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         self.progs_list = ray.get(
             self.shared_variable_actor.get_progs_list.remote(self.id))
         self.progs_dict = ray.get(
             self.shared_variable_actor.get_progs_dict.remote())
+        self.lc_data = dict()
+        self.lc_data_version = 0
         print("Loaded the dataset!")
 
         self.scheds = tiramisu_programs.schedule_utils.ScheduleUtils.get_schedules_str(
@@ -69,52 +75,62 @@ class TiramisuScheduleEnvironment(gym.Env):
             "computations_indices":
             gym.spaces.Box(low=-np.inf, high=np.inf, shape=(12, 5)),
             "prog_tree":
-            gym.spaces.Box(low=-np.inf, high=np.inf, shape=(5000,))
+            gym.spaces.Box(low=-1, high=np.inf, shape=(12, 18))
         })
 
         self.dataset_path = config.environment.dataset_path
+        self.workspace = tiramisu_programs.get_workspace(config.environment)
         self.depth = 0
         self.nb_executions = 5
         self.episode_total_time = 0
         self.prog_ind = 0
         self.steps = 0
         self.previous_cpp_file = None
+        self.prog = None
 
-    def reset(self, file=None):
+    def reset(self, file=None, prog_name=None):
         """
         Reset the environment to the intial state. A state is defined as a random program with the schedule applied to it.
         The initial state is defined as a random program with no schedules applied to it.
         the input file is just a placeholder required by the gym.
+        prog_name selects the program instead of drawing it randomly.
         Returns: The current intitial state.
         """
 
         print("\n----------Resetting the environment-----------\n")
         self.episode_total_time = time.time()
+        nb_attempts = 0
         while True:
+            nb_attempts += 1
             try:
 
                 # Choosing a random program
+                if self.prog is not None:
+                    # The harnesses and the program reference each other,
+                    # their processes are stopped explicitly
+                    self.prog.close()
+                    self.prog = None
                 if self.previous_cpp_file:
-                    tiramisu_programs.cpp_file.CPP_File.clean_cpp_file(
-                    self.dataset_path, self.previous_cpp_file)
-                random_prog_index = random.randint(0, len(self.progs_list) - 1)
-                file = tiramisu_programs.cpp_file.CPP_File.get_cpp_file(
-                    self.dataset_path, self.progs_list[random_prog_index])
-                self.previous_cpp_file = self.progs_list[random_prog_index]
+                    self.workspace.release(self.previous_cpp_file)
+                if prog_name is None:
+                    random_prog_index = random.randint(0, len(self.progs_list) - 1)
+                    chosen_prog = self.progs_list[random_prog_index]
+                else:
+                    chosen_prog = prog_name
+                file = self.workspace.get_program_file(
+                    self.dataset_path, chosen_prog)
+                self.previous_cpp_file = chosen_prog
                 self.prog = tiramisu_programs.tiramisu_program.TiramisuProgram(self.config, file)
 
                 
                 print(f"Trying with program {self.prog.name}")
-                self.schedule_object = tiramisu_programs.schedule.Schedule(self.prog)
-                self.schedule_controller = tiramisu_programs.schedule_controller.ScheduleController(
-                    schedule=self.schedule_object,
-                    nb_executions=self.nb_executions,
-                    scheds=self.scheds,
-                    config=self.config)
-                lc_data = ray.get(self.shared_variable_actor.get_lc_data.remote())
-                self.schedule_controller.load_legality_data(lc_data)
-                self.obs = self.schedule_object.get_representation()
-                if self.config.tiramisu.env_type == "cpu":
+                with self.profiler.span("actor.get_lc_data"):
+                    self.lc_data_version, lc_data_delta = ray.get(
+                        self.shared_variable_actor.get_lc_data.remote(
+                            self.lc_data_version))
+                self.lc_data.update(lc_data_delta)
+                self.obs = self.restart_schedule()
+                if self.config.tiramisu.env_type in ("cpu", "hybrid"):
                     if self.progs_dict == {} or self.prog.name not in self.progs_dict.keys(
                     ):
                         print("Getting the intitial exe time by execution")
@@ -135,21 +151,57 @@ class TiramisuScheduleEnvironment(gym.Env):
                     self.progs_dict[self.prog.name][
                         "initial_execution_time"] = self.prog.initial_execution_time
 
+            except LoopsDepthException as e:
+                print(f"Skipping program {chosen_prog}: {e}")
+                if prog_name is not None:
+                    raise
+                continue
             except:
                 print("RESET_ERROR_STDERR", traceback.format_exc(), file=sys.stderr)
                 print("RESET_ERROR_STDOUT", traceback.format_exc(), file=sys.stdout)
+                if prog_name is not None:
+                    raise
                 continue
 
             self.steps = 0
             self.search_time = time.time()
             print(f"Choosing program {self.prog.name}")
+            print("Representation cache:",
+                  tiramisu_programs.schedule.Schedule.
+                  get_representation_cache_stats())
+            if self.schedule_controller.correction_table is not None:
+                print("Hybrid evaluation:",
+                      self.schedule_controller.correction_table.get_stats())
+            self.profiler.add_event("reset",
+                                    self.episode_total_time,
+                                    time.time() - self.episode_total_time,
+                                    program=self.prog.name,
+                                    nb_attempts=nb_attempts)
             return self.obs
 
+    def restart_schedule(self):
+        """Start a new empty schedule of the current program, without choosing
+        a new program.
+
+        Returns: The representation of the program without schedule.
+        """
+        self.schedule_object = tiramisu_programs.schedule.Schedule(self.prog)
+        self.schedule_controller = tiramisu_programs.schedule_controller.ScheduleController(
+            schedule=self.schedule_object,
+            nb_executions=self.nb_executions,
+            scheds=self.scheds,
+            config=self.config,
+            shared_variable_actor=self.shared_variable_actor,
+            worker_id=self.id)
+        self.schedule_controller.load_legality_data(self.lc_data)
+        return self.schedule_object.get_representation()
+
     def step(self, raw_action):
         """
         Apply a transformation on a program. If the action raw_action is legal, it is applied. If not, it is ignored and not added to the schedule.
         Returns: The current state after eventually applying the transformation, and the reward that the agent received for taking the action.
         """
+        step_start_time = time.time()
         action_name = rl_interface.Action.ACTIONS_ARRAY[raw_action]
         print("\n ----> {} [ {} ] \n".format(
             action_name, self.schedule_object.schedule_str))
@@ -164,7 +216,9 @@ class TiramisuScheduleEnvironment(gym.Env):
             action = rl_interface.Action(raw_action,
                                          self.schedule_object.it_dict,
                                          self.schedule_object.common_it)
-            _, speedup, done, info = self.schedule_controller.apply_action(action)
+            with self.profiler.span("apply_action", action=action_name):
+                _, speedup, done, info = self.schedule_controller.apply_action(
+                    action)
             print("Obtained speedup: ",speedup)
             
         except Exception as e:
@@ -181,6 +235,9 @@ class TiramisuScheduleEnvironment(gym.Env):
                 print("Already Applied exception")
                 info = {"more than one time": True}
                 done = False
+                self.profiler.add_event("step", step_start_time,
+                                        time.time() - step_start_time,
+                                        "error")
                 return self.obs, reward, done, info
 
             else:
@@ -196,11 +253,28 @@ class TiramisuScheduleEnvironment(gym.Env):
             done = True
         if done:
             print("\n ************** End of an episode ************")
-            speedup = self.schedule_controller.get_final_score()
-            ray.get(self.shared_variable_actor.update_lc_data.remote(self.schedule_controller.get_legality_data()))
+            with self.profiler.span("final_score"):
+                speedup = self.schedule_controller.get_final_score()
+            with self.profiler.span("actor.update_lc_data"):
+                ray.get(self.shared_variable_actor.update_lc_data.remote(self.schedule_controller.get_legality_data()))
         reward_object = rl_interface.Reward(speedup)
         reward = reward_object.reward
-
-        if self.total_steps % self.SAVING_FREQUENCY:
-            ray.get(self.shared_variable_actor.write_lc_data.remote())
+        self.profiler.add_event("step", step_start_time,
+                                time.time() - step_start_time,
+                                "error" if "error" in info else None,
+                                action=action_name)
+        if done:
+            self.nb_episodes += 1
+            if self.nb_episodes % self.config.environment.profile_dump_interval == 0:
+                self.dump_profile()
         return self.obs, reward, done, info
+
+    def dump_profile(self):
+        """Export the profile of the worker and report it to the Ray metrics."""
+        if not self.profiler.enabled:
+            return
+        try:
+            self.profiler.dump(self.config.environment.profile_dir)
+            self.profiler.report_ray_metrics()
+        except Exception:
+            print("PROFILE_ERROR", traceback.format_exc(), file=sys.stderr)
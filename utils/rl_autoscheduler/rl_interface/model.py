@@ -1,7 +1,5 @@
 import math
 import torch
-import json
-import traceback
 import numpy as np
 from ray.rllib.models.torch.torch_modelv2 import TorchModelV2
 from ray.rllib.utils.framework import try_import_torch
@@ -12,7 +10,7 @@ from ray.rllib.models.torch.torch_modelv2 import TorchModelV2
 from ray.rllib.models.torch.misc import SlimFC, normc_initializer
 from ray.rllib.utils.annotations import override
 from ray.rllib.utils.framework import try_import_torch
-from tiramisu_programs.surrogate_model_utils.json_to_tensor import get_tree_footprint
+from tiramisu_programs.surrogate_model_utils.json_to_tensor import TREE_MAX_NODES, decode_tree, get_tree_footprint
 
 train_device_name = 'cpu'  # choose training/storing device, either 'cuda:X' or 'cpu'
 store_device_name = 'cpu'
@@ -91,6 +89,9 @@ class TiramisuModelMult(TorchModelV2, nn.Module):
             prev_layer_size = size
         
         self._rec_loop_embd_layers = nn.Sequential(*rec_loop_embd_layers)
+        # Decoded trees with their index tensors, by footprint and device
+        self._trees = dict()
+        self._encodings_footprints = dict()
         #Prediction Layer
         predict_layers=[]
         
@@ -135,26 +136,8 @@ class TiramisuModelMult(TorchModelV2, nn.Module):
         
         #recursive loop embedding layer
         loops_tensor=input_dict["obs_flat"]["loops_representation"]
-        child_list=input_dict["obs_flat"]["child_list"][:][:][0][0]
-        has_comps=input_dict["obs_flat"]["has_comps"][0].tolist()
-        try:
-            prog_tree_tensor = np.array(input_dict["obs_flat"]["prog_tree"])
-            prog_tree_string = "".join(list(prog_tree_tensor[0].view('U1'))).strip("_")
-            prog_tree = json.loads(prog_tree_string)
-            # tree_footprint = get_tree_footprint(prog_tree)
-        except:
-            pass
-        # prog_tree_string =  # FIX THIS  --> Compare tree footprint
-        computations_indices=input_dict["obs_flat"]["computations_indices"][:][:][0][0]
-
-
-        try:
-            loop_index=0
-            prog_embedding=self.get_hidden_state(prog_tree,comps_embeddings,loops_tensor)
-        except:
-            print("Actor Critic",traceback.format_exc())
-            prog_tree = {"child_list":[]}
-            prog_embedding = torch.zeros((loops_tensor.shape[0],180))
+        prog_tree_tensor=input_dict["obs_flat"]["prog_tree"]
+        prog_embedding=self.get_batch_hidden_state(prog_tree_tensor,comps_embeddings,loops_tensor)
         
         # prediction layer
         self._features=self._prediction_layers(prog_embedding.view(prog_embedding.shape[0],-1))
@@ -171,6 +154,55 @@ class TiramisuModelMult(TorchModelV2, nn.Module):
         assert self._features is not None, "must call forward() first"
         return self._value.squeeze(1)
 
+    def get_batch_hidden_state(self, prog_tree_tensor, comps_embeddings, loops_tensor):
+        """Embed a batch of programs with possibly different trees.
+
+        The samples are grouped by tree footprint, and the recursive embedding
+        runs once per group on the samples of that group.
+        """
+        batch_size = prog_tree_tensor.shape[0]
+        tree_encodings, tree_ids = torch.unique(
+            prog_tree_tensor.reshape(batch_size, -1), dim=0, return_inverse=True)
+        footprints_samples = dict()
+        for i, tree_encoding in enumerate(tree_encodings):
+            footprint = self.get_footprint(tree_encoding, comps_embeddings.device)
+            footprints_samples.setdefault(footprint, []).append(
+                (tree_ids == i).nonzero().squeeze(1))
+        samples_order = []
+        embeddings = []
+        for footprint, samples in footprints_samples.items():
+            samples = torch.cat(samples)
+            embeddings.append(self.get_hidden_state(
+                self._trees[(footprint, comps_embeddings.device)],
+                comps_embeddings[samples], loops_tensor[samples]))
+            samples_order.append(samples)
+        # Put the samples back in their original order
+        return torch.cat(embeddings)[torch.argsort(torch.cat(samples_order))]
+
+    def get_footprint(self, tree_encoding, device):
+        """Get the footprint of an encoded tree. The first time a footprint is
+        seen on a device, its tree is decoded and its index tensors are built
+        once on that device."""
+        key = tree_encoding.cpu().numpy().tobytes()
+        prog_tree = None
+        if key not in self._encodings_footprints:
+            prog_tree = decode_tree(tree_encoding.view(TREE_MAX_NODES, -1).tolist())
+            self._encodings_footprints[key] = get_tree_footprint(prog_tree)
+        footprint = self._encodings_footprints[key]
+        if (footprint, device) not in self._trees:
+            if prog_tree is None:
+                prog_tree = decode_tree(tree_encoding.view(TREE_MAX_NODES, -1).tolist())
+            self._trees[(footprint, device)] = self.add_index_tensors(prog_tree, device)
+        return footprint
+
+    def add_index_tensors(self, node, device):
+        node["loop_index_tensor"] = torch.tensor([node["loop_index"]], device=device)
+        node["computations_indices_tensor"] = torch.tensor(
+            node["computations_indices"], dtype=torch.long, device=device)
+        for child in node["child_list"]:
+            self.add_index_tensors(child, device)
+        return node
+
     def get_hidden_state(self, node, comps_embeddings, loops_tensor):
         nodes_list = []
         for n in node["child_list"]:
@@ -185,7 +217,7 @@ class TiramisuModelMult(TorchModelV2, nn.Module):
             )
         if node["has_comps"]:
             selected_comps_tensor = torch.index_select(
-                comps_embeddings, 1, torch.tensor(node["computations_indices"])
+                comps_embeddings, 1, node["computations_indices_tensor"]
             )
             lstm_out, (comps_h_n, comps_c_n) = self.comps_lstm(selected_comps_tensor)
             comps_h_n = comps_h_n.permute(1, 0, 2)
@@ -194,7 +226,7 @@ class TiramisuModelMult(TorchModelV2, nn.Module):
                 comps_embeddings.shape[0], -1, -1
             )
         selected_loop_tensor = torch.index_select(
-            loops_tensor, 1, torch.tensor(node["loop_index"])
+            loops_tensor, 1, node["loop_index_tensor"]
         )
         x = torch.cat((nodes_h_n, comps_h_n, selected_loop_tensor), 2)
         x = self._rec_loop_embd_layers(x)
@@ -1,9 +1,16 @@
+from .annotation_store import *
+from .correction_table import *
 from .cpp_file import *
+from .legality_server import *
+from .measurement_harness import *
+from .measurement_pool import *
 from .optimization import *
+from .program_model import *
 from .schedule import *
 from .schedule_utils import *
 from .schedule_controller import *
 from .tiramisu_program import *
+from .workspace import *
 from .surrogate_model_utils.json_to_tensor import *
 from .surrogate_model_utils.modeling import *
 
@@ -14,5 +21,9 @@ __all__ = [
     "NumpyEncoder", "LCException", "SkewParamsException", "IsTiledException",
     "IsInterchangedException", "IsSkewedException", "IsUnrolledException",
     "IsParallelizedException", "IsReversedException", "SkewUnrollException",
-    "ScheduleUtils", "Schedule", "TiramisuProgram", "InternalExecException"
+    "ScheduleUtils", "Schedule", "TiramisuProgram", "InternalExecException",
+    "LegalityServer", "MeasurementHarness", "MeasurementPool",
+    "get_measurement_pool", "AnnotationStore", "get_annotation_store",
+    "get_source_hash", "Workspace", "get_workspace", "CorrectionTable",
+    "get_correction_table", "ProgramModel"
 ]
\ No newline at end of file
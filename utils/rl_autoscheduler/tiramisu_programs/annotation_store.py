@@ -0,0 +1,141 @@
+import hashlib
+import json
+import mmap
+import os
+import threading
+
+_annotation_stores = dict()
+_annotation_stores_lock = threading.Lock()
+
+
+def get_source_hash(file_path):
+    """Hash a program generator the same way TiramisuProgram.program_hash does."""
+    with open(file_path, 'r') as f:
+        return hashlib.sha256(f.read().encode('utf-8')).hexdigest()
+
+
+class AnnotationStore():
+    """Dataset-level store of the program annotations.
+
+    The annotations only depend on the program generator, so they are computed
+    once for the whole dataset (see precompute_annotations.py) instead of
+    compiling a generator at every episode reset.
+
+    On disk the store is an append-only file with one program per line:
+    `<name>\\t<source sha256>\\t<annotations JSON>`. Only the names, hashes and
+    line offsets are kept in memory, the JSON of a program is read through a
+    memory map when it is requested. A later line of the same program
+    overrides the former ones, and an entry whose hash differs from the
+    current source is considered missing, so editing a generator invalidates
+    its annotations.
+
+    Args:
+        path (str): The path to the store file, created on the first write.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = dict()
+        self.indexed_size = 0
+        self.file = None
+        self.mmap = None
+        self.lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Index the lines appended to the file since the last refresh,
+        possibly by other processes."""
+        if not os.path.isfile(self.path):
+            return
+        size = os.path.getsize(self.path)
+        if size <= self.indexed_size:
+            return
+        if self.mmap is not None:
+            self.mmap.close()
+            self.file.close()
+        self.file = open(self.path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        offset = self.indexed_size
+        while offset < len(self.mmap):
+            end = self.mmap.find(b'\n', offset)
+            # A line being written by another process is indexed next time
+            if end == -1:
+                break
+            fields = self.mmap[offset:offset +
+                               min(end - offset, 256)].split(b'\t', 2)
+            if len(fields) == 3:
+                name, source_hash = fields[0].decode(), fields[1].decode()
+                json_start = offset + len(fields[0]) + len(fields[1]) + 2
+                self.index[name] = (source_hash, json_start, end)
+            offset = end + 1
+        self.indexed_size = offset
+
+    def get(self, name, source_hash=None):
+        """Get the annotations of a program.
+
+        Args:
+            name (str): The name of the program.
+            source_hash (str, optional): The hash of the current program generator. Defaults to None, no validation.
+
+        Returns:
+            dict: A new copy of the annotations, or None if they are missing or outdated.
+        """
+        with self.lock:
+            # The entry may have been added or updated by another process
+            if name not in self.index or (source_hash is not None and
+                                          self.index[name][0] != source_hash):
+                self.refresh()
+            if name not in self.index:
+                return None
+            stored_hash, start, end = self.index[name]
+            if source_hash is not None and stored_hash != source_hash:
+                return None
+            try:
+                return json.loads(self.mmap[start:end])
+            except ValueError:
+                return None
+
+    def put(self, name, source_hash, annotations):
+        """Append the annotations of a program to the store."""
+        line = '{}\t{}\t{}\n'.format(
+            name, source_hash,
+            json.dumps(annotations, separators=(',', ':'))).encode('utf-8')
+        with self.lock:
+            # A single write on a file opened in append mode, so that
+            # concurrent writers do not interleave their lines
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            self.refresh()
+
+    def is_up_to_date(self, name, source_hash):
+        """Check whether the stored annotations of a program match its
+        current generator.
+
+        Args:
+            name (str): The name of the program, the key used by get and put.
+            source_hash (str): The hash of the current program generator.
+        """
+        with self.lock:
+            return name in self.index and self.index[name][0] == source_hash
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.file.close()
+        self.mmap = None
+        self.file = None
+
+
+def get_annotation_store(path):
+    """Get the annotation store of a file, opening it on first use in the process."""
+    with _annotation_stores_lock:
+        if path not in _annotation_stores:
+            _annotation_stores[path] = AnnotationStore(path)
+        return _annotation_stores[path]
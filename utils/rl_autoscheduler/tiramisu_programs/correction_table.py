@@ -0,0 +1,131 @@
+import heapq
+import math
+import threading
+from collections import defaultdict
+
+_correction_table = None
+_correction_table_lock = threading.Lock()
+
+
+class CorrectionTable():
+    """Corrects the speedups predicted by the surrogate model with the real
+    measurements, and decides which schedules are worth measuring.
+
+    The correction of a program is the geometric mean of the ratios between
+    the measured and the predicted speedups of its measured schedules. Programs
+    without measurements use the correction of all the programs.
+
+    A schedule is measured while the correction of its program is not reliable
+    yet (fewer than `warmup` measurements, or a spread of the log ratios above
+    `max_uncertainty`), when its predicted speedup is among the `top_k`
+    best predictions of its program so far, or when the prediction is not a
+    finite positive number. The other schedules are rewarded with their
+    corrected prediction. Speedups that are not finite positive numbers are
+    never recorded, so they cannot corrupt the corrections.
+
+    Args:
+        top_k (int, optional): The number of best predicted schedules per program that are measured. Defaults to 3.
+        warmup (int, optional): The number of measurements per program before trusting the correction. Defaults to 2.
+        max_uncertainty (float, optional): The maximum standard deviation of the log ratios to trust the correction. Defaults to 0.5.
+        max_history (int, optional): The number of most recent ratios kept per program. Defaults to 100.
+    """
+
+    def __init__(self, top_k=3, warmup=2, max_uncertainty=0.5, max_history=100):
+        self.top_k = top_k
+        self.warmup = warmup
+        self.max_uncertainty = max_uncertainty
+        self.max_history = max_history
+        self.log_ratios = defaultdict(list)
+        self.best_predictions = defaultdict(list)
+        self.nb_measurements = 0
+        self.nb_predictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_valid_speedup(speedup):
+        return math.isfinite(speedup) and speedup > 0
+
+    def get_log_ratios(self, prog_name):
+        if self.log_ratios.get(prog_name):
+            return self.log_ratios[prog_name]
+        return [
+            log_ratio for log_ratios in self.log_ratios.values()
+            for log_ratio in log_ratios
+        ]
+
+    def get_correction(self, prog_name):
+        with self.lock:
+            log_ratios = self.get_log_ratios(prog_name)
+            if not log_ratios:
+                return 1.0
+            return math.exp(sum(log_ratios) / len(log_ratios))
+
+    def get_uncertainty(self, prog_name):
+        """Get the standard deviation of the log ratios of a program, inf if
+        there are not enough measurements to estimate it."""
+        with self.lock:
+            log_ratios = self.log_ratios.get(prog_name, [])
+            if len(log_ratios) < 2:
+                return math.inf
+            mean = sum(log_ratios) / len(log_ratios)
+            return math.sqrt(
+                sum((log_ratio - mean)**2
+                    for log_ratio in log_ratios) / (len(log_ratios) - 1))
+
+    def correct(self, prog_name, predicted_speedup):
+        return predicted_speedup * self.get_correction(prog_name)
+
+    def should_measure(self, prog_name, predicted_speedup):
+        # A non positive or non finite prediction gives no usable execution time
+        if not self.is_valid_speedup(predicted_speedup):
+            return True
+        if len(self.log_ratios.get(prog_name, [])) < self.warmup:
+            return True
+        if self.get_uncertainty(prog_name) > self.max_uncertainty:
+            return True
+        # The correction is the same for all the schedules of a program, the
+        # raw predictions give the same ranking
+        with self.lock:
+            best_predictions = self.best_predictions[prog_name]
+            return len(best_predictions
+                       ) < self.top_k or predicted_speedup >= best_predictions[0]
+
+    def add_prediction(self, prog_name, predicted_speedup):
+        if not self.is_valid_speedup(predicted_speedup):
+            return
+        with self.lock:
+            self.nb_predictions += 1
+            best_predictions = self.best_predictions[prog_name]
+            if len(best_predictions) < self.top_k:
+                heapq.heappush(best_predictions, predicted_speedup)
+            elif predicted_speedup > best_predictions[0]:
+                heapq.heapreplace(best_predictions, predicted_speedup)
+
+    def add_measurement(self, prog_name, predicted_speedup, measured_speedup):
+        if not (self.is_valid_speedup(predicted_speedup)
+                and self.is_valid_speedup(measured_speedup)):
+            return
+        with self.lock:
+            self.nb_measurements += 1
+            log_ratios = self.log_ratios[prog_name]
+            log_ratios.append(math.log(measured_speedup / predicted_speedup))
+            del log_ratios[:-self.max_history]
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "nb_predictions": self.nb_predictions,
+                "nb_measurements": self.nb_measurements,
+                "nb_programs": len(self.log_ratios)
+            }
+
+
+def get_correction_table(tiramisu_config):
+    """Get the correction table of the process, creating it on first use."""
+    global _correction_table
+    with _correction_table_lock:
+        if _correction_table is None:
+            _correction_table = CorrectionTable(
+                tiramisu_config.hybrid_top_k, tiramisu_config.hybrid_warmup,
+                tiramisu_config.hybrid_max_uncertainty)
+        return _correction_table
@@ -8,6 +8,7 @@ import re
 import torch
 
 from tiramisu_programs.schedule_utils import TimeOutException
+from utils.profiler import get_profiler
 
 
 class CPP_File(object):
@@ -28,32 +29,77 @@ class CPP_File(object):
             bool: Whether or not the compilation and running was successful.
         """
         # print("inside compile and run")
-        os.environ["FUNC_DIR"] = ("/".join(Path(file_path).parts[:-1]) if len(
-            Path(file_path).parts) > 1 else ".") + "/"
-        os.environ["FILE_PATH"] = file_path
+        if not cls.compile_tiramisu_code(config, file_path, log_message):
+            return False
+        with get_profiler().span("run_generator",
+                                 file=Path(file_path).name) as record:
+            failed = cls.launch_cmd(config.tiramisu.run_tiramisu_cmd,
+                                    file_path,
+                                    env=cls.get_cmd_env(file_path))
+            record["outcome"] = "error" if failed else None
+        if failed:
+            print(f"Error occured while running {file_path}")
+            return False
+        return True
+
+    @classmethod
+    def compile_tiramisu_code(cls,
+                              config,
+                              file_path,
+                              log_message="No message"):
+        """Compiles a C++ file into the executable `<file_path>.out`.
+
+        Args:
+            config (RLAutoSchedulerConfig): The experiment config.
+            file_path (str): The path to the C++ file to compile.
+            log_message (str, optional): _description_. Defaults to "No message".
 
-        failed = cls.launch_cmd(config.tiramisu.compile_tiramisu_cmd,
-                                file_path)
+        Returns:
+            bool: Whether or not the compilation was successful.
+        """
+        with get_profiler().span("compile",
+                                 file=Path(file_path).name) as record:
+            failed = cls.launch_cmd(config.tiramisu.compile_tiramisu_cmd,
+                                    file_path,
+                                    env=cls.get_cmd_env(file_path))
+            record["outcome"] = "error" if failed else None
         if failed:
             print(f"Error occured while compiling {file_path}")
             with open(file_path) as file:
                 print(file.read(), file=sys.stderr, flush=True)
             return False
-        else:
-            failed = cls.launch_cmd(config.tiramisu.run_tiramisu_cmd,
-                                    file_path)
-            if failed:
-                print(f"Error occured while running {file_path}")
-                return False
         return True
 
+    @classmethod
+    def get_cmd_env(cls, file_path, func_name=None):
+        """Build the environment of the shell commands working on a file.
+
+        The variables are set per command instead of in `os.environ`, so that
+        commands on different files can run concurrently.
+
+        Args:
+            file_path (str): The path to the C++ file.
+            func_name (str, optional): The name of the Tiramisu function. Defaults to None.
+
+        Returns:
+            dict: The environment, with FUNC_DIR, FILE_PATH and FUNC_NAME set.
+        """
+        env = dict(os.environ)
+        env["FUNC_DIR"] = ("/".join(Path(file_path).parts[:-1]) if len(
+            Path(file_path).parts) > 1 else ".") + "/"
+        env["FILE_PATH"] = file_path
+        if func_name is not None:
+            env["FUNC_NAME"] = func_name
+        return env
+
     @classmethod
     def launch_cmd(cls,
                    step_cmd,
                    file_path,
                    cmd_type=None,
                    nb_executions=None,
-                   initial_exec_time=None):
+                   initial_exec_time=None,
+                   env=None):
         """Execute a command on the shell.
 
         Args:
@@ -62,6 +108,7 @@ class CPP_File(object):
             cmd_type (str, optional): Can take three values: "initial_exec" for commands used to get intital execution time,"sched_eval" for commands used to evauate a schedule, and None for everything else.  Defaults to None.
             nb_executions (int, optional): The number of times to execyte the shell command. Defaults to None.
             initial_exec_time (float, optional): The program intial execution time. It is used with the "sched_eval" option . Defaults to None.
+            env (dict, optional): The environment of the command, see get_cmd_env. Defaults to None, the current environment.
 
         Raises:
             TimeOutException: The shell command exceeded the timeout.
@@ -79,6 +126,7 @@ class CPP_File(object):
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
                     timeout=15 * nb_executions,
+                    env=env,
                 )
                 # print("after running initial exec")
             elif cmd_type == "sched_eval":
@@ -89,6 +137,7 @@ class CPP_File(object):
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
                     timeout=15 + 10 * nb_executions * initial_exec_time / 1000,
+                    env=env,
                 )
                 # print("after running sched eval")
 
@@ -99,6 +148,7 @@ class CPP_File(object):
                     shell=True,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
+                    env=env,
                 )
 
         except subprocess.TimeoutExpired:
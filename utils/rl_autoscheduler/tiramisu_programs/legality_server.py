@@ -0,0 +1,296 @@
+import json
+import os
+import subprocess
+import sys
+
+import tiramisu_programs
+
+
+class LegalityServer():
+    """Client of a long-lived process that answers the legality, skewing solver
+    and annotation queries of one program.
+
+    The server is the program generator itself, compiled once with its code
+    generation replaced by a loop reading requests from stdin. Each request
+    resets the schedules instead of recompiling the program, so a query costs
+    a dependency check instead of a g++ compilation.
+
+    Protocol, one request per line, replies on a single line prefixed by `@@`:
+        LEGALITY, then one optimization per line, then END -> 1, 0 or -1
+        SOLVER <comp> <first_dim> <second_dim> -> the solver factors
+        ANNOTATIONS -> the program JSON
+        QUIT
+    """
+    reply_prefix = '@@ '
+
+    server_includes = '''#include <iostream>
+#include <sstream>
+#include <algorithm>
+#include <map>
+#include <tiramisu/tiramisu.h>
+#include <tiramisu/auto_scheduler/evaluator.h>
+'''
+
+    server_template = '''
+    function * fct = tiramisu::global::get_implicit_function();
+    // function::get_computation_by_name is not public, the computations are
+    // looked up by the names of their variables in the generator
+    std::map<std::string, computation *> comps = {$comps_map$};
+    auto get_comp = [&](const std::string &name) {
+        return comps.at(name);
+    };
+    auto get_loop_var = [&](computation * comp, int level) {
+        return var(isl_map_get_dim_name(comp->get_schedule(), isl_dim_out,
+                                        loop_level_into_dynamic_dimension(level)));
+    };
+    auto restore_schedules = [&]() {
+        fct->reset_schedules();
+$ordering_lines$
+    };
+    prepare_schedules_for_legality_checks();
+    perform_full_dependency_analysis();
+
+    std::string line;
+    std::cout << "@@ READY" << std::endl;
+    while (std::getline(std::cin, line)) {
+        std::istringstream request(line);
+        std::string cmd;
+        request >> cmd;
+        if (cmd == "LEGALITY") {
+            std::vector<std::string> optims;
+            while (std::getline(std::cin, line) && line != "END")
+                optims.push_back(line);
+            try {
+                restore_schedules();
+                prepare_schedules_for_legality_checks();
+                bool is_legal = true;
+                for (auto &optim_line : optims) {
+                    std::istringstream optim_stream(optim_line);
+                    std::string optim, name, next_name;
+                    std::vector<int> params;
+                    int param;
+                    optim_stream >> optim >> name;
+                    if (optim == "fusion")
+                        optim_stream >> next_name;
+                    while (optim_stream >> param)
+                        params.push_back(param);
+                    computation * comp = get_comp(name);
+                    if (optim == "interchange")
+                        comp->interchange(params[0], params[1]);
+                    else if (optim == "reversal")
+                        comp->loop_reversal(params[0]);
+                    else if (optim == "skewing")
+                        comp->skew(params[0], params[1], params[2], params[3]);
+                    else if (optim == "parallelization_check")
+                        is_legal &= fct->loop_parallelization_is_legal(params[0], {comp});
+                    else if (optim == "parallelization")
+                        comp->tag_parallel_level(params[0]);
+                    else if (optim == "tiling" && params.size() == 4)
+                        comp->tile(params[0], params[1], params[2], params[3]);
+                    else if (optim == "tiling")
+                        comp->tile(params[0], params[1], params[2], params[3], params[4], params[5]);
+                    else if (optim == "unrolling_check")
+                        is_legal &= loop_unrolling_is_legal(get_loop_var(comp, params[0]), {comp});
+                    else if (optim == "unrolling")
+                        comp->unroll(params[0], params[1]);
+                    else if (optim == "fusion")
+                        comp->then(*get_comp(next_name), params[0]);
+                }
+                is_legal &= check_legality_of_function();
+                std::cout << "@@ " << is_legal << std::endl;
+            } catch (...) {
+                std::cout << "@@ -1" << std::endl;
+            }
+        }
+        else if (cmd == "SOLVER") {
+            std::string name;
+            int first_dim, second_dim;
+            request >> name >> first_dim >> second_dim;
+            std::vector<std::pair<int,int>> outer1, outer2, outer3;
+            computation * comp = get_comp(name);
+            tie(outer1, outer2, outer3) = fct->skewing_local_solver(
+                {comp}, get_loop_var(comp, first_dim), get_loop_var(comp, second_dim), 1);
+            std::cout << "@@ ";
+            for (auto &outer : {outer1, outer2, outer3})
+                if (outer.size() > 0)
+                    std::cout << outer.front().first << " " << outer.front().second << " ";
+            std::cout << std::endl;
+        }
+        else if (cmd == "ANNOTATIONS") {
+            restore_schedules();
+            auto ast = tiramisu::auto_scheduler::syntax_tree(fct);
+            std::string program_json = tiramisu::auto_scheduler::evaluate_by_learning_model::get_program_json(ast);
+            std::replace(program_json.begin(), program_json.end(), '\\n', ' ');
+            std::cout << "@@ " << program_json << std::endl;
+        }
+        else if (cmd == "QUIT")
+            break;
+    }
+'''
+
+    def __init__(self, prog):
+        self.prog = prog
+        self.process = None
+        self.server_file = prog.func_folder + prog.name + '_legality_server.cpp'
+        # The server compiled in a previous episode on this program is reused
+        self.is_compiled = os.path.isfile(self.server_file + '.out')
+
+    @classmethod
+    def get_server_code(cls, model, source):
+        """Build the source of the server of a program generator.
+
+        Args:
+            model (ProgramModel): The model of the generator.
+            source (str): The content of the generator.
+
+        Returns:
+            str: The source of the server.
+        """
+        ordering_lines = ''.join('        ' + line + '\n'
+                                 for line in model.ordering_lines)
+        comps_map = ', '.join('{{"{0}", &{0}}}'.format(comp_name)
+                              for comp_name in model.comp_names)
+        server_lines = cls.server_template.replace(
+            '$ordering_lines$', ordering_lines).replace('$comps_map$', comps_map)
+        return cls.server_includes + model.replace_code_gen(source, server_lines)
+
+    def write_server_code(self):
+        with open(self.server_file, 'w') as f:
+            f.write(self.get_server_code(self.prog.model,
+                                         self.prog.original_str))
+
+    def start(self):
+        """Compile the server if needed and launch it.
+
+        Returns:
+            bool: Whether or not the server is ready to answer requests.
+        """
+        if self.is_running():
+            return True
+        if not self.is_compiled:
+            self.write_server_code()
+            self.is_compiled = tiramisu_programs.CPP_File.compile_tiramisu_code(
+                self.prog.config, self.server_file, 'Compiling legality server')
+            if not self.is_compiled:
+                return False
+        self.process = subprocess.Popen(['./' + self.server_file + '.out'],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL,
+                                        universal_newlines=True,
+                                        bufsize=1)
+        return self.read_reply() == 'READY'
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def read_reply(self):
+        # Tiramisu may print its own messages on stdout, they are skipped
+        for line in self.process.stdout:
+            if line.startswith(self.reply_prefix):
+                return line[len(self.reply_prefix):].strip()
+        self.process = None
+        return None
+
+    def request(self, lines):
+        """Send a request to the server, launching it if it is not running.
+
+        Args:
+            lines (list): The lines of the request.
+
+        Returns:
+            str: The reply, or None if the server failed or died while answering.
+        """
+        if not self.start():
+            return None
+        try:
+            self.process.stdin.write(''.join(line + '\n' for line in lines))
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            self.process = None
+            return None
+        return self.read_reply()
+
+    def check_legality_of_schedule(self, optims_list, comps=None,
+                                   first_comp=None):
+        reply = self.request(['LEGALITY'] + get_server_optim_lines(
+            optims_list, comps, first_comp) + ['END'])
+        if reply is None:
+            print('Legality server stopped while checking: ' + ' '.join(
+                [o.tiramisu_optim_str for o in optims_list]),
+                  file=sys.stderr,
+                  flush=True)
+            return -1
+        return int(reply)
+
+    def call_solver(self, comp, params):
+        reply = self.request([
+            'SOLVER {} {} {}'.format(comp, params['first_dim_index'],
+                                     params['second_dim_index'])
+        ])
+        if reply is None:
+            raise tiramisu_programs.InternalExecException
+        solver_result = reply.split()
+        if len(solver_result) == 0:
+            return None
+        return solver_result
+
+    def get_program_annotations(self):
+        reply = self.request(['ANNOTATIONS'])
+        if reply is None:
+            return None
+        return json.loads(reply)
+
+    def stop(self):
+        if self.is_running():
+            try:
+                self.process.stdin.write('QUIT\n')
+                self.process.stdin.flush()
+                self.process.wait(timeout=5)
+            except (BrokenPipeError, subprocess.TimeoutExpired):
+                self.process.kill()
+        self.process = None
+
+    def __del__(self):
+        self.stop()
+
+
+def get_server_optim_lines(optims_list, comps=None, first_comp=None):
+    """Convert optimization commands into the request lines of the legality server.
+
+    Args:
+        optims_list (list): The list of OptimizationCommand to apply.
+        comps (list, optional): The computations to check unrolling for. Defaults to None.
+        first_comp (str, optional): The computation to check parallelization for. Defaults to None.
+
+    Returns:
+        list: The request lines, one transformation of one computation per line.
+    """
+    lines = []
+    for optim in optims_list:
+        params = ' '.join(str(p) for p in optim.params_list) if isinstance(
+            optim.params_list, list) else ''
+        if optim.type == 'Interchange':
+            lines += ['interchange {} {}'.format(c, params) for c in optim.comps]
+        elif optim.type == 'Reversal':
+            lines += ['reversal {} {}'.format(c, params) for c in optim.comps]
+        elif optim.type == 'Skewing':
+            lines += ['skewing {} {}'.format(c, params) for c in optim.comps]
+        elif optim.type == 'Parallelization':
+            lines.append('parallelization_check {} {}'.format(
+                first_comp, params))
+            lines.append('parallelization {} {}'.format(optim.comps[0], params))
+        elif optim.type == 'Tiling':
+            lines += ['tiling {} {}'.format(c, params) for c in optim.comps]
+        elif optim.type == 'Fusion':
+            for prev_comp, comp in zip(optim.comps, optim.comps[1:]):
+                lines.append('fusion {} {} {}'.format(prev_comp, comp,
+                                                      optim.params_list[0]))
+        elif optim.type == 'Unrolling':
+            for comp in comps or []:
+                lines.append('unrolling_check {} {}'.format(
+                    comp, optim.params_list[comp][0]))
+            for comp in optim.comps:
+                lines.append('unrolling {} {}'.format(
+                    comp, ' '.join(str(p) for p in optim.params_list[comp])))
+    return lines
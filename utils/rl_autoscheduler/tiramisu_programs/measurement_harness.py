@@ -0,0 +1,234 @@
+import os
+import select
+import subprocess
+import time
+
+import tiramisu_programs
+from tiramisu_programs.schedule_utils import TimeOutException
+from utils.profiler import get_profiler
+
+
+class MeasurementHarness():
+    """Client of a persistent process that measures the scheduled versions of
+    one program.
+
+    The harness is compiled once per program. It allocates and initializes the
+    buffers once, then for every request loads the shared object of a schedule
+    with dlopen, runs the function and replies with the execution times. A new
+    schedule thus only costs the generation of its function object.
+
+    The number of executions is adaptive: the harness stops as soon as the 95%
+    confidence interval of the mean execution time is tight enough, or right
+    after an execution slower than an abort threshold, since such a schedule
+    is clearly worse than the best known one.
+
+    Protocol, one request per line, replies on lines prefixed by `@@`:
+        <shared object path> <max_executions> <min_executions> <ci_target> <abort_ms>
+        -> one line per execution with its time in ms, then END
+        -> or ERROR if the shared object cannot be loaded
+    A ci_target or abort_ms of 0 disables the corresponding stop.
+    """
+    reply_prefix = b'@@ '
+
+    harness_cpp_template = '''#include "Halide.h"
+#include "$func_name$_wrapper.h"
+#include "tiramisu/utils.h"
+#include <dlfcn.h>
+#include <iostream>
+#include <sstream>
+#include <chrono>
+#include <cmath>
+
+using namespace std;
+
+int main(int, char **argv){
+
+$buffers_init$
+
+    std::string line;
+    std::cout << "@@ READY" << std::endl;
+    while (std::getline(std::cin, line)) {
+        std::istringstream request(line);
+        std::string so_path;
+        int max_execs, min_execs;
+        double ci_target, abort_ms;
+        if (!(request >> so_path >> max_execs >> min_execs >> ci_target >> abort_ms))
+            break;
+        void * handle = dlopen(so_path.c_str(), RTLD_NOW | RTLD_LOCAL);
+        if (!handle) {
+            std::cerr << dlerror() << std::endl;
+            std::cout << "@@ ERROR" << std::endl;
+            continue;
+        }
+        auto $func_name$_ptr = (decltype(&$func_name$)) dlsym(handle, "$func_name$");
+        double sum = 0, sum_squares = 0;
+        for (int i = 1; i <= max_execs; ++i) {
+            auto begin = std::chrono::high_resolution_clock::now();
+            $func_name$_ptr($func_params$);
+            auto end = std::chrono::high_resolution_clock::now();
+            double time = std::chrono::duration_cast<std::chrono::nanoseconds>(end-begin).count() / (double)1000000;
+            // Streamed, so that the client sees the executions done before a timeout
+            std::cout << "@@ " << time << std::endl;
+            if (abort_ms > 0 && time > abort_ms)
+                break;
+            sum += time;
+            sum_squares += time * time;
+            if (i >= min_execs && i > 1 && ci_target > 0) {
+                double mean = sum / i;
+                double std_dev = std::sqrt(std::max(sum_squares - i * mean * mean, 0.0) / (i - 1));
+                if (1.96 * std_dev / std::sqrt(i) <= ci_target * mean)
+                    break;
+            }
+        }
+        std::cout << "@@ END" << std::endl;
+        dlclose(handle);
+    }
+    return 0;
+}'''
+
+    def __init__(self, prog, cores=None):
+        self.prog = prog
+        self.cores = cores
+        self.process = None
+        self.harness_file = prog.func_folder + prog.name + '_harness.cpp'
+
+    def write_harness_code(self):
+        harness_cpp_code = self.harness_cpp_template.replace(
+            '$func_name$', self.prog.name)
+        harness_cpp_code = harness_cpp_code.replace(
+            '$buffers_init$', self.prog.get_buffers_init_lines())
+        harness_cpp_code = harness_cpp_code.replace(
+            '$func_params$', ','.join(
+                [name + '.raw_buffer()' for name in self.prog.IO_buffer_names]))
+        with open(self.harness_file, 'w') as f:
+            f.write(harness_cpp_code)
+        self.prog.write_wrapper_code()
+
+    def start(self):
+        """Compile the harness if needed and launch it.
+
+        Returns:
+            bool: Whether or not the harness is ready to run measurements.
+        """
+        if self.is_running():
+            return True
+        # The harnesses of the different core sets share the same binary
+        with self.prog.harness_lock:
+            if not self.prog.harness_is_compiled:
+                self.write_harness_code()
+                env = self.prog.get_cmd_env()
+                log_message_cmd = 'printf "Compiling harness\n">> ${FUNC_DIR}log.txt'
+                tiramisu_programs.CPP_File.launch_cmd(log_message_cmd,
+                                                      '',
+                                                      env=env)
+                with get_profiler().span('compile_harness') as record:
+                    failed = tiramisu_programs.CPP_File.launch_cmd(
+                        self.prog.config.tiramisu.compile_harness_cmd,
+                        self.prog.file_path,
+                        env=env)
+                    record['outcome'] = 'error' if failed else None
+                if failed:
+                    print('Failed compiling harness')
+                    return False
+                self.prog.harness_is_compiled = True
+        cores = self.cores
+        self.process = subprocess.Popen(
+            ['./' + self.prog.name + '_harness'],
+            cwd=self.prog.func_folder,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            preexec_fn=(lambda: os.sched_setaffinity(0, cores))
+            if cores else None,
+        )
+        self.buffer = b''
+        return self.read_reply(timeout=60) == 'READY'
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def read_reply(self, timeout):
+        """Read the next reply of the harness.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for the reply, None to wait indefinitely.
+
+        Raises:
+            TimeOutException: The harness did not reply in time, it is killed.
+
+        Returns:
+            str: The reply, or None if the harness died.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        fd = self.process.stdout.fileno()
+        while True:
+            while b'\n' in self.buffer:
+                line, self.buffer = self.buffer.split(b'\n', 1)
+                if line.startswith(self.reply_prefix):
+                    return line[len(self.reply_prefix):].decode('UTF-8').strip()
+            remaining = max(deadline - time.time(),
+                            0) if deadline is not None else None
+            if not select.select([fd], [], [], remaining)[0]:
+                self.stop(kill=True)
+                raise TimeOutException
+            data = os.read(fd, 65536)
+            if not data:
+                self.process = None
+                return None
+            self.buffer += data
+
+    def measure(self,
+                so_path,
+                nb_executions,
+                timeout,
+                min_executions=None,
+                ci_target=0,
+                abort_time=0):
+        """Run the function of a shared object until its execution time is
+        known precisely enough.
+
+        Args:
+            so_path (str): The path to the shared object of the scheduled function.
+            nb_executions (int): The maximum number of executions.
+            timeout (float): Maximum number of seconds for each execution.
+            min_executions (int, optional): The minimum number of executions before stopping on the confidence interval. Defaults to None, nb_executions.
+            ci_target (float, optional): Stop when the half width of the 95% confidence interval is below this fraction of the mean. Defaults to 0, disabled.
+            abort_time (float, optional): Stop after an execution slower than this time in ms. Defaults to 0, disabled.
+
+        Raises:
+            TimeOutException: An execution exceeded the timeout.
+
+        Returns:
+            list: The execution times in ms, or None if the measurement failed.
+        """
+        if not self.start():
+            return None
+        if min_executions is None:
+            min_executions = nb_executions
+        try:
+            self.process.stdin.write('{} {} {} {} {}\n'.format(
+                os.path.abspath(so_path), nb_executions, min_executions,
+                ci_target, abort_time).encode('UTF-8'))
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            self.process = None
+            return None
+        execution_times = []
+        while True:
+            reply = self.read_reply(timeout)
+            if reply is None or reply == 'ERROR':
+                return None
+            if reply == 'END':
+                return execution_times
+            execution_times.append(float(reply))
+
+    def stop(self, kill=False):
+        if self.is_running():
+            if kill:
+                self.process.kill()
+            else:
+                self.process.stdin.close()
+            self.process.wait()
+        self.process = None
+
+    def __del__(self):
+        self.stop()
@@ -0,0 +1,183 @@
+import fcntl
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+_measurement_pool = None
+_measurement_pool_lock = threading.Lock()
+
+
+def parse_core_set(core_set):
+    """Parse a core set written like taskset lists, e.g. "0-11,24-35".
+
+    Args:
+        core_set (str): The list of cores and core ranges separated by commas.
+
+    Returns:
+        list: The core ids.
+    """
+    cores = []
+    for part in str(core_set).split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            cores += list(range(int(first), int(last) + 1))
+        else:
+            cores.append(int(part))
+    return cores
+
+
+def get_worker_core_sets(core_sets, worker_id, nb_workers):
+    """Split the core sets among the workers, so that the workers of a node
+    measure on different cores.
+
+    Args:
+        core_sets (list): The core sets of the node, e.g. ["0-11", "12-23"].
+        worker_id (int): The id of the worker.
+        nb_workers (int): The number of workers.
+
+    Returns:
+        list: The core sets of the worker. When there are fewer core sets than
+        workers, each worker gets one core set shared with other workers.
+    """
+    if not core_sets or nb_workers <= 1:
+        return core_sets
+    if nb_workers <= len(core_sets):
+        return core_sets[worker_id % nb_workers::nb_workers]
+    print(f"{nb_workers} workers share {len(core_sets)} core sets, their "
+          "measurements on the same core set are serialized")
+    return [core_sets[worker_id % len(core_sets)]]
+
+
+class CoreSetLock():
+    """Lock of a core set shared by all the processes of a node, so that the
+    workers sharing a core set do not time schedules on it at the same time.
+
+    Args:
+        core_set (str): The core set, e.g. "0-11".
+    """
+
+    def __init__(self, core_set):
+        self.path = os.path.join(
+            tempfile.gettempdir(),
+            "rl_autoscheduler_cores_{}.lock".format(
+                str(core_set).replace(",", "_")))
+
+    def __enter__(self):
+        self.file = open(self.path, "a")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+class MeasurementPool():
+    """Evaluates schedules asynchronously.
+
+    Compiling a schedule is independent from compiling another one, so the
+    compilations run concurrently, each one in its own compiler process.
+    Timing needs isolation, so the measurements are serialized per core set:
+    each core set has a single runner thread, and its harnesses are pinned to
+    its cores. The workers of a node get disjoint core sets when there are
+    enough of them, see get_worker_core_sets, and a core set shared by several
+    workers is locked for the node during each measurement, see CoreSetLock.
+
+    Args:
+        nb_compile_workers (int): The number of concurrent compilations.
+        core_sets (list, optional): The core sets to run measurements on, e.g. ["0-11", "12-23"]. Defaults to None, one set without pinning.
+    """
+
+    def __init__(self, nb_compile_workers=4, core_sets=None):
+        self.compile_executor = ThreadPoolExecutor(nb_compile_workers)
+        self.core_sets = [parse_core_set(core_set) for core_set in core_sets
+                          ] if core_sets else [None]
+        # Unpinned measurements are not serialized between the workers
+        self.core_set_locks = [CoreSetLock(core_set) for core_set in core_sets
+                               ] if core_sets else [None]
+        self.run_executors = [ThreadPoolExecutor(1) for _ in self.core_sets]
+        self.nb_queued_runs = [0] * len(self.core_sets)
+        self.lock = threading.Lock()
+
+    def prepare(self, prog, optims_list):
+        """Generate the shared object of a schedule in the background, without
+        measuring it.
+
+        Returns:
+            Future: The path to the shared object.
+        """
+        return self.compile_executor.submit(prog.prepare_schedule, optims_list)
+
+    def submit(self,
+               prog,
+               optims_list,
+               cmd_type,
+               nb_executions,
+               initial_exec_time=None):
+        """Compile and measure a schedule.
+
+        Args:
+            prog (TiramisuProgram): The program to schedule.
+            optims_list (list): The list of OptimizationCommand of the schedule.
+            cmd_type (str): "initial_exec" or "sched_eval", it sets the timeout.
+            nb_executions (int): The number of executions.
+            initial_exec_time (float, optional): The initial execution time of the program. Defaults to None.
+
+        Returns:
+            Future: The execution time of the schedule.
+        """
+        result = Future()
+        result.set_running_or_notify_cancel()
+
+        def on_run_done(run_future, index):
+            with self.lock:
+                self.nb_queued_runs[index] -= 1
+            if run_future.exception() is not None:
+                result.set_exception(run_future.exception())
+            else:
+                result.set_result(run_future.result())
+
+        def on_compiled(compile_future):
+            if compile_future.exception() is not None:
+                result.set_exception(compile_future.exception())
+                return
+            # The run goes to the core set with the fewest queued runs
+            with self.lock:
+                index = self.nb_queued_runs.index(min(self.nb_queued_runs))
+                self.nb_queued_runs[index] += 1
+            run_future = self.run_executors[index].submit(
+                self.run_schedule, index, prog, compile_future.result(),
+                cmd_type, nb_executions, initial_exec_time)
+            run_future.add_done_callback(
+                lambda run_future: on_run_done(run_future, index))
+
+        self.prepare(prog, optims_list).add_done_callback(on_compiled)
+        return result
+
+    def run_schedule(self, index, prog, so_path, cmd_type, nb_executions,
+                     initial_exec_time):
+        if self.core_set_locks[index] is None:
+            return prog.run_schedule(so_path, cmd_type, nb_executions,
+                                     initial_exec_time, self.core_sets[index])
+        with self.core_set_locks[index]:
+            return prog.run_schedule(so_path, cmd_type, nb_executions,
+                                     initial_exec_time, self.core_sets[index])
+
+    def shutdown(self):
+        self.compile_executor.shutdown()
+        for run_executor in self.run_executors:
+            run_executor.shutdown()
+
+
+def get_measurement_pool(tiramisu_config, worker_id=0, nb_workers=1):
+    """Get the measurement pool of the process, creating it on first use on
+    the core sets of the worker, see get_worker_core_sets."""
+    global _measurement_pool
+    with _measurement_pool_lock:
+        if _measurement_pool is None:
+            _measurement_pool = MeasurementPool(
+                tiramisu_config.nb_compile_workers,
+                get_worker_core_sets(tiramisu_config.measurement_core_sets,
+                                     worker_id, nb_workers))
+        return _measurement_pool
@@ -0,0 +1,111 @@
+import json
+import os
+import re
+import threading
+
+from utils.checkpointer import atomic_write
+
+_program_models = dict()
+_program_models_lock = threading.Lock()
+
+
+class ProgramModel():
+    """Structured view of a program generator, parsed once per source.
+
+    It holds what the environment needs from the generator: the function name,
+    the computations, the input/output buffers and their sizes, the ordering
+    of the computations, and the position of the code generation statement.
+    Every variant of the generator (legality check, solver, code generation,
+    annotations) is the source with its code generation statement replaced,
+    which is a slice at known offsets instead of a search in the source.
+
+    The model is memoized per process by source hash, and cached on disk in a
+    JSON file next to the source.
+    """
+    version = 1
+
+    def __init__(self, source_hash, name, comp_names, code_gen_line,
+                 code_gen_start, code_gen_end, body_start, io_buffer_names,
+                 buffer_sizes, ordering_lines):
+        self.source_hash = source_hash
+        self.name = name
+        self.comp_names = comp_names
+        self.code_gen_line = code_gen_line
+        self.code_gen_start = code_gen_start
+        self.code_gen_end = code_gen_end
+        self.body_start = body_start
+        self.io_buffer_names = io_buffer_names
+        self.buffer_sizes = buffer_sizes
+        self.ordering_lines = ordering_lines
+
+    @classmethod
+    def parse(cls, source, source_hash):
+        """Extract the structure of a generator from its source."""
+        name = re.findall(r'tiramisu::init\(\"(\w+)\"\);', source)[0]
+        body_start = source.index('tiramisu::init')
+        comp_names = re.findall(r'computation (\w+)\(', source)
+        code_gen_match = re.search(r'tiramisu::codegen\({.+;', source)
+        code_gen_line = code_gen_match.group(0)
+        buffers_vect = re.findall(r'{(.+)}', code_gen_line)[0]
+        io_buffer_names = re.findall(r'\w+', buffers_vect)
+        buffer_sizes = []
+        for buf_name in io_buffer_names:
+            sizes_vect = re.findall(r'buffer ' + buf_name + '.*{(.*)}',
+                                    source)[0]
+            buffer_sizes.append(re.findall(r'\d+', sizes_vect))
+        ordering_lines = re.findall(r'\w+\s*\.\s*(?:then|after)\s*\([^;]*\);',
+                                    source[body_start:code_gen_match.start()])
+        return cls(source_hash, name, comp_names, code_gen_line,
+                   code_gen_match.start(), code_gen_match.end(), body_start,
+                   io_buffer_names, buffer_sizes, ordering_lines)
+
+    @classmethod
+    def load(cls, file_path, source, source_hash):
+        """Get the model of a generator, from the memo of the process, from
+        the cache file next to the source, or by parsing the source.
+
+        Args:
+            file_path (str): The path to the generator.
+            source (str): The content of the generator.
+            source_hash (str): The sha256 of the content.
+
+        Returns:
+            ProgramModel: The model of the generator.
+        """
+        with _program_models_lock:
+            if source_hash in _program_models:
+                return _program_models[source_hash]
+        cache_file = file_path + '.model.json'
+        model = None
+        try:
+            with open(cache_file, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == cls.version and data.get(
+                    'source_hash') == source_hash:
+                del data['version']
+                model = cls(**data)
+        except (OSError, ValueError, TypeError):
+            model = None
+        if model is None:
+            model = cls.parse(source, source_hash)
+            try:
+                atomic_write(cache_file, json.dumps(model.to_dict()))
+            except OSError:
+                pass
+        with _program_models_lock:
+            _program_models[source_hash] = model
+        return model
+
+    def to_dict(self):
+        data = dict(vars(self))
+        data['version'] = self.version
+        return data
+
+    def replace_code_gen(self, source, lines):
+        """Get a variant of the generator with its code generation statement
+        replaced by other lines."""
+        return source[:self.code_gen_start] + lines + source[self.code_gen_end:]
+
+    def get_body(self, source):
+        """Get the part of the generator from the init to the code generation."""
+        return source[self.body_start:self.code_gen_start]
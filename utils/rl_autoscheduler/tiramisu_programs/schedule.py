@@ -1,20 +1,68 @@
-import traceback
+import copy
+import hashlib
 import json
+import traceback
+from collections import OrderedDict
 
 import numpy as np
 import rl_interface
 
 from tiramisu_programs.schedule_utils import *
 from tiramisu_programs.surrogate_model_utils.json_to_tensor import (
-    get_sched_rep, get_tree_structure)
+    encode_tree, get_sched_rep, get_tree_structure)
 
 global_dioph_sols_dict = dict()
 EPSILON = 1e-6
 
 
+class RepresentationCache:
+    """LRU cache of the initial representations of programs.
+
+    Programs are drawn again and again from the same list, so their initial
+    representation is computed once per worker and only copied afterwards.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+        }
+
+
 class Schedule:
     MAX_DEPTH = 6
     MAX_COMPS = 5
+    # The parts of the representation that are never modified by the actions,
+    # they are shared by all the schedules of a program
+    SHARED_ATTRIBUTES = [
+        "prog_rep", "comps_placeholders", "comp_indic_dict", "comps_it",
+        "templates"
+    ]
+    COPIED_ATTRIBUTES = ["common_it", "schedule_dict", "it_dict", "repr"]
+    representation_cache = None
 
     def __init__(self, program):
         self.depth = 0
@@ -36,6 +84,40 @@ class Schedule:
         """
         if self.repr is not None: return self.repr
 
+        if Schedule.representation_cache is None:
+            Schedule.representation_cache = RepresentationCache(
+                self.prog.config.environment.representation_cache_size)
+        key = (self.prog.name,
+               hashlib.sha256(
+                   json.dumps(self.annotations,
+                              sort_keys=True).encode('utf-8')).hexdigest())
+        cached_representation = Schedule.representation_cache.get(key)
+        if cached_representation is None:
+            self.compute_representation()
+            cached_representation = {
+                attribute: getattr(self, attribute, None)
+                for attribute in self.SHARED_ATTRIBUTES +
+                self.COPIED_ATTRIBUTES
+            }
+            Schedule.representation_cache.put(
+                key, copy.deepcopy(cached_representation))
+        else:
+            for attribute in self.SHARED_ATTRIBUTES:
+                setattr(self, attribute, cached_representation[attribute])
+            for attribute in self.COPIED_ATTRIBUTES:
+                setattr(self, attribute,
+                        copy.deepcopy(cached_representation[attribute]))
+            self.placeholders = self.comps_placeholders
+            self.added_iterators = []
+        return self.repr
+
+    @classmethod
+    def get_representation_cache_stats(cls):
+        if cls.representation_cache is None:
+            return None
+        return cls.representation_cache.get_stats()
+
+    def compute_representation(self):
         (self.prog_rep,
         self.comps_placeholders,
         self.comp_indic_dict) = ScheduleUtils.get_representation(self.annotations)
@@ -95,7 +177,6 @@ class Schedule:
         self.repr["loops_representation"] = np.empty((0, 26), np.float32)
         self.repr['child_list'] = np.empty((0, 11), np.float32)
         self.repr['has_comps'] = np.empty((0, 12), np.float32)
-        self.repr["prog_tree"] = np.empty((0,5000),np.float32) 
         self.repr['computations_indices'] = np.empty((0, 5), np.float32)
 
         for i in range(5):
@@ -234,11 +315,7 @@ class Schedule:
         if len(self.comps) == 1:
             np.put(self.repr["action_mask"], [56, 57, 58, 59, 60],
                    [0, 0, 0, 0, 0])
-        max_size = 5000
-        string = json.dumps(self.templates["prog_tree"])
-        padded_string = string + (max_size - len(string))*"_"
-        self.repr["prog_tree"] = np.array(list(padded_string),"U1").view(np.float32)
-        return self.repr
+        self.repr["prog_tree"] = encode_tree(self.templates["prog_tree"])
 
     def apply_interchange(self, params):
         for comp in self.comps:
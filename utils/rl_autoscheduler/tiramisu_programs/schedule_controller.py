@@ -2,18 +2,22 @@ import copy
 import sys
 import time
 import traceback
-from typing import List
+from typing import Dict, List
 
+import ray
 import torch
 from rl_interface.action import Action
 
+from tiramisu_programs.correction_table import get_correction_table
+from tiramisu_programs.measurement_pool import get_measurement_pool
 from tiramisu_programs.optimization import OptimizationCommand
 from tiramisu_programs.schedule import Schedule
 from tiramisu_programs.schedule_utils import *
 from tiramisu_programs.surrogate_model_utils.json_to_tensor import \
     get_schedule_representation
 from tiramisu_programs.surrogate_model_utils.modeling import \
-    Model_Recursive_LSTM_v2
+    get_surrogate_model
+from utils.profiler import get_profiler
 
 global_dioph_sols_dict = dict()
 
@@ -24,7 +28,9 @@ class ScheduleController:
                  schedule: Schedule = None,
                  nb_executions=5,
                  scheds=None,
-                 config=None):
+                 config=None,
+                 shared_variable_actor=None,
+                 worker_id=0):
         self.depth = 0
         self.schedule = []
         self.schedule_object = schedule
@@ -35,16 +41,30 @@ class ScheduleController:
         self.new_scheds = {}
         self.search_time = time.time()
         self.config = config
-        if self.config.tiramisu.env_type == "cpu":
+        self.shared_variable_actor = shared_variable_actor
+        self.measurement_pool = None
+        self.correction_table = None
+        self.last_evaluation_is_measured = True
+        if self.config.tiramisu.env_type in ("cpu", "hybrid"):
             self.measurement_env = self.schedule_object.prog.evaluate_schedule
+            if self.config.tiramisu.measurement_pool:
+                self.measurement_pool = get_measurement_pool(
+                    self.config.tiramisu, worker_id, self.config.ray.num_workers)
+                self.measurement_env = self.evaluate_in_pool
+            if self.config.tiramisu.env_type == "hybrid":
+                # The schedules are scored by the model, and only the
+                # promising ones are executed
+                self.execution_env = self.measurement_env
+                self.correction_table = get_correction_table(
+                    self.config.tiramisu)
+                self.measurement_env = self.evaluate_hybrid
         else:
             self.measurement_env = self.get_exec_time_by_model
         self.lc_total_time = 0
-        self.lc_data = []
+        self.lc_data = dict()
+        self.new_lc_data = []
         self.schedule_list_model = []
-        self.model = Model_Recursive_LSTM_v2()
-        self.model.load_state_dict(
-            torch.load(config.tiramisu.model_checkpoint, map_location="cpu"))
+        self.model = get_surrogate_model(config.tiramisu.model_checkpoint)
 
     def apply_action(self, action):
 
@@ -55,6 +75,9 @@ class ScheduleController:
         self.steps += 1
         first_comp = self.schedule_object.comps[0]
         saved_legality = self.get_legality(action=action)
+        if saved_legality is not None:
+            get_profiler().add_event('legality_check', time.time(), 0.0,
+                                     'cache_hit')
 
         if not action.id in range(44, 46):  # If the action is skewing
             action_params = action.parameter()
@@ -80,6 +103,8 @@ class ScheduleController:
                     lc_check = self.schedule_object.prog.check_legality_of_schedule(
                         self.schedule, first_comp=first_comp) if saved_legality is None else saved_legality
 
+                if saved_legality is None:
+                    self.save_legality_data(action, lc_check)
                 if lc_check == -1:
                     print("X: The action produced an error.")
                     self.pop_schedule(action=action)
@@ -122,6 +147,8 @@ class ScheduleController:
                 else:
                     lc_check = self.schedule_object.prog.check_legality_of_schedule(
                         self.schedule, first_comp=first_comp) if saved_legality is None else saved_legality
+                if saved_legality is None:
+                    self.save_legality_data(action, lc_check)
                 if lc_check == -1:
                     print("X: This action produces an error")
                     self.pop_schedule(action=action)
@@ -175,6 +202,8 @@ class ScheduleController:
                     l_time = time.time() - start_time
                     self.lc_total_time += l_time
 
+                    if saved_legality is None:
+                        self.save_legality_data(action, lc_check)
                     if lc_check == -1:
                         print("X: This action produces an error")
                         self.pop_schedule(action=action)
@@ -246,6 +275,8 @@ class ScheduleController:
                         l_time = time.time() - start_time
                         self.lc_total_time += l_time
 
+                        if saved_legality is None:
+                            self.save_legality_data(action, lc_check)
                         if lc_check == -1:
                             print("X: This action produces an error")
                             self.pop_schedule(action=action)
@@ -289,6 +320,8 @@ class ScheduleController:
 
                 l_time = time.time() - start_time
                 self.lc_total_time += l_time
+                if saved_legality is None:
+                    self.save_legality_data(action, lc_check)
                 if lc_check == -1:
                     print("X: This action produces an error")
                     self.pop_schedule(action=action)
@@ -324,6 +357,8 @@ class ScheduleController:
                         self.schedule, first_comp=first_comp) if saved_legality is None else saved_legality
                 l_time = time.time() - start_time
                 self.lc_total_time += l_time
+                if saved_legality is None:
+                    self.save_legality_data(action, lc_check)
                 if lc_check == -1:
                     print("X: This action produces am error")
                     self.pop_schedule(action=action)
@@ -367,6 +402,8 @@ class ScheduleController:
                 l_time = time.time() - start_time
                 self.lc_total_time += l_time
 
+                if saved_legality is None:
+                    self.save_legality_data(action, lc_check)
                 if lc_check == -1:
                     print("X: This action produces an error")
                     self.pop_schedule(action=action)
@@ -402,6 +439,8 @@ class ScheduleController:
                     self.schedule_object.comp_indic_dict)
 
             self.depth += 1
+            if self.correction_table is not None:
+                info["predicted_speedup"] = self.score_step()
             return self.schedule_object.repr, 1.0, done, info
         elif exit:
             return self.schedule_object.repr, 1.0, done, info
@@ -423,12 +462,29 @@ class ScheduleController:
                        exec_time)
         return speedup
 
+    def prepare_parallelization(self):
+        """Compile the parallelized variant of the current schedule in the
+        measurement pool, so that it is ready by the time the current schedule
+        is measured and the parallelization is tested."""
+        if self.measurement_pool is None or self.schedule_object.is_parallelized:
+            return
+        action_params = Action(Action.PARALLELIZATION0,
+                               self.schedule_object.it_dict,
+                               self.schedule_object.common_it).parameter()
+        self.measurement_pool.prepare(
+            self.schedule_object.prog, self.schedule + [
+                OptimizationCommand("Parallelization",
+                                    [int(action_params["dim_index"])],
+                                    self.schedule_object.comps)
+            ])
+
     def test_additional_actions(self, training=True):
         info = dict()
         if training:
             print(
                 "This operation alters the training and, therefore, it won't be executed")
             try:
+                self.prepare_parallelization()
                 exec_time = 0
                 exec_time = self.get_exec_time()
             except:
@@ -476,6 +532,7 @@ class ScheduleController:
             self.search_time = time.time() - self.search_time
 
             try:
+                self.prepare_parallelization()
                 exec_time = 0
                 exec_time = self.get_exec_time()
 
@@ -558,33 +615,163 @@ class ScheduleController:
         })
         stat = dict()
         try:
-            computations_tensor, loops_tensor = get_schedule_representation(
+            predicted_speedup = self.predict_speedups(
+                [self.schedule_object.schedule_dict])[0]
+            stat[
+                "initial_execution_time"] = self.schedule_object.prog.initial_execution_time
+            stat["predicted_speedup"] = predicted_speedup
+            print(f"The predicted speedup is {predicted_speedup}")
+            stat[
+                "predicted_execution_time"] = self.schedule_object.prog.initial_execution_time / predicted_speedup
+        except Exception:
+            print("ERROR_MODEL", traceback.format_exc())
+            print(sys.exc_info()[2])
+
+        return stat["predicted_execution_time"]
+
+    def predict_speedups(self, schedule_dicts):
+        """Predict the speedups of several schedules of the current program with
+        a single forward pass of the surrogate model.
+
+        The schedules share the program tree, so their representations are
+        stacked along the batch dimension.
+
+        Args:
+            schedule_dicts (list): The schedules, in the format of Schedule.schedule_dict.
+
+        Returns:
+            list: The predicted speedup of each schedule.
+        """
+        if not schedule_dicts:
+            return []
+        templates = self.schedule_object.templates
+        representations = [
+            get_schedule_representation(
                 self.schedule_object.annotations,
-                self.schedule_object.schedule_dict,
-                self.schedule_object.templates["comps_repr_templates_list"],
-                self.schedule_object.templates["loops_repr_templates_list"],
-                self.schedule_object.
+                schedule_dict,
+                templates["comps_repr_templates_list"],
+                templates["loops_repr_templates_list"],
                 templates["comps_placeholders_indices_dict"],
-                self.schedule_object.
                 templates["loops_placeholders_indices_dict"],
                 max_depth=self.schedule_object.MAX_DEPTH - 1)
-            tree_tensors = (self.schedule_object.templates["prog_tree"],
-                            computations_tensor, loops_tensor)
-            with torch.no_grad():
-                predicted_speedup = self.model(
-                    tree_tensors,
-                    num_matrices=self.schedule_object.MAX_DEPTH - 1).item()
-                stat[
-                    "initial_execution_time"] = self.schedule_object.prog.initial_execution_time
-                stat["predicted_speedup"] = predicted_speedup
-                print(f"The predicted speedup is {predicted_speedup}")
-                stat[
-                    "predicted_execution_time"] = self.schedule_object.prog.initial_execution_time / predicted_speedup
+            for schedule_dict in schedule_dicts
+        ]
+        computations_tensor = torch.cat(
+            [computations for computations, loops in representations])
+        loops_tensor = torch.cat([loops for computations, loops in representations])
+        tree_tensors = (templates["prog_tree"], computations_tensor,
+                        loops_tensor)
+        with get_profiler().span('model_inference',
+                                 batch_size=len(schedule_dicts)), \
+                torch.inference_mode():
+            predicted_speedups = self.model(
+                tree_tensors, num_matrices=self.schedule_object.MAX_DEPTH - 1)
+        return predicted_speedups.tolist()
+
+    def score_step(self):
+        """Score the current schedule with the model, corrected by the
+        measurements, in the hybrid mode.
+
+        Returns:
+            float: The corrected predicted speedup, or None if the model failed.
+        """
+        prog_name = self.schedule_object.prog.name
+        try:
+            predicted_speedup = self.predict_speedups(
+                [self.schedule_object.schedule_dict])[0]
         except Exception:
             print("ERROR_MODEL", traceback.format_exc())
-            print(sys.exc_info()[2])
+            return None
+        # The predictions are recorded once per evaluated schedule, in
+        # evaluate_hybrid, not for every partial schedule
+        return self.correction_table.correct(prog_name, predicted_speedup)
+
+    def evaluate_hybrid(self,
+                        optims_list,
+                        cmd_type,
+                        nb_executions,
+                        initial_exec_time=None):
+        """Evaluate a schedule with the model, and execute it only if it is
+        among the best predicted schedules of the program or if the
+        correction of the program is not reliable yet, see CorrectionTable.
+
+        Returns:
+            float: The measured execution time, or the predicted one corrected by the previous measurements.
+        """
+        prog_name = self.schedule_object.prog.name
+        self.last_evaluation_is_measured = True
+        if cmd_type == 'initial_exec':
+            return self.execution_env(optims_list, cmd_type, nb_executions,
+                                      initial_exec_time)
+        try:
+            predicted_speedup = self.predict_speedups(
+                [self.schedule_object.schedule_dict])[0]
+        except Exception:
+            # The schedule is measured as in the cpu mode
+            print("ERROR_MODEL", traceback.format_exc())
+            return self.execution_env(optims_list, cmd_type, nb_executions,
+                                      initial_exec_time)
+        if self.correction_table.should_measure(prog_name, predicted_speedup):
+            execution_time = self.execution_env(optims_list, cmd_type,
+                                                nb_executions,
+                                                initial_exec_time)
+            if execution_time != 0:
+                self.correction_table.add_measurement(
+                    prog_name, predicted_speedup,
+                    initial_exec_time / execution_time)
+        else:
+            self.last_evaluation_is_measured = False
+            execution_time = initial_exec_time / self.correction_table.correct(
+                prog_name, predicted_speedup)
+            print(f"Predicted execution time {execution_time} used instead of measuring")
+        self.correction_table.add_prediction(prog_name, predicted_speedup)
+        return execution_time
 
-        return stat["predicted_execution_time"]
+    def get_exec_times_by_model(self, schedule_dicts):
+        """Predict the execution times of several schedules of the current
+        program in one batch, see predict_speedups.
+
+        Returns:
+            list: The predicted execution time of each schedule.
+        """
+        initial_execution_time = self.schedule_object.prog.initial_execution_time
+        return [
+            initial_execution_time / predicted_speedup
+            for predicted_speedup in self.predict_speedups(schedule_dicts)
+        ]
+
+    def submit_measurement(self,
+                           optims_list,
+                           cmd_type,
+                           nb_executions,
+                           initial_exec_time=None):
+        """Compile and measure a schedule of the current program in the
+        measurement pool.
+
+        Returns:
+            Future: The execution time of the schedule.
+        """
+        return self.measurement_pool.submit(self.schedule_object.prog,
+                                            optims_list, cmd_type,
+                                            nb_executions, initial_exec_time)
+
+    def evaluate_in_pool(self,
+                         optims_list,
+                         cmd_type,
+                         nb_executions,
+                         initial_exec_time=None):
+        """Measure a schedule of the current program in the measurement pool
+        and wait for the result.
+
+        This is the synchronous measurement_env of the pool: it blocks until
+        the schedule is compiled and executed. Use submit_measurement to get
+        the future and overlap several measurements.
+
+        Returns:
+            float: The execution time of the schedule.
+        """
+        return self.submit_measurement(optims_list, cmd_type, nb_executions,
+                                       initial_exec_time).result()
 
     def get_exec_time(self):
         prog_name = self.schedule_object.prog.name
@@ -603,9 +790,7 @@ class ScheduleController:
                     else:
                         curr_sched = copy.deepcopy(self.schedule)
                         self.new_scheds[prog_name] = {}
-                        execution_time = self.measurement_env(
-                            self.schedule, 'sched_eval', self.nb_executions,
-                            self.schedule_object.prog.initial_execution_time)
+                        execution_time = self.measure_exec_time()
                         self.new_scheds[prog_name][
                             self.schedule_object.schedule_str] = (
                                 curr_sched, execution_time, 0)
@@ -617,9 +802,7 @@ class ScheduleController:
                             self.schedule_object.schedule_str][1]
                     else:
                         curr_sched = copy.deepcopy(self.schedule)
-                        execution_time = self.measurement_env(
-                            self.schedule, 'sched_eval', self.nb_executions,
-                            self.schedule_object.prog.initial_execution_time)
+                        execution_time = self.measure_exec_time()
                         self.new_scheds[prog_name][
                             self.schedule_object.schedule_str] = (
                                 curr_sched, execution_time, 0)
@@ -627,9 +810,7 @@ class ScheduleController:
                     curr_sched = copy.deepcopy(self.schedule)
                     self.new_scheds[prog_name] = {}
                     start_time = time.time()
-                    execution_time = self.measurement_env(
-                        self.schedule, 'sched_eval', self.nb_executions,
-                        self.schedule_object.prog.initial_execution_time)
+                    execution_time = self.measure_exec_time()
                     sched_time = time.time() - start_time
                     self.new_scheds[prog_name][
                         self.schedule_object.schedule_str] = (curr_sched,
@@ -639,22 +820,55 @@ class ScheduleController:
             execution_time = self.schedule_object.prog.initial_execution_time
         return execution_time
 
+    def measure_exec_time(self):
+        """Measure the current schedule, looking it up first in the persistent
+        evaluation cache shared by all the workers.
+
+        Returns:
+            float: The execution time of the current schedule.
+        """
+        prog = self.schedule_object.prog
+        schedule_str = self.schedule_object.schedule_str
+        use_eval_cache = (self.shared_variable_actor is not None
+                          and self.config.tiramisu.env_type
+                          in ("cpu", "hybrid"))
+        if use_eval_cache:
+            with get_profiler().span('actor.get_exec_time') as record:
+                execution_time = ray.get(
+                    self.shared_variable_actor.get_exec_time.remote(
+                        prog.program_hash, schedule_str))
+                record['outcome'] = 'cache_miss' if execution_time is None \
+                    else 'cache_hit'
+            if execution_time is not None:
+                print(f"Evaluation cache hit for {prog.name}: {schedule_str}")
+                return execution_time
+        execution_time = self.measurement_env(self.schedule, 'sched_eval',
+                                              self.nb_executions,
+                                              prog.initial_execution_time)
+        # The predictions of the hybrid mode are not cached as measurements
+        if use_eval_cache and self.last_evaluation_is_measured:
+            with get_profiler().span('actor.update_exec_time'):
+                ray.get(
+                    self.shared_variable_actor.update_exec_time.remote(
+                        prog.program_hash, schedule_str, execution_time))
+        return execution_time
+
+    def get_legality_key(self, action):
+        return f"{self.schedule_object.prog.name}@{self.schedule_object.schedule_str}@{action.id}"
+
     def save_legality_data(self, action, lc_check):
-        key = f"{self.schedule_object.prog.name}@{self.schedule_object.schedule_str}@{action}"
-        self.lc_data.append(
-            [
-                key,
-                lc_check
-            ]
-        )
+        if lc_check == -1:  # Errors are not cached
+            return
+        key = self.get_legality_key(action)
+        self.lc_data[key] = lc_check
+        self.new_lc_data.append([key, lc_check])
 
     def get_legality(self, action):
-        key = f"{self.schedule_object.prog.name}@{self.schedule_object.schedule_str}@{action}"
-        values = [v for (k, v) in self.lc_data if k == key]
-        return values[0] if len(values) else None
+        return self.lc_data.get(self.get_legality_key(action))
 
     def get_legality_data(self):
-        return self.lc_data
+        """Get the legality results found during this episode."""
+        return self.new_lc_data
 
-    def load_legality_data(self, lc_data: List) -> None:
+    def load_legality_data(self, lc_data: Dict) -> None:
         self.lc_data = lc_data
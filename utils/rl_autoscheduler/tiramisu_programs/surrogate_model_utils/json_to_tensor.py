@@ -22,6 +22,10 @@ class LoopsDepthException(Exception):
     pass
 
 
+TREE_MAX_NODES = 12
+TREE_MAX_CHILDREN = 11
+TREE_MAX_COMPS = 5
+
 train_dataset_file = "/data/mm12191/datasets/dataset_batch760000-780130_train.pkl"
 val_dataset_file = "/data/mm12191/datasets/dataset_batch760000-780130_val.pkl"
 global_dioph_sols_dict = dict()
@@ -687,4 +691,89 @@ def get_tree_footprint(tree):
     for child in tree["child_list"]:
         footprint += get_tree_footprint(child)
     footprint += "</L" + str(int(tree["loop_index"])) + ">"
-    return footprint
\ No newline at end of file
+    return footprint
+
+
+def encode_tree(tree,
+                max_nodes=TREE_MAX_NODES,
+                max_children=TREE_MAX_CHILDREN,
+                max_comps=TREE_MAX_COMPS):
+    """Encode a program tree, as returned by get_sched_rep, into a fixed size array.
+
+    Each row is a loop node, numbered in depth first order from the root:
+    `[loop_index, parent_node, child_nodes..., computations_indices...]`,
+    padded with -1. A child always has a greater node number than its parent.
+
+    Args:
+        tree (dict): The program tree.
+        max_nodes (int): The maximum number of loops.
+        max_children (int): The maximum number of child loops of a loop.
+        max_comps (int): The maximum number of computations of a loop.
+
+    Raises:
+        LoopsDepthException: The tree has too many loops, children or
+            computations, it cannot be encoded without dropping some of them.
+
+    Returns:
+        np.ndarray: The encoding, of shape (max_nodes, 2 + max_children + max_comps).
+    """
+    encoding = np.full((max_nodes, 2 + max_children + max_comps),
+                       -1,
+                       dtype=np.float32)
+    nb_nodes = 0
+
+    def encode_node(node, parent):
+        nonlocal nb_nodes
+        node_id = nb_nodes
+        nb_nodes += 1
+        if node_id >= max_nodes:
+            raise LoopsDepthException(
+                f"The program tree has more than {max_nodes} loops")
+        if len(node["child_list"]) > max_children:
+            raise LoopsDepthException(
+                f"A loop of the program tree has more than {max_children} child loops")
+        if node["has_comps"] and len(node["computations_indices"]) > max_comps:
+            raise LoopsDepthException(
+                f"A loop of the program tree has more than {max_comps} computations")
+        encoding[node_id, 0] = node["loop_index"]
+        encoding[node_id, 1] = parent
+        if node["has_comps"]:
+            comps = node["computations_indices"]
+            encoding[node_id, 2 + max_children:2 + max_children +
+                     len(comps)] = comps
+        for i, child in enumerate(node["child_list"]):
+            encoding[node_id, 2 + i] = encode_node(child, node_id)
+        return node_id
+
+    encode_node(tree, -1)
+    return encoding
+
+
+def decode_tree(encoding, max_children=TREE_MAX_CHILDREN):
+    """Rebuild the program tree from its encoding, see encode_tree.
+
+    Args:
+        encoding (list): The rows of the encoding.
+        max_children (int): The maximum number of child loops of a loop.
+
+    Returns:
+        dict: The program tree.
+    """
+
+    def decode_node(node_id):
+        row = encoding[node_id]
+        # Children are always after their parent, this also guards against
+        # malformed encodings such as all zeros dummy observations
+        children = [
+            int(child) for child in row[2:2 + max_children]
+            if node_id < child < len(encoding)
+        ]
+        comps = [int(comp) for comp in row[2 + max_children:] if comp >= 0]
+        return {
+            "loop_index": int(row[0]),
+            "has_comps": len(comps) > 0,
+            "computations_indices": comps,
+            "child_list": [decode_node(child) for child in children],
+        }
+
+    return decode_node(0)
@@ -1,6 +1,11 @@
+import threading
+
 import torch
 from torch import nn
 
+_surrogate_models = dict()
+_surrogate_models_lock = threading.Lock()
+
 
 def seperate_vector(
     X: torch.Tensor, num_matrices: int = 4, pad: bool = True, pad_amount: int = 5
@@ -201,3 +206,25 @@ class Model_Recursive_LSTM_v2(nn.Module):
         out = self.predict(x)
         return self.ELU(out[:, 0, 0])
 
+
+def get_surrogate_model(checkpoint_path):
+    """Get the surrogate model of a checkpoint, loading it once per process.
+
+    The same instance is handed to every caller, so it is frozen: in evaluation
+    mode, which disables the dropouts, and without gradients.
+
+    Args:
+        checkpoint_path (str): The path to the state dict of a Model_Recursive_LSTM_v2.
+
+    Returns:
+        Model_Recursive_LSTM_v2: The loaded model.
+    """
+    with _surrogate_models_lock:
+        if checkpoint_path not in _surrogate_models:
+            model = Model_Recursive_LSTM_v2()
+            model.load_state_dict(
+                torch.load(checkpoint_path, map_location="cpu"))
+            model.eval()
+            model.requires_grad_(False)
+            _surrogate_models[checkpoint_path] = model
+        return _surrogate_models[checkpoint_path]
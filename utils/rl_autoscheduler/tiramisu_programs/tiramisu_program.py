@@ -1,11 +1,18 @@
+import hashlib
 import json
 import os
 import random
 import re
+import threading
 import time
 from pathlib import Path
 
 import tiramisu_programs
+from utils.profiler import get_profiler
+
+
+# Best execution time measured for each program in this process, by hash
+best_execution_times = dict()
 
 
 class InternalExecException(Exception):
@@ -18,13 +25,18 @@ class TiramisuProgram():
 #include <cstdlib>
 #include <algorithm>
 #include <vector>
+#include <pthread.h>
+#include <sched.h>
+#include <unistd.h>
 
-#define NB_THREAD_INIT 48
+// Buffers smaller than this number of elements per thread use fewer threads
+#define MIN_INIT_PART 65536
 struct args {
     double *buf;
     unsigned long long int part_start;
     unsigned long long int part_end;
     double value;
+    int cpu;
 };
 
 void *init_part(void *params)
@@ -33,23 +45,41 @@ void *init_part(void *params)
    unsigned long long int start = ((struct args*) params)->part_start;
    unsigned long long int end = ((struct args*) params)->part_end;
    double val = ((struct args*) params)->value;
+   int cpu = ((struct args*) params)->cpu;
+   if (cpu >= 0) {
+       cpu_set_t cpu_set;
+       CPU_ZERO(&cpu_set);
+       CPU_SET(cpu, &cpu_set);
+       pthread_setaffinity_np(pthread_self(), sizeof(cpu_set), &cpu_set);
+   }
    for (unsigned long long int k = start; k < end; k++){
        buffer[k]=val;
    }
    pthread_exit(NULL);
 }
 
+// The buffer is filled by one thread per core the process may run on, each
+// pinned to its core. The pages are allocated on first touch, so each part of
+// the buffer lands on the NUMA node of one of the cores that compute on it.
 void parallel_init_buffer(double* buf, unsigned long long int size, double value){
-    pthread_t threads[NB_THREAD_INIT]; 
-    struct args params[NB_THREAD_INIT];
-    for (int i = 0; i < NB_THREAD_INIT; i++) {
-        unsigned long long int start = i*size/NB_THREAD_INIT;
-        unsigned long long int end = std::min((i+1)*size/NB_THREAD_INIT, size);
-        params[i] = (struct args){buf, start, end, value};
-        pthread_create(&threads[i], NULL, init_part, (void*)&(params[i])); 
+    std::vector<int> cpus;
+    cpu_set_t cpu_set;
+    if (sched_getaffinity(0, sizeof(cpu_set), &cpu_set) == 0)
+        for (int cpu = 0; cpu < CPU_SETSIZE; cpu++)
+            if (CPU_ISSET(cpu, &cpu_set))
+                cpus.push_back(cpu);
+    unsigned long long int nb_threads = cpus.size() > 0 ? cpus.size() : std::max(1L, sysconf(_SC_NPROCESSORS_ONLN));
+    nb_threads = std::max(1ULL, std::min(nb_threads, size / MIN_INIT_PART));
+    std::vector<pthread_t> threads(nb_threads);
+    std::vector<struct args> params(nb_threads);
+    for (unsigned long long int i = 0; i < nb_threads; i++) {
+        unsigned long long int start = i*size/nb_threads;
+        unsigned long long int end = std::min((i+1)*size/nb_threads, size);
+        params[i] = (struct args){buf, start, end, value, cpus.size() > 0 ? cpus[i] : -1};
+        pthread_create(&threads[i], NULL, init_part, (void*)&(params[i]));
     }
-    for (int i = 0; i < NB_THREAD_INIT; i++) 
-        pthread_join(threads[i], NULL); 
+    for (unsigned long long int i = 0; i < nb_threads; i++)
+        pthread_join(threads[i], NULL);
     return;
 }
 #ifdef __cplusplus
@@ -60,68 +90,72 @@ int $func_name$($func_params$);
 }  // extern "C"
 #endif'''
 
-    wrapper_cpp_template = '''#include "Halide.h"
-#include "$func_name$_wrapper.h"
-#include "tiramisu/utils.h"
-#include <iostream>
-#include <time.h>
-#include <fstream>
-#include <chrono>
-
-using namespace std::chrono;
-using namespace std;
-
-int main(int, char **argv){
-        
-$buffers_init$
-
-    int nb_execs = atoi(argv[1]);
-
-    std::ofstream out("measurements_file.txt");
-    double duration;
-    
-    for (int i = 0; i < nb_execs; ++i) {
-        auto begin = std::chrono::high_resolution_clock::now(); 
-        $func_name$($func_params$);
-        auto end = std::chrono::high_resolution_clock::now(); 
-
-        duration = std::chrono::duration_cast<std::chrono::nanoseconds>(end-begin).count() / (double)1000000;
-        out << duration << " "; 
-
-    }
-    
-    out.close();
-    return 0;
-}'''
-
     def __init__(self, config, file_path):
         self.config = config
         self.file_path = file_path
         with open(file_path, 'r') as f:
             self.original_str = f.read()
+        self.program_hash = hashlib.sha256(
+            self.original_str.encode('utf-8')).hexdigest()
         self.func_folder = ('/'.join(Path(file_path).parts[:-1])
                             if len(Path(file_path).parts) > 1 else '.') + '/'
-        self.body = re.findall(r'(tiramisu::init(?s:.)+)tiramisu::codegen',
-                               self.original_str)[0]
-        self.name = re.findall(r'tiramisu::init\(\"(\w+)\"\);',
-                               self.original_str)[0]
-        self.comp_name = re.findall(r'computation (\w+)\(', self.original_str)
-        self.code_gen_line = re.findall(r'tiramisu::codegen\({.+;',
-                                        self.original_str)[0]
-        buffers_vect = re.findall(r'{(.+)}', self.code_gen_line)[0]
-        self.IO_buffer_names = re.findall(r'\w+', buffers_vect)
-        self.buffer_sizes = []
-        for buf_name in self.IO_buffer_names:
-            sizes_vect = re.findall(r'buffer ' + buf_name + '.*{(.*)}',
-                                    self.original_str)[0]
-            self.buffer_sizes.append(re.findall(r'\d+', sizes_vect))
+        self.model = tiramisu_programs.ProgramModel.load(
+            file_path, self.original_str, self.program_hash)
+        self.body = self.model.get_body(self.original_str)
+        self.name = self.model.name
+        self.comp_name = self.model.comp_names
+        self.code_gen_line = self.model.code_gen_line
+        self.IO_buffer_names = self.model.io_buffer_names
+        self.buffer_sizes = self.model.buffer_sizes
         self.program_annotations = ''
-        self.wrapper_is_compiled = False
+        self.harnesses = dict()
+        self.harness_lock = threading.Lock()
+        # The harness compiled in a previous episode on this program is reused
+        self.harness_is_compiled = os.path.isfile(self.func_folder +
+                                                  self.name + '_harness')
+        self.codegen_locks = dict()
+        self.codegen_locks_lock = threading.Lock()
+        self.codegen_timings = dict()
+        self.last_timings = {}
         self.initial_execution_time = 1.0
+        self.legality_server = tiramisu_programs.LegalityServer(
+            self) if config.tiramisu.legality_server else None
 
     def get_program_annotations(self):
         if not self.program_annotations == '':
             return self.program_annotations
+        annotation_store = tiramisu_programs.get_annotation_store(
+            self.config.environment.annotation_store_file
+        ) if self.config.environment.annotation_store_file else None
+        if annotation_store is not None:
+            start_time = time.time()
+            program_annotations = annotation_store.get(self.name,
+                                                       self.program_hash)
+            if program_annotations is not None:
+                get_profiler().add_event('annotations', start_time,
+                                         time.time() - start_time,
+                                         'cache_hit')
+                self.program_annotations = program_annotations
+                return self.program_annotations
+        with get_profiler().span('annotations') as record:
+            record['outcome'] = 'computed'
+            self.program_annotations = self.compute_program_annotations()
+        if annotation_store is not None:
+            annotation_store.put(self.name, self.program_hash,
+                                 self.program_annotations)
+        return self.program_annotations
+
+    def compute_program_annotations(self):
+        """Get the annotations of the program from Tiramisu, either from the
+        legality server or by compiling and running the generator.
+
+        Returns:
+            dict: The program annotations.
+        """
+        if self.legality_server is not None:
+            program_annotations = self.legality_server.get_program_annotations()
+            if program_annotations is not None:
+                return program_annotations
         get_json_lines = '''
     auto ast = tiramisu::auto_scheduler::syntax_tree(tiramisu::global::get_implicit_function());
     std::string program_json = tiramisu::auto_scheduler::evaluate_by_learning_model::get_program_json(ast);
@@ -129,8 +163,8 @@ $buffers_init$
     out << program_json;
     out.close();
     '''
-        get_json_prog = self.original_str.replace(self.code_gen_line,
-                                                  get_json_lines)
+        get_json_prog = self.model.replace_code_gen(self.original_str,
+                                                    get_json_lines)
         output_file = self.func_folder + self.name + '_get_prog_annot.cpp'
 
         with open(output_file, 'w') as f:
@@ -139,21 +173,10 @@ $buffers_init$
             self.config, output_file, 'Generating program annotations')
         with open(self.func_folder + self.name + '_program_annotations.json',
                   'r') as f:
-            self.program_annotations = json.loads(f.read())
-        return self.program_annotations
+            return json.loads(f.read())
 
-    def check_legality_of_schedule(
-        self,
-        optims_list,
-        comps=None,
-        first_comp=None
-    ): 
-        legality_check_lines = '''
-    prepare_schedules_for_legality_checks();
-    perform_full_dependency_analysis();
-    
-    bool is_legal=true;
-'''
+    def get_legality_check_lines(self, optims_list, comps=None, first_comp=None):
+        legality_check_lines = ''
         for optim in optims_list:
             if optim.type == 'Interchange':
                 legality_check_lines += optim.tiramisu_optim_str + '\n'
@@ -179,6 +202,36 @@ $buffers_init$
                         [0]) + ''', {&''' + comp + '''});
     '''
                     legality_check_lines += optim.tiramisu_optim_str + '\n'  
+        return legality_check_lines
+
+    def check_legality_of_schedule(
+        self,
+        optims_list,
+        comps=None,
+        first_comp=None
+    ): 
+        with get_profiler().span('legality_check') as record:
+            if self.legality_server is not None:
+                lc_result = self.legality_server.check_legality_of_schedule(
+                    optims_list, comps, first_comp)
+            else:
+                lc_result = self.compile_legality_check(
+                    optims_list, comps, first_comp)
+            record['outcome'] = {
+                1: 'legal',
+                0: 'illegal'
+            }.get(lc_result, 'error')
+        return lc_result
+
+    def compile_legality_check(self, optims_list, comps=None, first_comp=None):
+        legality_check_lines = '''
+    prepare_schedules_for_legality_checks();
+    perform_full_dependency_analysis();
+    
+    bool is_legal=true;
+'''
+        legality_check_lines += self.get_legality_check_lines(
+            optims_list, comps, first_comp)
 
         legality_check_lines += '''
     is_legal &= check_legality_of_function();
@@ -188,8 +241,8 @@ $buffers_init$
     out.close();
         '''
 
-        LC_code = self.original_str.replace(self.code_gen_line,
-                                            legality_check_lines)
+        LC_code = self.model.replace_code_gen(self.original_str,
+                                              legality_check_lines)
         output_file = self.func_folder + self.name + '_legality_check.cpp'
         with open(output_file, 'w') as f:
             f.write(LC_code)
@@ -202,7 +255,71 @@ $buffers_init$
 
         return lc_result
 
+    def check_legality_of_schedules(self,
+                                    optims_lists,
+                                    comps=None,
+                                    first_comp=None):
+        """Check the legality of several candidate schedules of this program
+        with a single compilation.
+
+        The generated program performs the dependency analysis once, then for
+        each candidate resets the schedules, restores the original ordering of
+        the computations, applies the candidate and checks it.
+
+        Args:
+            optims_lists (list): The candidate schedules, each one a list of OptimizationCommand.
+            comps (list, optional): The computations to check unrolling for. Defaults to None.
+            first_comp (str, optional): The computation to check parallelization for. Defaults to None.
+
+        Returns:
+            list: One result per candidate, 1 if legal, 0 if illegal and -1 if the check failed.
+        """
+        if not optims_lists:
+            return []
+        if self.legality_server is not None:
+            return [
+                self.legality_server.check_legality_of_schedule(
+                    optims_list, comps, first_comp)
+                for optims_list in optims_lists
+            ]
+        ordering_lines = ''.join('    ' + line + '\n'
+                                 for line in self.model.ordering_lines)
+        legality_check_lines = '''
+    prepare_schedules_for_legality_checks();
+    perform_full_dependency_analysis();
+    function * fct = tiramisu::global::get_implicit_function();
+    std::ofstream out("''' + self.func_folder + '''legality_check_results.txt");
+'''
+        for optims_list in optims_lists:
+            legality_check_lines += '''
+    {
+    fct->reset_schedules();
+''' + ordering_lines + '''
+    prepare_schedules_for_legality_checks();
+    bool is_legal=true;
+''' + self.get_legality_check_lines(optims_list, comps, first_comp) + '''
+    is_legal &= check_legality_of_function();
+    out << is_legal << std::endl;
+    }
+'''
+        legality_check_lines += '''
+    out.close();
+'''
+        LC_code = self.model.replace_code_gen(self.original_str,
+                                              legality_check_lines)
+        output_file = self.func_folder + self.name + '_batch_legality_check.cpp'
+        with open(output_file, 'w') as f:
+            f.write(LC_code)
+        self.reset_legality_check_results_file()
+        log_message = 'Checking legality of {} schedules'.format(
+            len(optims_lists))
+        tiramisu_programs.CPP_File.compile_and_run_tiramisu_code(
+            self.config, output_file, log_message)
+        return self.read_legality_check_results_file(len(optims_lists))
+
     def call_solver(self, comp, params):  
+        if self.legality_server is not None:
+            return self.legality_server.call_solver(comp, params)
         lc_file = self.func_folder + self.name + '_legality_check.cpp'
         if os.path.isfile(lc_file):
             with open(lc_file, 'r') as f:
@@ -214,7 +331,7 @@ $buffers_init$
         else:
 
             original_str = self.original_str
-            to_replace = self.code_gen_line
+            to_replace = None
             header = '''
     
     perform_full_dependency_analysis();
@@ -243,7 +360,11 @@ $buffers_init$
     }
     
     '''
-        solver_code = original_str.replace(to_replace, solver_lines)
+        if to_replace is None:
+            solver_code = self.model.replace_code_gen(original_str,
+                                                      solver_lines)
+        else:
+            solver_code = original_str.replace(to_replace, solver_lines)
 
         output_file = self.func_folder + self.name + '_solver.cpp'
 
@@ -268,7 +389,26 @@ $buffers_init$
                           cmd_type,
                           nb_executions,
                           initial_exec_time=None):
+        so_file = self.prepare_schedule(optims_list)
+        return self.run_schedule(so_file, cmd_type, nb_executions,
+                                 initial_exec_time)
+
+    def prepare_schedule(self, optims_list):
+        """Generate the shared object of the function scheduled with a list of
+        optimizations.
+
+        The shared objects are cached by schedule, an already generated schedule
+        is not compiled again. This method can be called from several threads.
+
+        Args:
+            optims_list (list): The list of OptimizationCommand of the schedule.
 
+        Raises:
+            InternalExecException: The compilation or the code generation failed.
+
+        Returns:
+            str: The path to the shared object.
+        """
         optim_lines = ''
         for optim in optims_list:
             if optim.type == 'Interchange':
@@ -284,69 +424,194 @@ $buffers_init$
             elif optim.type == 'Reversal':
                 optim_lines += optim.tiramisu_optim_str + '\n'
 
-        codegen_code = self.original_str.replace(
-            self.code_gen_line,
-            optim_lines + '\n' + self.code_gen_line.replace(
-                self.name, self.func_folder + self.name))
-        output_file = self.func_folder + self.name + '_schedule_codegen.cpp'
+        schedule_hash = hashlib.sha256(
+            optim_lines.encode('utf-8')).hexdigest()[:16]
+        object_file = self.func_folder + self.name + '_' + schedule_hash + '.o'
+        with self.codegen_locks_lock:
+            codegen_lock = self.codegen_locks.setdefault(
+                schedule_hash, threading.Lock())
+        with codegen_lock:
+            if not os.path.isfile(object_file + '.so'):
+                log_message = 'Applying schedule: ' + ' '.join(
+                    [o.tiramisu_optim_str for o in optims_list])
+                self.codegen_timings[object_file + '.so'] = \
+                    self.generate_function_object(optim_lines, object_file,
+                                                  log_message)
+        return object_file + '.so'
+
+    def run_schedule(self,
+                     so_file,
+                     cmd_type,
+                     nb_executions,
+                     initial_exec_time=None,
+                     cores=None):
+        """Measure the execution time of a generated schedule.
+
+        Args:
+            so_file (str): The path to the shared object returned by prepare_schedule.
+            cmd_type (str): "initial_exec" or "sched_eval", it sets the timeout.
+            nb_executions (int): The number of executions.
+            initial_exec_time (float, optional): The initial execution time of the program. Defaults to None.
+            cores (list, optional): The cores to run on. Defaults to None, no pinning.
+
+        Raises:
+            InternalExecException: The measurement failed.
+
+        Returns:
+            float: The minimal execution time in ms.
+        """
+        # A schedule that was already generated has no compilation times
+        timings = self.codegen_timings.pop(so_file, {
+            'compile': 0.0,
+            'codegen': 0.0
+        })
+        try:
+            start_time = time.time()
+            execution_times = self.get_measurements(so_file, cmd_type,
+                                                    nb_executions,
+                                                    initial_exec_time, cores)
+            timings['run'] = time.time() - start_time
+            self.last_timings = timings
+            if execution_times is None:
+                raise InternalExecException
+            if len(execution_times) != 0:
+                if cmd_type == 'sched_eval':
+                    best_execution_times[self.program_hash] = min(
+                        min(execution_times),
+                        best_execution_times.get(self.program_hash,
+                                                 float('inf')))
+                return min(execution_times)
+            else:
+                return 0
+        except tiramisu_programs.schedule.TimeOutException:
+            print("time out exception")
+            return 10 * nb_executions * (initial_exec_time
+                                         if initial_exec_time else 1.0)
+
+    def generate_function_object(self, optim_lines, object_file, log_message):
+        """Compile and run the generator of a schedule to produce the shared
+        object of the scheduled function.
+
+        Args:
+            optim_lines (str): The Tiramisu code of the schedule.
+            object_file (str): The path of the object file to generate.
+            log_message (str): The message to log.
+
+        Raises:
+            InternalExecException: The compilation or the code generation failed.
+
+        Returns:
+            dict: The compilation and code generation times in seconds.
+        """
+        codegen_code = self.model.replace_code_gen(
+            self.original_str, optim_lines + '\n' +
+            re.sub(r'"[^"]*"', '"' + object_file + '"', self.code_gen_line))
+        output_file = object_file[:-len('.o')] + '_codegen.cpp'
         with open(output_file, 'w') as f:
             f.write(codegen_code)
-        log_message = 'Applying schedule: ' + ' '.join(
-            [o.tiramisu_optim_str for o in optims_list])
+        timings = dict()
         start_time = time.time()
-        if (tiramisu_programs.CPP_File.compile_and_run_tiramisu_code(
-                self.config, output_file, log_message)):
-            try:
-                execution_times = self.get_measurements(
-                    cmd_type, nb_executions, initial_exec_time)
-                if len(execution_times) != 0:
-                    return min(execution_times)
-                else:
-                    return 0
-            except tiramisu_programs.schedule.TimeOutException:
-                print("time out exception")
-                return 10 * nb_executions * (initial_exec_time
-                                             if initial_exec_time else 1.0)
-        else:
+        if not tiramisu_programs.CPP_File.compile_tiramisu_code(
+                self.config, output_file, log_message):
             raise InternalExecException
-
-    def get_measurements(self, cmd_type, nb_executions, initial_exec_time):
-        os.environ['FUNC_DIR'] = ('/'.join(Path(self.file_path).parts[:-1])
-                                  if len(Path(self.file_path).parts) > 1 else
-                                  '.') + '/'
-        os.environ['FILE_PATH'] = self.file_path
-        os.environ['FUNC_NAME'] = self.name
-        if not self.wrapper_is_compiled:
-            self.write_wrapper_code()
-            log_message_cmd = 'printf "Compiling wrapper\n">> ${FUNC_DIR}log.txt'
-            tiramisu_programs.CPP_File.launch_cmd(log_message_cmd, '')
+        timings['compile'] = time.time() - start_time
+        start_time = time.time()
+        env = tiramisu_programs.CPP_File.get_cmd_env(output_file)
+        with get_profiler().span('codegen') as record:
             failed = tiramisu_programs.CPP_File.launch_cmd(
-                self.config.tiramisu.compile_wrapper_cmd, self.file_path)
-            if failed:
-                print('Failed compiling wrapper')
-                return
-            self.wrapper_is_compiled = True
-        self.reset_measurements_file()
-        log_message_cmd = 'printf "Running wrapper nb_exec = ' + str(
-            nb_executions) + '\n">> ${FUNC_DIR}log.txt'
-        run_wrapper_cmd = 'cd ${FUNC_DIR};\
-        ${GXX} -shared -o ${FUNC_NAME}.o.so ${FUNC_NAME}.o;\
-        ./${FUNC_NAME}_wrapper ' + str(nb_executions)
-        tiramisu_programs.CPP_File.launch_cmd(log_message_cmd, '')
-        s_time = time.time()
-        failed = tiramisu_programs.CPP_File.launch_cmd(run_wrapper_cmd,
-                                                       self.file_path,
-                                                       cmd_type, nb_executions,
-                                                       initial_exec_time)
-
+                self.config.tiramisu.run_tiramisu_cmd, output_file, env=env)
+            if not failed:
+                failed = tiramisu_programs.CPP_File.launch_cmd(
+                    '${GXX} -shared -o ' + object_file + '.so ' + object_file,
+                    output_file,
+                    env=env)
+            record['outcome'] = 'error' if failed else None
         if failed:
-            print('Failed running wrapper')
-            return
-        return self.read_measurements_file()
-
-    def write_wrapper_code(
-            self):  
-
+            print(f"Error occured while running {output_file}")
+            raise InternalExecException
+        timings['codegen'] = time.time() - start_time
+        return timings
+
+    def get_measurements(self,
+                         so_file,
+                         cmd_type,
+                         nb_executions,
+                         initial_exec_time,
+                         cores=None):
+        """Measure a shared object with the adaptive protocol of the harness.
+
+        The executions stop once the confidence interval of the execution time
+        is tight enough, or after an execution slower than
+        measurement_abort_factor times the best known execution time of the
+        program (or its initial execution time). The timeout applies to each
+        execution.
+
+        Returns:
+            list: The execution times in ms, or None if the measurement failed.
+        """
+        tiramisu_config = self.config.tiramisu
+        abort_time = 0
+        if cmd_type == 'initial_exec':
+            timeout = 15
+        elif cmd_type == 'sched_eval':
+            timeout = 15 + 10 * initial_exec_time / 1000
+            if tiramisu_config.measurement_abort_factor > 0:
+                abort_time = tiramisu_config.measurement_abort_factor * min(
+                    initial_exec_time,
+                    best_execution_times.get(self.program_hash,
+                                             initial_exec_time))
+        else:
+            timeout = None
+        log_message_cmd = 'printf "Running harness nb_exec = ' + str(
+            nb_executions) + '\n">> ${FUNC_DIR}log.txt'
+        tiramisu_programs.CPP_File.launch_cmd(log_message_cmd,
+                                              '',
+                                              env=self.get_cmd_env())
+        with get_profiler().span('run', cmd_type=cmd_type) as record:
+            execution_times = self.get_harness(cores).measure(
+                so_file,
+                nb_executions,
+                timeout,
+                min_executions=min(tiramisu_config.measurement_min_executions,
+                                   nb_executions),
+                ci_target=tiramisu_config.measurement_ci_target,
+                abort_time=abort_time)
+            if execution_times is None:
+                record['outcome'] = 'error'
+            elif len(execution_times) < nb_executions:
+                record['outcome'] = 'aborted' if abort_time > 0 and max(
+                    execution_times) > abort_time else 'converged'
+            record['nb_executions'] = len(execution_times or [])
+        if execution_times is None:
+            print('Failed running harness')
+        return execution_times
+
+    def get_harness(self, cores=None):
+        """Get the measurement harness running on a set of cores, there is one
+        harness per set of cores."""
+        key = tuple(cores) if cores else None
+        with self.harness_lock:
+            if key not in self.harnesses:
+                self.harnesses[key] = tiramisu_programs.MeasurementHarness(
+                    self, cores)
+            return self.harnesses[key]
+
+    def close(self):
+        """Stop the measurement harnesses and the legality server of the
+        program."""
+        with self.harness_lock:
+            harnesses = list(self.harnesses.values())
+            self.harnesses.clear()
+        for harness in harnesses:
+            harness.stop()
+        if self.legality_server is not None:
+            self.legality_server.stop()
+
+    def get_cmd_env(self):
+        return tiramisu_programs.CPP_File.get_cmd_env(self.file_path,
+                                                      self.name)
+
+    def get_buffers_init_lines(self):
         buffers_init_lines = ''
         for i, buffer_name in enumerate(self.IO_buffer_names):
             buffers_init_lines += f'''
@@ -354,19 +619,10 @@ $buffers_init$
     parallel_init_buffer(c_{buffer_name}, {'*'.join(self.buffer_sizes[i][::-1])}, (double){str(random.randint(1,10))});
     Halide::Buffer<double> {buffer_name}(c_{buffer_name}, {','.join(self.buffer_sizes[i][::-1])});
     '''
-        wrapper_cpp_code = self.wrapper_cpp_template.replace(
-            '$func_name$', self.name)
-        wrapper_cpp_code = wrapper_cpp_code.replace('$buffers_init$',
-                                                    buffers_init_lines)
-        wrapper_cpp_code = wrapper_cpp_code.replace('$func_folder_path$',
-                                                    self.func_folder)
-        wrapper_cpp_code = wrapper_cpp_code.replace(
-            '$func_params$',
-            ','.join([name + '.raw_buffer()'
-                      for name in self.IO_buffer_names]))
-        output_file = self.func_folder + self.name + '_wrapper.cpp'
-        with open(output_file, 'w') as f:
-            f.write(wrapper_cpp_code)
+        return buffers_init_lines
+
+    def write_wrapper_code(
+            self):  
 
         wrapper_h_code = self.wrapper_h_template.replace('$func_name$', self.name)
         wrapper_h_code = wrapper_h_code.replace(
@@ -385,14 +641,15 @@ $buffers_init$
         with open(self.func_folder + "legality_check_result.txt", 'w') as f:
             f.write('-1')
 
-    def read_measurements_file(self):
-        with open(self.func_folder + "measurements_file.txt", 'r') as f:
-            res = [float(i) for i in f.read().split()]
-        return res
+    def read_legality_check_results_file(self, nb_results):
+        with open(self.func_folder + "legality_check_results.txt", 'r') as f:
+            res = [int(line) for line in f.read().split()]
+        # The candidates that were not reached because of a crash count as errors
+        return res + [-1] * (nb_results - len(res))
 
-    def reset_measurements_file(self):
-        with open(self.func_folder + "measurements_file.txt", 'w') as f:
-            f.write('-1')
+    def reset_legality_check_results_file(self):
+        with open(self.func_folder + "legality_check_results.txt", 'w') as f:
+            f.write('')
 
     def read_solver_result_file(self):
         with open(self.func_folder + "solver_result.txt", 'r') as f:
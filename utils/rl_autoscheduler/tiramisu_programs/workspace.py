@@ -0,0 +1,137 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+_workspace = None
+_workspace_lock = threading.Lock()
+
+WORKSPACE_PREFIX = "rl_autoscheduler_workspace_"
+
+
+class Workspace():
+    """Scratch directories of the programs scheduled by one worker process.
+
+    Each process has its own root directory, preferably on tmpfs, so that the
+    workers never race on the same files. A program keeps its directory across
+    episodes: only its generator is copied, once, and the shared objects,
+    harness and servers compiled in the previous episodes are reused. The
+    directories of the programs that are no longer scheduled are removed, least
+    recently used first, when the workspace exceeds its size budget.
+
+    Args:
+        base_dir (str, optional): The directory holding the workspaces of the workers. Defaults to None, /dev/shm if available, ./Dataset_copies otherwise.
+        max_size (int, optional): The size budget in MB. Defaults to 2048.
+    """
+
+    def __init__(self, base_dir=None, max_size=2048):
+        if not base_dir:
+            base_dir = "/dev/shm" if os.access("/dev/shm",
+                                              os.W_OK) else "./Dataset_copies"
+        os.makedirs(base_dir, exist_ok=True)
+        self.remove_stale_workspaces(base_dir)
+        # The compilation and run commands prefix the file paths with "./",
+        # so the workspace is addressed relatively to the working directory
+        self.root = os.path.relpath(
+            os.path.join(base_dir, WORKSPACE_PREFIX + str(os.getpid())))
+        os.makedirs(self.root, exist_ok=True)
+        self.max_size = max_size * 1024 * 1024
+        # Sizes of the released program directories, least recently used first
+        self.released = OrderedDict()
+        self.lock = threading.Lock()
+
+    def remove_stale_workspaces(self, base_dir):
+        """Remove the workspaces left by the worker processes that exited."""
+        for entry in os.scandir(base_dir):
+            if not entry.name.startswith(WORKSPACE_PREFIX):
+                continue
+            try:
+                pid = int(entry.name[len(WORKSPACE_PREFIX):])
+                os.kill(pid, 0)
+            except ValueError:
+                continue
+            except ProcessLookupError:
+                shutil.rmtree(entry.path, ignore_errors=True)
+            except PermissionError:
+                # The process exists but belongs to another user
+                continue
+
+    def get_program_file(self, dataset_path, func_name):
+        """Get the generator of a program in its workspace directory.
+
+        The generator is copied if it is missing or differs from the dataset
+        one, in which case the artifacts compiled from the former version are
+        dropped.
+
+        Args:
+            dataset_path (str): The path to the dataset.
+            func_name (str): The program to schedule.
+
+        Returns:
+            str: The path to the generator in the workspace.
+        """
+        file_name = func_name + "_generator.cpp"
+        original_path = os.path.join(dataset_path, func_name, file_name)
+        program_dir = os.path.join(self.root, func_name)
+        target_path = os.path.join(program_dir, file_name)
+        with self.lock:
+            self.released.pop(func_name, None)
+        original_stat = os.stat(original_path)
+        try:
+            target_stat = os.stat(target_path)
+            is_up_to_date = target_stat.st_size == original_stat.st_size and \
+                target_stat.st_mtime_ns == original_stat.st_mtime_ns
+        except FileNotFoundError:
+            is_up_to_date = False
+        if not is_up_to_date:
+            shutil.rmtree(program_dir, ignore_errors=True)
+            os.makedirs(program_dir)
+            # copy2 keeps the modification time used by the check above
+            shutil.copy2(original_path, target_path)
+        return target_path
+
+    def release(self, func_name):
+        """Mark a program directory as unused, it is kept for the next episodes
+        on this program unless the workspace exceeds its size budget."""
+        program_dir = os.path.join(self.root, func_name)
+        size = get_dir_size(program_dir)
+        with self.lock:
+            self.released[func_name] = size
+            self.collect_garbage()
+
+    def remove(self, func_name):
+        with self.lock:
+            self.released.pop(func_name, None)
+        shutil.rmtree(os.path.join(self.root, func_name), ignore_errors=True)
+
+    def collect_garbage(self):
+        """Remove the least recently used released directories until the
+        workspace fits in its budget. Must be called with the lock held."""
+        total_size = sum(self.released.values())
+        while total_size > self.max_size and self.released:
+            func_name, size = self.released.popitem(last=False)
+            shutil.rmtree(os.path.join(self.root, func_name),
+                          ignore_errors=True)
+            total_size -= size
+
+
+def get_dir_size(path):
+    """Get the size in bytes of the files of a program directory, which is flat."""
+    size = 0
+    try:
+        for entry in os.scandir(path):
+            if entry.is_file(follow_symlinks=False):
+                size += entry.stat(follow_symlinks=False).st_size
+    except FileNotFoundError:
+        pass
+    return size
+
+
+def get_workspace(environment_config):
+    """Get the workspace of the process, creating it on first use."""
+    global _workspace
+    with _workspace_lock:
+        if _workspace is None:
+            _workspace = Workspace(environment_config.workspace_dir,
+                                   environment_config.workspace_max_size)
+        return _workspace
@@ -27,7 +27,10 @@ def main(config: RLAutoSchedulerConfig):
     progs_list_registery = GlobalVarActor.remote(
         config.environment.programs_file,
         config.environment.dataset_path,
-        num_workers=config.ray.num_workers)
+        num_workers=config.ray.num_workers,
+        eval_cache_file=config.environment.eval_cache_file,
+        checkpoint_interval=config.environment.checkpoint_interval,
+        checkpoint_max_pending=config.environment.checkpoint_max_pending)
     shared_variable_actor = Actor.remote(progs_list_registery)
 
     register_env(
@@ -66,6 +69,8 @@ def main(config: RLAutoSchedulerConfig):
             },
         },
     )
+    # Write the legality data and programs dict that are still pending
+    ray.get(progs_list_registery.shutdown.remote())
 
 
 if __name__ == "__main__":
@@ -1,4 +1,8 @@
 from .environment_variables import *
 from .rl_autoscheduler_config import *
+from .checkpointer import *
 from .global_ray_variables import *
+from .legality_index import *
+from .schedule_eval_cache import *
+from .profiler import *
 from .program_generator import *
\ No newline at end of file
@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+
+
+def atomic_write(path, data):
+    """Write a file through a temporary file and a rename, so that readers never
+    see a partially written file."""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class BackgroundCheckpointer:
+    """Calls a flush function from a background thread once enough updates are
+    pending or enough time has passed, whichever comes first.
+
+    Args:
+        flush_fn (callable): The function that writes the state to disk.
+        interval (float): Maximum number of seconds between two flushes of pending updates.
+        max_pending (int): Number of pending updates that triggers an early flush.
+    """
+
+    def __init__(self, flush_fn, interval=60.0, max_pending=1000):
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self.max_pending = max_pending
+        self.nb_pending = 0
+        self.nb_flushes = 0
+        self.last_flush_duration = 0.0
+        self.max_flush_duration = 0.0
+        self.total_flush_duration = 0.0
+        self.flush_lock = threading.Lock()
+        self.wake_up = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def notify(self, nb_updates=1):
+        self.nb_pending += nb_updates
+        if self.nb_pending >= self.max_pending:
+            self.wake_up.set()
+
+    def run(self):
+        while not self.stopped:
+            self.wake_up.wait(self.interval)
+            self.wake_up.clear()
+            if self.nb_pending > 0 and not self.stopped:
+                self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            self.nb_pending = 0
+            start_time = time.time()
+            self.flush_fn()
+            duration = time.time() - start_time
+            self.nb_flushes += 1
+            self.last_flush_duration = duration
+            self.max_flush_duration = max(self.max_flush_duration, duration)
+            self.total_flush_duration += duration
+        print(f"Checkpoint written in {duration:.3f}s")
+        return duration
+
+    def stop(self):
+        """Stop the background thread and write the remaining updates."""
+        if self.stopped:
+            return
+        self.stopped = True
+        self.wake_up.set()
+        self.thread.join()
+        self.flush()
+
+    def get_stats(self):
+        return {
+            "nb_flushes": self.nb_flushes,
+            "nb_pending": self.nb_pending,
+            "last_flush_duration": self.last_flush_duration,
+            "max_flush_duration": self.max_flush_duration,
+            "mean_flush_duration": self.total_flush_duration /
+            self.nb_flushes if self.nb_flushes else 0.0,
+        }
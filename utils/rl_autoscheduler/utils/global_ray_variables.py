@@ -1,19 +1,30 @@
-from typing import List
+from typing import List, Tuple
 import ray
+import atexit
 import json
 import os
+import threading
+
+from utils.checkpointer import BackgroundCheckpointer, atomic_write
+from utils.legality_index import LegalityIndex
+from utils.schedule_eval_cache import ScheduleEvalCache
 
 
 @ray.remote
 class GlobalVarActor:
 
-    def __init__(self, programs_file, dataset_path, num_workers=7):
+    def __init__(self,
+                 programs_file,
+                 dataset_path,
+                 num_workers=7,
+                 eval_cache_file="./eval_cache.db",
+                 checkpoint_interval=60.0,
+                 checkpoint_max_pending=1000):
         self.index = -1
         self.num_workers = num_workers
         self.progs_list = self.get_dataset(dataset_path)
         self.programs_file = programs_file
         self.progs_dict = dict()
-        self.lc_data = []
         if os.path.isfile(programs_file):
             try:
                 with open(programs_file) as f:
@@ -25,16 +36,27 @@ class GlobalVarActor:
             with open(programs_file,"w+") as f:
                 f.write(json.dumps(self.progs_dict))
 
-        if os.path.isfile("lc_data.json"):
+        self.lc_index = LegalityIndex("lc_data.jsonl")
+        if len(self.lc_index) == 0 and os.path.isfile("lc_data.json"):
+            # Import the legality data saved in the former full-rewrite format
             try:
                 with open("lc_data.json") as f:
-                    self.lc_data = json.load(f)
+                    self.lc_index.update(json.load(f))
+                self.lc_index.flush()
             except:
-                self.lc_data = []
-        else:
-            self.lc_data = []
-            with open("lc_data.json","w+") as f:
-                f.write(json.dumps(self.lc_data))
+                pass
+
+        self.eval_cache = ScheduleEvalCache(eval_cache_file)
+
+        # The shared state is written to disk by a background thread, so that
+        # the workers never wait for a checkpoint
+        self.lock = threading.Lock()
+        self.progs_dict_is_dirty = False
+        self.checkpointer = BackgroundCheckpointer(
+            self.checkpoint,
+            interval=checkpoint_interval,
+            max_pending=checkpoint_max_pending)
+        atexit.register(self.checkpointer.stop)
 
     def get_dataset(self, path):
         os.getcwd()
@@ -53,30 +75,64 @@ class GlobalVarActor:
         ]
 
     def update_lc_data(self, v: List):
-        self.lc_data.extend(v)
+        with self.lock:
+            self.lc_index.update(v)
+        self.checkpointer.notify(len(v))
         return True
 
-    def get_lc_data(self) -> List:
-        return self.lc_data
-    
+    def get_lc_data(self, version=0) -> Tuple[int, List]:
+        with self.lock:
+            return self.lc_index.get_delta(version)
+
     def write_lc_data(self):
         print("Saving lc_data to disk")
-        with open("lc_data.json", "w") as f:
-            json.dump(self.lc_data, f)
+        self.checkpointer.flush()
         return True
 
     def update_progs_dict(self, v):
-        self.progs_dict.update(v)
+        with self.lock:
+            self.progs_dict.update(v)
+            self.progs_dict_is_dirty = True
+        self.checkpointer.notify(len(v))
         return True
 
     def write_progs_dict(self):
         print("Saving progs_dict to disk")
-        with open(self.programs_file, "w") as f:
-            json.dump(self.progs_dict, f)
+        self.checkpointer.flush()
         return True
 
     def get_progs_dict(self):
-        return self.progs_dict
+        with self.lock:
+            return dict(self.progs_dict)
+
+    def checkpoint(self):
+        """Write the legality data and the programs dict to disk. Only the
+        serialization is done while holding the lock."""
+        with self.lock:
+            lc_version, lc_lines = self.lc_index.get_pending_lines()
+            progs_dict_str = json.dumps(
+                self.progs_dict) if self.progs_dict_is_dirty else None
+            self.progs_dict_is_dirty = False
+        self.lc_index.write_lines(lc_version, lc_lines)
+        if progs_dict_str is not None:
+            atomic_write(self.programs_file, progs_dict_str)
+
+    def get_checkpoint_stats(self):
+        return self.checkpointer.get_stats()
+
+    def shutdown(self):
+        self.checkpointer.stop()
+        return True
+
+    def get_exec_time(self, program_hash, schedule_str):
+        return self.eval_cache.get(program_hash, schedule_str)
+
+    def update_exec_time(self, program_hash, schedule_str, exec_time):
+        self.eval_cache.put(program_hash, schedule_str, exec_time)
+        return True
+
+    def get_eval_cache_stats(self):
+        return self.eval_cache.get_stats()
 
     def increment(self):
         self.index += 1
@@ -95,8 +151,8 @@ class Actor:
     def update_lc_data(self, v: List):
         return ray.get(self.data_registry.update_lc_data.remote(v))
 
-    def get_lc_data(self) -> List:
-        return ray.get(self.data_registry.get_lc_data.remote())
+    def get_lc_data(self, version=0) -> Tuple[int, List]:
+        return ray.get(self.data_registry.get_lc_data.remote(version))
     
     def write_lc_data(self):
         return ray.get(self.data_registry.write_lc_data.remote())
@@ -107,8 +163,24 @@ class Actor:
     def write_progs_dict(self):
         return ray.get(self.data_registry.write_progs_dict.remote())
 
+    def get_checkpoint_stats(self):
+        return ray.get(self.data_registry.get_checkpoint_stats.remote())
+
     def update_progs_dict(self, v):
         return ray.get(self.data_registry.update_progs_dict.remote(v))
 
+    def get_exec_time(self, program_hash, schedule_str):
+        return ray.get(
+            self.data_registry.get_exec_time.remote(program_hash,
+                                                    schedule_str))
+
+    def update_exec_time(self, program_hash, schedule_str, exec_time):
+        return ray.get(
+            self.data_registry.update_exec_time.remote(
+                program_hash, schedule_str, exec_time))
+
+    def get_eval_cache_stats(self):
+        return ray.get(self.data_registry.get_eval_cache_stats.remote())
+
     def increment(self):
         return ray.get(self.data_registry.increment.remote())
@@ -0,0 +1,94 @@
+import json
+import os
+
+
+class LegalityIndex:
+    """Hashed store of legality check results with incremental synchronization.
+
+    Results live in a dict for O(1) lookups and in an ordered log, so that a
+    worker can fetch only the entries added since its last sync (its version).
+    On disk the log is an append-only JSON lines file, one `[key, value]` per line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = dict()
+        self.log = []
+        self.nb_flushed = 0
+        if os.path.isfile(path):
+            self.load()
+
+    def load(self):
+        """Read the entries stored on disk, dropping a truncated last line
+        left by an interrupted write."""
+        valid_size = 0
+        with open(self.path, "rb+") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    key, value = json.loads(line)
+                except ValueError:
+                    break
+                self.add(key, value)
+                valid_size += len(line)
+            f.truncate(valid_size)
+        self.nb_flushed = len(self.log)
+
+    def add(self, key, value):
+        if key in self.entries:
+            return False
+        self.entries[key] = value
+        self.log.append(key)
+        return True
+
+    def update(self, entries):
+        for key, value in entries:
+            self.add(key, value)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def get_delta(self, version=0):
+        """Get the entries added after a given version.
+
+        Args:
+            version (int): The version returned by the previous sync, 0 to get everything.
+
+        Returns:
+            tuple: The current version and the list of new `[key, value]` entries.
+        """
+        return len(self.log), [[key, self.entries[key]]
+                               for key in self.log[version:]]
+
+    def get_pending_lines(self):
+        """Serialize the entries that are not on disk yet.
+
+        Returns:
+            tuple: The version up to which the entries are serialized, and the JSON lines.
+        """
+        return len(self.log), "".join(
+            json.dumps([key, self.entries[key]]) + "\n"
+            for key in self.log[self.nb_flushed:])
+
+    def write_lines(self, version, lines):
+        """Append serialized entries to the file, then mark them as flushed."""
+        if lines:
+            with open(self.path, "a") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        self.nb_flushed = version
+
+    def flush(self):
+        """Append the entries that are not on disk yet.
+
+        Returns:
+            int: The number of written entries.
+        """
+        nb_pending = len(self.log) - self.nb_flushed
+        self.write_lines(*self.get_pending_lines())
+        return nb_pending
+
+    def __len__(self):
+        return len(self.log)
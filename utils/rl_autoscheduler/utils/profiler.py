@@ -0,0 +1,210 @@
+import csv
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+class Profiler:
+    """Records the duration and outcome of the steps of the environment.
+
+    Every span is kept as an event (name, start, duration, thread, outcome and
+    arguments) and aggregated per name. A worker exports its events as a
+    Chrome trace (chrome://tracing or Perfetto), its summary as a CSV file,
+    and can report the summary to the Ray metrics.
+
+    A disabled profiler records nothing, so the instrumentation can stay in the
+    code at a negligible cost.
+
+    Args:
+        enabled (bool, optional): Whether or not to record events. Defaults to False.
+        worker_id (int, optional): The id of the worker, used in the exported file names. Defaults to None, the pid.
+        max_events (int, optional): Maximum number of events kept for the trace, the summary keeps counting beyond. Defaults to 100000.
+    """
+
+    def __init__(self, enabled=False, worker_id=None, max_events=100000):
+        self.enabled = enabled
+        self.worker_id = worker_id if worker_id is not None else os.getpid()
+        self.max_events = max_events
+        self.events = []
+        self.summary = defaultdict(lambda: {
+            "count": 0,
+            "total": 0.0,
+            "max": 0.0,
+            "outcomes": defaultdict(int)
+        })
+        self.origin = time.time()
+        self.lock = threading.Lock()
+        self.metrics = None
+        # Spans not reported to the Ray metrics yet, independently of the
+        # trace cap, once the reports have started
+        self.unreported_events = None
+
+    @contextmanager
+    def span(self, name, **args):
+        """Time a block of code.
+
+        The block can set the outcome of the span, e.g. "cache_hit", through
+        the `outcome` key of the yielded dict, and add arguments through its
+        other keys. An exception sets the outcome to "timeout" or "error" and
+        is raised again.
+
+        Args:
+            name (str): The name of the span, e.g. "compile".
+            **args: Arguments shown with the span in the trace.
+
+        Yields:
+            dict: The record of the span.
+        """
+        record = {"outcome": None}
+        if not self.enabled:
+            yield record
+            return
+        start_time = time.time()
+        try:
+            yield record
+        except Exception as e:
+            record["outcome"] = "timeout" if type(e).__name__ in (
+                "TimeOutException", "TimeoutError") else "error"
+            args["error"] = type(e).__name__
+            raise
+        finally:
+            args.update((key, value) for key, value in record.items()
+                        if key != "outcome")
+            self.add_event(name, start_time,
+                           time.time() - start_time, record["outcome"], **args)
+
+    def add_event(self, name, start_time, duration, outcome=None, **args):
+        """Record a span measured by the caller, e.g. a cache hit of duration 0."""
+        if not self.enabled:
+            return
+        with self.lock:
+            if len(self.events) < self.max_events:
+                self.events.append((name, start_time, duration,
+                                    threading.get_ident(), outcome, args))
+            if self.unreported_events is not None:
+                self.unreported_events.append((name, duration, outcome))
+            summary = self.summary[name]
+            summary["count"] += 1
+            summary["total"] += duration
+            summary["max"] = max(summary["max"], duration)
+            summary["outcomes"][outcome or "ok"] += 1
+
+    def get_summary(self):
+        """Get the statistics of the spans.
+
+        Returns:
+            dict: For each span name, the count, total, mean and max durations in seconds and the number of each outcome.
+        """
+        with self.lock:
+            return {
+                name: {
+                    "count": summary["count"],
+                    "total": summary["total"],
+                    "mean": summary["total"] / summary["count"],
+                    "max": summary["max"],
+                    "outcomes": dict(summary["outcomes"])
+                }
+                for name, summary in self.summary.items()
+            }
+
+    def export_chrome_trace(self, path):
+        with self.lock:
+            events = list(self.events)
+        trace_events = []
+        for name, start_time, duration, thread_id, outcome, args in events:
+            args = dict(args)
+            if outcome is not None:
+                args["outcome"] = outcome
+            trace_events.append({
+                "name": name,
+                "ph": "X",
+                "ts": (start_time - self.origin) * 1e6,
+                "dur": duration * 1e6,
+                "pid": self.worker_id,
+                "tid": thread_id,
+                "args": {key: str(value)
+                         for key, value in args.items()}
+            })
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace_events}, f)
+
+    def export_csv(self, path):
+        summary = self.get_summary()
+        outcomes = sorted(
+            {outcome
+             for stats in summary.values()
+             for outcome in stats["outcomes"]})
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["worker", "name", "count", "total", "mean", "max"] +
+                            outcomes)
+            for name, stats in sorted(summary.items(),
+                                      key=lambda item: -item[1]["total"]):
+                writer.writerow([
+                    self.worker_id, name, stats["count"], stats["total"],
+                    stats["mean"], stats["max"]
+                ] + [stats["outcomes"].get(outcome, 0) for outcome in outcomes])
+
+    def report_ray_metrics(self):
+        """Report the durations recorded since the last report to the Ray
+        metrics, as a histogram per span name and outcome.
+
+        After the first report, every span is queued for the next one even
+        when the trace is full, so the metrics keep flowing beyond max_events.
+        """
+        from ray.util import metrics
+
+        if self.metrics is None:
+            self.metrics = metrics.Histogram(
+                "rl_autoscheduler_span_seconds",
+                description="Duration of the environment steps",
+                boundaries=[0.001, 0.01, 0.1, 1, 10, 60, 300],
+                tag_keys=("name", "outcome", "worker"))
+        with self.lock:
+            if self.unreported_events is None:
+                # The first report covers the spans kept for the trace
+                events = [(name, duration, outcome) for name, _, duration, _,
+                          outcome, _ in self.events]
+            else:
+                events = self.unreported_events
+            self.unreported_events = []
+        for name, duration, outcome in events:
+            self.metrics.observe(duration,
+                                 tags={
+                                     "name": name,
+                                     "outcome": outcome or "ok",
+                                     "worker": str(self.worker_id)
+                                 })
+
+    def dump(self, directory):
+        """Export the trace and the summary of the worker into a directory."""
+        if not self.enabled:
+            return
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, f"worker_{self.worker_id}")
+        self.export_chrome_trace(prefix + "_trace.json")
+        self.export_csv(prefix + "_summary.csv")
+
+
+def get_profiler():
+    """Get the profiler of the process, a disabled one until configure_profiler
+    is called."""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = Profiler()
+        return _profiler
+
+
+def configure_profiler(enabled, worker_id=None):
+    profiler = get_profiler()
+    profiler.enabled = enabled
+    if worker_id is not None:
+        profiler.worker_id = worker_id
+    return profiler
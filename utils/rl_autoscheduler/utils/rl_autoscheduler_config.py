@@ -21,13 +21,33 @@ class RayConfig:
 class EnvironmentConfig:
     dataset_path: str = "../../Dataset_multi/"
     programs_file: str = "./multicomp.json"
+    eval_cache_file: str = "./eval_cache.db"
+    checkpoint_interval: float = 60.0
+    checkpoint_max_pending: int = 1000
+    representation_cache_size: int = 256
+    annotation_store_file: str = "./program_annotations.tsv"
+    workspace_dir: str = ""
+    workspace_max_size: int = 2048
+    profile: bool = False
+    profile_dir: str = "./profiles"
+    profile_dump_interval: int = 10
 
 
 @dataclass
 class TiramisuConfig:
     tiramisu_path: str = "/data/scratch/hbenyamina/tiramisu_rl/"
-    env_type: Literal["model", "cpu"] = "cpu"
+    env_type: Literal["model", "cpu", "hybrid"] = "cpu"
     model_checkpoint: str = "/data/scratch/hbenyamina/model_published_nn_finale.pt"
+    legality_server: bool = False
+    measurement_pool: bool = False
+    nb_compile_workers: int = 4
+    measurement_core_sets: List[str] = field(default_factory=list)
+    measurement_min_executions: int = 2
+    measurement_ci_target: float = 0.02
+    measurement_abort_factor: float = 2.0
+    hybrid_top_k: int = 3
+    hybrid_warmup: int = 2
+    hybrid_max_uncertainty: float = 0.5
     compile_tiramisu_cmd: str = 'printf "Compiling ${FILE_PATH}\n" >> ${FUNC_DIR}log.txt;\
         ${CXX} -I${TIRAMISU_ROOT}/3rdParty/Halide/include -I${TIRAMISU_ROOT}/include -I${TIRAMISU_ROOT}/3rdParty/isl/include  -Wl,--no-as-needed -ldl -g -fno-rtti   -lpthread -std=c++11 -O0 -o ${FILE_PATH}.o -c ${FILE_PATH};\
         ${CXX} -Wl,--no-as-needed -ldl -g -fno-rtti   -lpthread -std=c++11 -O0 ${FILE_PATH}.o -o ./${FILE_PATH}.out   -L${TIRAMISU_ROOT}/build  -L${TIRAMISU_ROOT}/3rdParty/Halide/lib  -L${TIRAMISU_ROOT}/3rdParty/isl/build/lib  -Wl,-rpath,${TIRAMISU_ROOT}/build:${TIRAMISU_ROOT}/3rdParty/Halide/lib:${TIRAMISU_ROOT}/3rdParty/isl/build/lib -ltiramisu -ltiramisu_auto_scheduler -lHalide -lisl'
@@ -35,9 +55,8 @@ class TiramisuConfig:
     run_tiramisu_cmd: str = 'printf "Running ${FILE_PATH}.out\n">> ${FUNC_DIR}log.txt;\
         ./${FILE_PATH}.out>> ${FUNC_DIR}log.txt;'
 
-    compile_wrapper_cmd = 'cd ${FUNC_DIR};\
-            ${GXX} -shared -o ${FUNC_NAME}.o.so ${FUNC_NAME}.o;\
-            ${CXX} -I${TIRAMISU_ROOT}/3rdParty/Halide/include -I${TIRAMISU_ROOT}/include -I${TIRAMISU_ROOT}/3rdParty/isl/include -Wl,--no-as-needed -ldl -g -fno-rtti -lpthread -std=c++11 -O3 -o ${FUNC_NAME}_wrapper ${FUNC_NAME}_wrapper.cpp ./${FUNC_NAME}.o.so -L${TIRAMISU_ROOT}/build  -L${TIRAMISU_ROOT}/3rdParty/Halide/lib  -L${TIRAMISU_ROOT}/3rdParty/isl/build/lib  -Wl,-rpath,${TIRAMISU_ROOT}/build:${TIRAMISU_ROOT}/3rdParty/Halide/lib:${TIRAMISU_ROOT}/3rdParty/isl/build/lib -ltiramisu -ltiramisu_auto_scheduler -lHalide -lisl'
+    compile_harness_cmd = 'cd ${FUNC_DIR};\
+            ${CXX} -I${TIRAMISU_ROOT}/3rdParty/Halide/include -I${TIRAMISU_ROOT}/include -I${TIRAMISU_ROOT}/3rdParty/isl/include -Wl,--no-as-needed -ldl -g -fno-rtti -lpthread -std=c++11 -O3 -o ${FUNC_NAME}_harness ${FUNC_NAME}_harness.cpp -L${TIRAMISU_ROOT}/build  -L${TIRAMISU_ROOT}/3rdParty/Halide/lib  -L${TIRAMISU_ROOT}/3rdParty/isl/build/lib  -Wl,-rpath,${TIRAMISU_ROOT}/build:${TIRAMISU_ROOT}/3rdParty/Halide/lib:${TIRAMISU_ROOT}/3rdParty/isl/build/lib -ltiramisu -ltiramisu_auto_scheduler -lHalide -lisl -ldl'
 
 
 @dataclass
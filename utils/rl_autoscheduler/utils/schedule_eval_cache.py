@@ -0,0 +1,67 @@
+import sqlite3
+import time
+
+
+class ScheduleEvalCache:
+    """Persistent store of measured schedule execution times.
+
+    Entries are content-addressed: the key is the hash of the program source
+    together with the canonical schedule string, so a measurement stays valid
+    across environment resets, worker restarts and dataset copies.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS exec_times (
+                program_hash TEXT NOT NULL,
+                schedule_str TEXT NOT NULL,
+                exec_time REAL NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (program_hash, schedule_str)
+            )""")
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, program_hash, schedule_str):
+        """Look up a measured execution time.
+
+        Args:
+            program_hash (str): The hash of the program source.
+            schedule_str (str): The canonical schedule string.
+
+        Returns:
+            float: The execution time, or None if the schedule was never measured.
+        """
+        row = self.connection.execute(
+            "SELECT exec_time FROM exec_times WHERE program_hash = ? AND schedule_str = ?",
+            (program_hash, schedule_str)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, program_hash, schedule_str, exec_time):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO exec_times VALUES (?, ?, ?, ?)",
+            (program_hash, schedule_str, float(exec_time), time.time()))
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM exec_times").fetchone()[0]
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+        }
+
+    def close(self):
+        self.connection.close()